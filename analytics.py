@@ -0,0 +1,254 @@
+import threading
+from datetime import date, datetime
+
+import numpy as np
+
+from book_management import EPOCH, MICROSECOND
+
+DAY = 86_400_000_000  # microseconds
+DEFAULT_LOAN_DAYS = 14
+
+
+class _Column:
+    """
+    A NumPy array that grows by doubling as values are appended.
+    """
+
+    __slots__ = ("data", "size")
+
+    def __init__(self, dtype):
+        self.data = np.zeros(1024, dtype=dtype)
+        self.size = 0
+
+    def append(self, value):
+        if self.size == len(self.data):
+            grown = np.zeros(2 * len(self.data), dtype=self.data.dtype)
+            grown[:self.size] = self.data
+            self.data = grown
+        self.data[self.size] = value
+        self.size += 1
+        return self.size - 1
+
+    def view(self):
+        return self.data[:self.size]
+
+
+class CirculationAnalytics:
+    """
+    Circulation statistics over a BookList and Loans, computed with
+    vectorised NumPy reductions over column arrays.
+
+    The catalog is held as one row per book (publisher code, copies,
+    available copies) and current loans as one row per loan (book row, due
+    date). Both tables are built once and then kept up to date from the
+    collections' change events, so a report never rescans the Python
+    objects. Rows of removed books and returned loans are masked out and
+    their slots reused. Loans that already existed when the tables were
+    built are counted as borrowed DEFAULT_LOAN_DAYS before they fall due.
+    """
+
+    def __init__(self, book_list, loans):
+        """
+        Initialize a new CirculationAnalytics instance and start following
+        changes to book_list and loans.
+        """
+        self.book_list = book_list
+        self.loans = loans
+        self._lock = threading.Lock()
+        self.publishers = []  # publisher names by code
+        self._publisher_codes = {}
+        self._book_rows = {}  # {book_id: row}
+        self._free_book_rows = []
+        self._publisher = _Column(np.int32)
+        self._num_copies = _Column(np.int32)
+        self._available = _Column(np.int32)
+        self._book_active = _Column(np.bool_)
+        self._loan_rows = {}  # {(username, book_id): row}
+        self._free_loan_rows = []
+        self._loan_book = _Column(np.int32)
+        self._loan_due = _Column(np.int64)
+        self._loan_active = _Column(np.bool_)
+        self._borrow_days = _Column(np.int32)  # day ordinal of every loan made
+
+        book_list.add_observer(self._on_book_event)
+        loans.add_observer(self._on_loan_event)
+        with self._lock:
+            for book in list(book_list.books.values()):
+                self._put_book(book)
+            for username, book_id, due_date in loans.snapshot()[0]:
+                self._put_loan(username, book_id, due_date, None)
+
+    def close(self):
+        """
+        Stop following changes to the collections.
+        """
+        self.book_list.remove_observer(self._on_book_event)
+        self.loans.remove_observer(self._on_loan_event)
+
+    # Table maintenance
+
+    def _publisher_code(self, publisher):
+        """Return the code of a publisher name, assigning one on first sight."""
+        code = self._publisher_codes.get(publisher)
+        if code is None:
+            code = self._publisher_codes[publisher] = len(self.publishers)
+            self.publishers.append(publisher)
+        return code
+
+    def _put_book(self, book):
+        """Write a book's row, adding the row if the book is new."""
+        row = self._book_rows.get(book.book_id)
+        values = (self._publisher_code(book.publisher), book.num_copies, book.available_copies, True)
+        columns = (self._publisher, self._num_copies, self._available, self._book_active)
+        if row is None:
+            if self._free_book_rows:
+                row = self._free_book_rows.pop()
+            else:
+                for column in columns:
+                    row = column.append(0)
+            self._book_rows[book.book_id] = row
+        for column, value in zip(columns, values):
+            column.data[row] = value
+
+    def _drop_book(self, book_id):
+        """Mask out a removed book's row, detach its loans and free the row for reuse."""
+        row = self._book_rows.pop(book_id, None)
+        if row is not None:
+            self._book_active.data[row] = False
+            loan_books = self._loan_book.view()
+            loan_books[loan_books == row] = -1
+            self._free_book_rows.append(row)
+
+    def _refresh_available(self, book_id):
+        """Copy a book's available copies into its row."""
+        row = self._book_rows.get(book_id)
+        book = self.book_list.books.get(book_id)
+        if row is not None and book is not None:
+            self._available.data[row] = book.available_copies
+
+    def _put_loan(self, username, book_id, due_date, borrowed_on):
+        """Add a current loan unless it is already recorded."""
+        key = (username, book_id)
+        if key in self._loan_rows:
+            return
+        book_row = self._book_rows.get(book_id, -1)
+        due = (due_date - EPOCH) // MICROSECOND
+        if self._free_loan_rows:
+            row = self._free_loan_rows.pop()
+        else:
+            for column in (self._loan_book, self._loan_due, self._loan_active):
+                row = column.append(0)
+        self._loan_book.data[row] = book_row
+        self._loan_due.data[row] = due
+        self._loan_active.data[row] = True
+        self._loan_rows[key] = row
+        if borrowed_on is None:
+            borrowed_on = date.fromordinal(due_date.toordinal() - DEFAULT_LOAN_DAYS)
+        self._borrow_days.append(borrowed_on.toordinal())
+
+    def _drop_loan(self, username, book_id):
+        """Mask out a returned loan's row and free it for reuse."""
+        row = self._loan_rows.pop((username, book_id), None)
+        if row is not None:
+            self._loan_active.data[row] = False
+            self._free_loan_rows.append(row)
+
+    def _on_book_event(self, event, data):
+        with self._lock:
+            if event == "add_book":
+                self._put_book(data["book"])
+            elif event == "remove_book":
+                self._drop_book(data["book_id"])
+            elif event == "update_book" and data["field"] in ("publisher", "num_copies"):
+                book = self.book_list.books.get(data["book_id"])
+                if book is not None:
+                    self._put_book(book)
+
+    def _on_loan_event(self, event, data):
+        with self._lock:
+            today = date.today()
+            if event == "borrow_book":
+                self._put_loan(data["username"], data["book_id"], data["due_date"], today)
+                self._refresh_available(data["book_id"])
+            elif event == "return_book":
+                self._drop_loan(data["username"], data["book_id"])
+                self._refresh_available(data["book_id"])
+            elif event in ("borrow_many", "return_many"):
+                for username, book_id in data["loans"]:
+                    if event == "borrow_many":
+                        self._put_loan(username, book_id, data["due_date"], today)
+                    else:
+                        self._drop_loan(username, book_id)
+                for book_id in {book_id for _, book_id in data["loans"]}:
+                    self._refresh_available(book_id)
+
+    # Reports
+
+    def _current_loans(self, now):
+        """Return the publisher code and microseconds overdue of every current loan of a known book."""
+        book_rows = self._loan_book.view()
+        mask = self._loan_active.view() & (book_rows >= 0)
+        book_rows = book_rows[mask]
+        now_us = ((now or datetime.now()) - EPOCH) // MICROSECOND
+        return self._publisher.view()[book_rows], now_us - self._loan_due.view()[mask]
+
+    def get_loans_per_day(self, start_date=None, end_date=None):
+        """
+        Return {date: number of loans made that day}, oldest first, optionally
+        limited to the days between start_date and end_date (inclusive).
+        """
+        with self._lock:
+            days = self._borrow_days.view()
+            if start_date is not None:
+                days = days[days >= start_date.toordinal()]
+            if end_date is not None:
+                days = days[days <= end_date.toordinal()]
+            values, counts = np.unique(days, return_counts=True)
+        return {date.fromordinal(int(day)): int(count) for day, count in zip(values, counts)}
+
+    def get_overdue_rate_by_publisher(self, now=None):
+        """
+        Return {publisher: share of its current loans that are overdue} for
+        every publisher with at least one book on loan.
+        """
+        with self._lock:
+            publishers, overdue_by = self._current_loans(now)
+            width = len(self.publishers)
+            totals = np.bincount(publishers, minlength=width)
+            overdue = np.bincount(publishers, weights=overdue_by > 0, minlength=width)
+            names = list(self.publishers)
+        return {names[code]: float(overdue[code] / totals[code]) for code in np.flatnonzero(totals)}
+
+    def get_average_days_overdue(self, now=None):
+        """
+        Return the mean number of days by which overdue loans are late, or 0.0 if none are.
+        """
+        with self._lock:
+            _, overdue_by = self._current_loans(now)
+            late = overdue_by[overdue_by > 0]
+        return float(late.mean() / DAY) if len(late) else 0.0
+
+    def get_utilisation(self):
+        """
+        Return the share of all copies that are on loan (1 - available / copies).
+        """
+        with self._lock:
+            active = self._book_active.view()
+            copies = int(self._num_copies.view()[active].sum())
+            available = int(self._available.view()[active].sum())
+        return (copies - available) / copies if copies else 0.0
+
+    def get_utilisation_by_publisher(self):
+        """
+        Return {publisher: share of its copies that are on loan} for every
+        publisher with at least one copy.
+        """
+        with self._lock:
+            active = self._book_active.view()
+            publishers = self._publisher.view()[active]
+            width = len(self.publishers)
+            copies = np.bincount(publishers, weights=self._num_copies.view()[active], minlength=width)
+            available = np.bincount(publishers, weights=self._available.view()[active], minlength=width)
+            names = list(self.publishers)
+        return {names[code]: float((copies[code] - available[code]) / copies[code])
+                for code in np.flatnonzero(copies)}
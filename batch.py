@@ -0,0 +1,149 @@
+import json
+import shlex
+import sys
+
+# Short command names: (service operation, positional parameters). Any other
+# service operation can be called by name, with key=value parameters.
+COMMANDS = {
+    "add-book": ("add_book", ("title", "author", "year", "publisher", "num_copies", "publication_date")),
+    "add-user": ("add_user", ("username", "firstname", "surname", "house_number", "street_name", "postcode",
+                              "email", "date_of_birth")),
+    "remove-book": ("remove_book", ("title",)),
+    "remove-user": ("remove_user", ("firstname",)),
+    "book": ("get_book", ("book_id",)),
+    "user": ("get_user", ("username",)),
+    "search": ("search_book", ("query", "search_type")),
+    "borrow": ("borrow_book", ("username", "book_id", "days")),
+    "return": ("return_book", ("username", "book_id")),
+    "hold": ("place_hold", ("username", "book_id", "priority")),
+    "cancel-hold": ("cancel_hold", ("username", "book_id")),
+    "loans": ("user_loans", ("username",)),
+    "holders": ("book_holders", ("book_id",)),
+    "overdue": ("overdue_books", ()),
+    "due-within": ("books_due_within", ("days",)),
+}
+INT_PARAMS = frozenset(("year", "num_copies", "days", "priority", "limit", "offset", "k", "n"))
+BOOL_PARAMS = frozenset(("descending", "available", "reset"))
+
+
+def _decode(key, value):
+    """Convert a command argument to the type its parameter expects."""
+    if key in INT_PARAMS:
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError(f"{key} must be an integer")
+    if key in BOOL_PARAMS:
+        if value.lower() not in ("true", "false", "yes", "no", "1", "0"):
+            raise ValueError(f"{key} must be true or false")
+        return value.lower() in ("true", "yes", "1")
+    if value[:1] in ("[", "{"):
+        try:
+            return json.loads(value)
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON for {key}: {e}")
+    return value
+
+
+def parse_command(line):
+    """
+    Turn a command line such as 'borrow alice BK00001 days=7' into an
+    (operation, params) pair for LibraryService.execute. Arguments are split
+    like a shell would, so quote values that contain spaces.
+    """
+    words = shlex.split(line)
+    name = words[0]
+    if name in COMMANDS:
+        operation, names = COMMANDS[name]
+    else:
+        operation, names = name.replace("-", "_"), ()
+    params = {}
+    positional = []
+    for word in words[1:]:
+        key, sep, value = word.partition("=")
+        if sep and key.isidentifier():
+            params[key] = _decode(key, value)
+        else:
+            positional.append(word)
+    if len(positional) > len(names):
+        raise ValueError(f"Too many arguments for {name}")
+    for key, value in zip(names, positional):
+        params[key] = _decode(key, value)
+    return operation, params
+
+
+def _run_line(service, number, line):
+    """Yield the response to each request on a line: a command, a JSON request or a JSON array of them."""
+    if line[0] in "{[":
+        try:
+            requests = json.loads(line)
+        except ValueError as e:
+            yield {"line": number, "op": None, "ok": False, "error": f"Invalid JSON: {e}"}
+            return
+        for request in requests if isinstance(requests, list) else [requests]:
+            operation = request.get("op") if isinstance(request, dict) else None
+            yield {"line": number, "op": operation, **service.handle(request)}
+        return
+    response = {"line": number, "op": None}
+    try:
+        operation, params = parse_command(line)
+        response["op"] = operation
+        response["result"] = service.execute(operation, params)
+        response["ok"] = True
+    except ValueError as e:
+        response["ok"] = False
+        response["error"] = str(e)
+    except Exception as e:
+        response["ok"] = False
+        response["error"] = f"{type(e).__name__}: {e}"
+    yield response
+
+
+def run_batch(service, lines, out, stop_on_error=False):
+    """
+    Run one command per line against a LibraryService and write one JSON
+    response per command to out; a command that fails is reported and the
+    batch carries on. Lines may also hold JSON requests as sent to the
+    network server, or a JSON array of them, answered one line each; blank
+    lines and lines starting with # are skipped. Every response names its
+    line and operation. Returns the number of commands that failed.
+    """
+    failed = 0
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        for response in _run_line(service, number, line):
+            out.write(json.dumps(response, separators=(",", ":")) + "\n")
+            if not response["ok"]:
+                failed += 1
+                if stop_on_error:
+                    return failed
+    return failed
+
+
+def run_batch_file(service, path, stop_on_error=False):
+    """
+    Run the commands in a file, or on standard input if path is "-",
+    writing the responses to standard output. Returns the number of
+    commands that failed.
+    """
+    if path == "-":
+        return run_batch(service, sys.stdin, sys.stdout, stop_on_error)
+    with open(path, encoding="utf-8") as f:
+        return run_batch(service, f, sys.stdout, stop_on_error)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run library commands from a file or standard input")
+    parser.add_argument("file", help="command file, or - for standard input")
+    parser.add_argument("--data-dir", help="directory for the durable write-ahead log and snapshots")
+    parser.add_argument("--compact", action="store_true", help="keep loans in the compact array-backed table")
+    parser.add_argument("--metrics", action="store_true", help="print operation call counts and latencies on exit")
+    parser.add_argument("--sqlite", help="keep books, users and loans in this SQLite database file")
+    parser.add_argument("--stop-on-error", action="store_true", help="stop at the first command that fails")
+    args = parser.parse_args()
+    from book_management import main
+    failed = main(args.data_dir, args.compact, args.metrics, args.sqlite, args.file, args.stop_on_error)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,470 @@
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from book_management import Book, BookList, Loans, User, UserList
+
+SIZES = {
+    "small": (10_000, 2_000, 5_000),
+    "medium": (100_000, 20_000, 50_000),
+    "large": (1_000_000, 200_000, 500_000),
+    "huge": (10_000_000, 2_000_000, 5_000_000),
+}
+SETUP_ATTEMPTS = 10_000  # random picks a scenario setup may try before giving up
+
+WORDS = ("the", "of", "and", "night", "river", "house", "garden", "secret", "history", "war", "peace",
+         "love", "shadow", "winter", "summer", "city", "stone", "fire", "water", "king", "queen",
+         "island", "journey", "silent", "golden", "last", "first", "dark", "light", "world",
+         "ocean", "mountain", "forest", "glass", "iron", "memory", "letters", "children", "song")
+FIRST_NAMES = ("Alice", "Ben", "Chloe", "Daniel", "Emma", "Farah", "George", "Hannah", "Isaac", "Jade",
+               "Kamal", "Laura", "Mohammed", "Nina", "Oliver", "Priya", "Quentin", "Rosa", "Sam", "Tara")
+SURNAMES = ("Smith", "Jones", "Taylor", "Brown", "Williams", "Wilson", "Johnson", "Davies", "Patel",
+            "Robinson", "Wright", "Thompson", "Evans", "Walker", "White", "Roberts", "Green", "Hall")
+PUBLISHERS = ("Penguin", "HarperCollins", "Macmillan", "Hachette", "Bloomsbury", "Faber", "Vintage",
+              "Random House", "Orion", "Pan", "Headline", "Little Brown")
+
+
+def _title(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))).capitalize()
+
+
+def make_book(rng):
+    """
+    Return a random Book.
+    """
+    day = datetime(1900, 1, 1) + timedelta(days=rng.randrange(45_000))
+    author = f"{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)}"
+    return Book(_title(rng), author, day.year, rng.choice(PUBLISHERS), rng.randint(1, 5), day)
+
+
+def make_user(rng, username, firstname=None):
+    """
+    Return a random User with the given username.
+    """
+    firstname = firstname or rng.choice(FIRST_NAMES)
+    surname = rng.choice(SURNAMES)
+    postcode = f"{rng.choice('ABCEHLMNSW')}{rng.randint(1, 20)} {rng.randint(1, 9)}{rng.choice('ABDEFGHJ')}{rng.choice('LNPQRSTUWXYZ')}"
+    return User(username, firstname, surname, str(rng.randint(1, 200)), f"{rng.choice(WORDS).capitalize()} Street",
+                postcode, f"{username}@example.com", datetime(1940, 1, 1) + timedelta(days=rng.randrange(25_000)))
+
+
+def generate_library(num_books, num_users, num_loans, seed=0, compact=False):
+    """
+    Build a reproducible library: the same seed always gives the same books,
+    users and loans. About a tenth of the loans are overdue.
+    """
+    rng = random.Random(seed)
+    book_list, user_list, loans = BookList(), UserList(), Loans(compact=compact)
+    book_list.add_books(make_book(rng) for _ in range(num_books))
+    user_list.add_users(make_user(rng, f"user{i}") for i in range(num_users))
+    books = list(book_list.books.values())
+    users = list(user_list.users.values())
+    made = 0
+    attempts = 0
+    while made < num_loans and attempts < num_loans * 3 and books and users:
+        attempts += 1
+        try:
+            loans.borrow_book(rng.choice(users), rng.choice(books), days=rng.randint(-14, 126))
+        except ValueError:
+            continue
+        made += 1
+    return book_list, user_list, loans
+
+
+def percentile(sorted_values, fraction):
+    """
+    Return the value at a fraction (0-1) of a sorted list, by nearest rank.
+    """
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def time_scenario(setup, operation, iterations):
+    """
+    Run operation(*setup()) iterations times, timing only the operation, and
+    return latency statistics in microseconds plus the last result size.
+    """
+    latencies = []
+    size = None
+    for _ in range(iterations):
+        args = setup()
+        start = time.perf_counter_ns()
+        result = operation(*args)
+        latencies.append((time.perf_counter_ns() - start) / 1000)
+        if isinstance(result, (list, tuple)):
+            size = len(result)
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        "iterations": iterations,
+        "mean_us": total / iterations,
+        "p50_us": percentile(latencies, 0.50),
+        "p90_us": percentile(latencies, 0.90),
+        "p99_us": percentile(latencies, 0.99),
+        "max_us": latencies[-1],
+        "ops_per_second": iterations / (total / 1_000_000) if total else None,
+        "result_size": size,
+    }
+
+
+def peak_bytes(setup, operation):
+    """
+    Run operation(*setup()) once more, tracing memory only from the end of
+    the setup, and return the peak number of bytes the operation allocated.
+    """
+    args = setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        operation(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def scenarios(book_list, user_list, loans, rng):
+    """
+    Return {name: (setup, operation)} covering the public BookList, UserList and Loans methods.
+    """
+    books = list(book_list.books.values())
+    users = list(user_list.users.values())
+    counter = iter(range(10 ** 12))
+    no_args = lambda: ()
+
+    def fresh_book():
+        return (make_book(rng),)
+
+    def removable_book():
+        book = make_book(rng)
+        book.set_title(f"Benchmark removal {next(counter)}")
+        book_list.add_book(book)
+        return (book.get_title(),)
+
+    def removable_user():
+        name = f"Benchmark{next(counter)}"
+        user_list.add_user(make_user(rng, f"bench_{name}", firstname=name))
+        return (name,)
+
+    def borrowable():
+        for _ in range(SETUP_ATTEMPTS):
+            user, book = rng.choice(users), rng.choice(books)
+            if book.get_available_copies() > 0 and book.book_id not in loans.loans.get(user.get_username(), {}):
+                return user, book
+        raise ValueError(f"No borrowable book found in {SETUP_ATTEMPTS} random picks")
+
+    def borrowed():
+        user, book = borrowable()
+        loans.borrow_book(user, book)
+        return user, book
+
+    def borrowable_batch():
+        batch, chosen = [], set()
+        for _ in range(SETUP_ATTEMPTS):
+            user, book = borrowable()
+            if book not in chosen:
+                chosen.add(book)
+                batch.append((user, book))
+                if len(batch) == 10:
+                    return (batch,)
+        raise ValueError(f"Fewer than 10 distinct borrowable books found in {SETUP_ATTEMPTS} random picks")
+
+    def borrowed_batch():
+        (batch,) = borrowable_batch()
+        loans.borrow_many(batch)
+        return (batch,)
+
+    def unavailable_book():
+        book = rng.choice(books)
+        for _ in range(SETUP_ATTEMPTS):
+            if book.get_available_copies() == 0:
+                return book
+            try:
+                loans.borrow_book(rng.choice(users), book)
+            except ValueError:
+                pass
+        raise ValueError(f"Could not lend every copy of {book.book_id} in {SETUP_ATTEMPTS} random picks")
+
+    def has_hold(user, book):
+        try:
+            loans.get_hold_position(user, book)
+        except ValueError:
+            return False
+        return True
+
+    def holdable():
+        book = unavailable_book()
+        for _ in range(SETUP_ATTEMPTS):
+            user = rng.choice(users)
+            if book.book_id not in loans.loans.get(user.get_username(), {}) and not has_hold(user, book):
+                return user, book
+        raise ValueError(f"No user without a loan or hold on {book.book_id} found in {SETUP_ATTEMPTS} random picks")
+
+    def held():
+        user, book = holdable()
+        loans.place_hold(user, book)
+        return user, book
+
+    def uncached(setup):
+        # Emptying the cache in the untimed setup makes every timed search a cache miss.
+        def cold():
+            book_list._search_cache.clear()
+            return setup()
+        return cold
+
+    def word():
+        return (rng.choice(WORDS),)
+
+    def prefix():
+        return (rng.choice(WORDS)[:3],)
+
+    def rare_title():
+        return (rng.choice(books).get_title(),)
+
+    def a_user():
+        return (rng.choice(users),)
+
+    return {
+        "BookList.add_book": (fresh_book, book_list.add_book),
+        "BookList.add_books[100]": (lambda: ([make_book(rng) for _ in range(100)],), book_list.add_books),
+        "BookList.search_book[title]": (word, lambda q: book_list.search_book(q, "title")),
+        "BookList.search_book[title,uncached]": (uncached(word), lambda q: book_list.search_book(q, "title")),
+        "BookList.search_book[title,rare]": (rare_title, lambda q: book_list.search_book(q, "title")),
+        "BookList.search_book[title,rare,uncached]": (uncached(rare_title),
+                                                      lambda q: book_list.search_book(q, "title")),
+        "BookList.search_book[author]": (lambda: (rng.choice(SURNAMES),), lambda q: book_list.search_book(q, "author")),
+        "BookList.search_book[author,uncached]": (uncached(lambda: (rng.choice(SURNAMES),)),
+                                                  lambda q: book_list.search_book(q, "author")),
+        "BookList.search_book[publisher]": (lambda: (rng.choice(PUBLISHERS),),
+                                            lambda q: book_list.search_book(q, "publisher")),
+        "BookList.search_book[publisher,uncached]": (uncached(lambda: (rng.choice(PUBLISHERS),)),
+                                                     lambda q: book_list.search_book(q, "publisher")),
+        "BookList.search_book[publication_date]": (
+            lambda: (rng.choice(books).get_publication_date().strftime("%Y-%m-%d"),),
+            lambda q: book_list.search_book(q, "publication_date")),
+        "BookList.search_book_page[title,20]": (word, lambda q: book_list.search_book_page(q, "title", 20,
+                                                                                          order_by="title")[0]),
+        "BookList.search_book_page[title,20,uncached]": (uncached(word), lambda q: book_list.search_book_page(
+            q, "title", 20, order_by="title")[0]),
+        "BookList.iter_search_book[title,20,uncached]": (uncached(word), lambda q: list(book_list.iter_search_book(
+            q, "title", limit=20))),
+        "BookList.search_book_regex[title]": (lambda: (rf"\b{rng.choice(WORDS)}\b",),
+                                              lambda pattern: book_list.search_book_regex(pattern, "title")),
+        "BookList.find_books[author,available]": (lambda: (rng.choice(SURNAMES),),
+                                                  lambda q: list(book_list.find_books(author=q, available=True))),
+        "BookList.find_books[title,dates]": (
+            lambda: (rng.choice(WORDS), datetime(rng.randint(1900, 2010), 1, 1)),
+            lambda q, start: list(book_list.find_books(title=q, start_date=start,
+                                                       end_date=start + timedelta(days=3650)))),
+        "BookList.typeahead[title]": (prefix, lambda p: book_list.typeahead(p, "title")),
+        "BookList.typeahead[author,year]": (lambda: (rng.choice(FIRST_NAMES)[:2],),
+                                              lambda p: book_list.typeahead(p, "author", rank_by="year")),
+        "BookList.remove_book": (removable_book, book_list.remove_book),
+        "BookList.get_total_books": (no_args, book_list.get_total_books),
+        "BookList.get_copy_totals[publisher]": (lambda: ("publisher", rng.choice(PUBLISHERS)), book_list.get_copy_totals),
+        "BookList.get_books_published_between": (
+            lambda: (datetime(rng.randint(1900, 2020), 1, 1), datetime(rng.randint(1900, 2020), 12, 31)),
+            book_list.get_books_published_between),
+        "BookList.get_books_published_in_year": (lambda: (rng.randint(1900, 2020),),
+                                                 book_list.get_books_published_in_year),
+        "BookList.get_newest_books": (lambda: (20,), book_list.get_newest_books),
+        "Book.set_title": (lambda: (rng.choice(books), _title(rng)), lambda book, title: book.set_title(title)),
+        "UserList.add_user": (lambda: (make_user(rng, f"bench_user{next(counter)}"),), user_list.add_user),
+        "UserList.remove_user": (removable_user, user_list.remove_user),
+        "UserList.find_users": (lambda: (rng.choice(FIRST_NAMES), rng.choice(SURNAMES)),
+                                lambda first, last: user_list.find_users(firstname=first, surname=last)),
+        "UserList.get_user_count": (no_args, user_list.get_user_count),
+        "UserList.get_user_by_username": (lambda: (rng.choice(users).get_username(),),
+                                          user_list.get_user_by_username),
+        "Loans.borrow_book": (borrowable, loans.borrow_book),
+        "Loans.return_book": (borrowed, loans.return_book),
+        "Loans.borrow_many[10]": (borrowable_batch, loans.borrow_many),
+        "Loans.return_many[10]": (borrowed_batch, loans.return_many),
+        "Loans.get_user_loan_count": (a_user, loans.get_user_loan_count),
+        "Loans.get_book_holders": (lambda: (rng.choice(books),), loans.get_book_holders),
+        "Loans.place_hold": (holdable, loans.place_hold),
+        "Loans.cancel_hold": (held, loans.cancel_hold),
+        "Loans.get_hold_position": (held, loans.get_hold_position),
+        "Loans.get_overdue_books": (lambda: (user_list,), loans.get_overdue_books),
+        "Loans.get_books_due_within": (lambda: (3, user_list), loans.get_books_due_within),
+    }
+
+
+def _copies_on_loan(loans, books):
+    """Return {book: number of copies currently on loan} for the given books."""
+    by_id = {book.book_id: book for book in books}
+    held = dict.fromkeys(books, 0)
+    for books_held in loans.loans.values():
+        for book_id in books_held:
+            if book_id in by_id:
+                held[by_id[book_id]] += 1
+    return held
+
+
+def concurrent_loans_check(book_list, user_list, loans, threads=8, operations=2_000, seed=0):
+    """
+    Hammer borrow_book/return_book from several threads, then verify that no
+    book is over-lent: for every book, available copies plus copies on loan
+    must equal its number of copies, and available copies never go negative.
+    """
+    books = list(book_list.books.values())[:200]
+    users = list(user_list.users.values())[:500]
+    before = {book: book.get_available_copies() + held for book, held in _copies_on_loan(loans, books).items()}
+
+    def worker(worker_seed):
+        rng = random.Random(worker_seed)
+        for _ in range(operations):
+            user, book = rng.choice(users), rng.choice(books)
+            try:
+                if rng.random() < 0.6:
+                    loans.borrow_book(user, book)
+                else:
+                    loans.return_book(user, book)
+            except ValueError:
+                pass
+
+    workers = [threading.Thread(target=worker, args=(seed + i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    held = _copies_on_loan(loans, books)
+    violations = [book.book_id for book in books
+                  if book.get_available_copies() < 0
+                  or book.get_available_copies() + held[book] != before[book]]
+    return {
+        "threads": threads,
+        "operations": threads * operations,
+        "ops_per_second": threads * operations / elapsed,
+        "invariant_violations": violations,
+    }
+
+
+def _rss_kib():
+    """Return the peak resident set size in KiB, where the platform reports it."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_benchmarks(num_books, num_users, num_loans, seed=0, iterations=200, compact=False, only=None):
+    """
+    Generate a library and run every scenario, returning a JSON-serialisable
+    report. A scenario whose setup cannot find suitable data is reported
+    with an error instead of timings.
+    """
+    gc.collect()
+    start = time.perf_counter()
+    book_list, user_list, loans = generate_library(num_books, num_users, num_loans, seed, compact)
+    generation_seconds = time.perf_counter() - start
+    library_rss_kib = _rss_kib()
+
+    rng = random.Random(seed + 1)
+    results = {}
+    for name, (setup, operation) in scenarios(book_list, user_list, loans, rng).items():
+        if only and not any(pattern in name for pattern in only):
+            continue
+        try:
+            results[name] = time_scenario(setup, operation, iterations)
+            results[name]["peak_bytes"] = peak_bytes(setup, operation)
+        except ValueError as e:
+            results[name] = {"error": str(e)}
+    if not only or any(pattern in "Loans.concurrent_borrow_return" for pattern in only):
+        results["Loans.concurrent_borrow_return"] = concurrent_loans_check(book_list, user_list, loans, seed=seed)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": seed,
+            "books": num_books,
+            "users": num_users,
+            "loans": num_loans,
+            "iterations": iterations,
+            "compact": compact,
+        },
+        "generation_seconds": generation_seconds,
+        "memory": {"library_rss_kib": library_rss_kib, "peak_rss_kib": _rss_kib()},
+        "results": results,
+    }
+
+
+def compare(report, baseline, threshold=1.25):
+    """
+    Return a list of (scenario, baseline p50, current p50) whose median
+    latency grew by more than the threshold factor.
+    """
+    regressions = []
+    for name, current in report["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous or "p50_us" not in current or not previous.get("p50_us"):
+            continue
+        if current["p50_us"] > previous["p50_us"] * threshold:
+            regressions.append((name, previous["p50_us"], current["p50_us"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the library operations on a synthetic library")
+    parser.add_argument("--size", choices=sorted(SIZES), default="small",
+                        help="preset library size (10k, 100k, 1M or 10M books)")
+    parser.add_argument("--books", type=int)
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--loans", type=int)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--compact", action="store_true", help="use the compact loan table")
+    parser.add_argument("--only", action="append", help="run only scenarios whose name contains this text")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--baseline", help="compare against an earlier JSON report")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="flag scenarios whose p50 latency grew by more than this factor")
+    args = parser.parse_args()
+
+    books, users, loans = SIZES[args.size]
+    report = run_benchmarks(args.books or books, args.users or users, args.loans or loans,
+                            args.seed, args.iterations, args.compact, args.only)
+
+    print(f"{'scenario':45} {'p50 us':>10} {'p90 us':>10} {'p99 us':>10} {'ops/s':>12} {'peak KB':>10}")
+    for name, result in report["results"].items():
+        if "p50_us" in result:
+            print(f"{name:45} {result['p50_us']:10.1f} {result['p90_us']:10.1f} {result['p99_us']:10.1f} "
+                  f"{result['ops_per_second']:12.0f} {result['peak_bytes'] / 1e3:10.1f}")
+        elif "error" in result:
+            print(f"{name:45} skipped: {result['error']}")
+        else:
+            status = "OK" if not result["invariant_violations"] else f"VIOLATED {result['invariant_violations']}"
+            print(f"{name:45} {result['ops_per_second']:12.0f} ops/s over {result['threads']} threads, invariants {status}")
+    print(f"library: {report['memory']['library_rss_kib'] / 1e3:.1f} MB peak RSS after generation, "
+          f"generated in {report['generation_seconds']:.1f}s")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    failed = bool(report["results"].get("Loans.concurrent_borrow_return", {}).get("invariant_violations"))
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: p50 {before:.1f}us -> {after:.1f}us")
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,57 +1,219 @@
-import random
+import heapq
+import re
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from itertools import islice
+
+class Observable:
+    """
+    Mixin for collections that tell registered observers about every change.
+    """
+
+    def add_observer(self, callback):
+        """
+        Register a callback(event, data) to be called after every change.
+        """
+        self._observers.append(callback)
+
+    def remove_observer(self, callback):
+        """
+        Unregister a previously added callback.
+        """
+        self._observers.remove(callback)
+
+    def _notify(self, event, **data):
+        """Pass a change event on to the registered observers."""
+        for callback in self._observers:
+            callback(event, data)
+
+class IdBlock:
+    """
+    A contiguous range of book IDs reserved from a BookIdAllocator. A block
+    is independent of its allocator, so an ingest worker (thread or process)
+    can hand out its IDs without any coordination.
+    """
+
+    def __init__(self, prefix, width, start, end):
+        """
+        Initialize a new IdBlock covering numbers start to end - 1.
+        """
+        self.prefix = prefix
+        self.width = width
+        self.start = start
+        self.end = end
+        self._next = start
+
+    def remaining(self):
+        """
+        Return how many IDs are left in the block.
+        """
+        return self.end - self._next
+
+    def next_id(self):
+        """
+        Return the next unused ID in the block.
+        """
+        if self._next >= self.end:
+            raise ValueError("ID block is exhausted")
+        number = self._next
+        self._next += 1
+        return f"{self.prefix}{number:0{self.width}d}"
+
+class BookIdAllocator:
+    """
+    Issues dense, monotonic book IDs (BK00001, BK00002, ...). Thread-safe.
+    Workers can reserve blocks of IDs up front, and observe() moves the
+    counter past IDs loaded from persisted state so they are never reissued.
+    """
+
+    def __init__(self, prefix="BK", width=5, start=1):
+        """
+        Initialize a new BookIdAllocator instance.
+        """
+        self.prefix = prefix
+        self.width = width
+        self._next = start
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        """
+        Return a new, never before issued book ID.
+        """
+        with self._lock:
+            number = self._next
+            self._next += 1
+        return f"{self.prefix}{number:0{self.width}d}"
+
+    def reserve(self, count):
+        """
+        Reserve count consecutive IDs and return them as an IdBlock.
+        """
+        if not isinstance(count, int) or count < 1:
+            raise ValueError("Count must be a positive integer")
+        with self._lock:
+            start = self._next
+            self._next += count
+        return IdBlock(self.prefix, self.width, start, start + count)
+
+    def number(self, book_id):
+        """
+        Return the numeric part of an ID issued with this prefix, or None.
+        """
+        digits = book_id[len(self.prefix):]
+        if book_id.startswith(self.prefix) and digits.isdigit():
+            return int(digits)
+        return None
+
+    def observe(self, book_id):
+        """
+        Make sure an existing book ID is never issued again.
+        """
+        number = self.number(book_id)
+        if number is not None:
+            self.advance(number + 1)
+
+    def advance(self, number):
+        """
+        Make sure the next issued ID is numbered at least number.
+        """
+        if number > self._next:
+            with self._lock:
+                self._next = max(self._next, number)
+
+    def peek(self):
+        """
+        Return the number the next issued ID will have.
+        """
+        return self._next
 
 class Book:
     """
     Represents a book in the library system.
     """
 
-    def __init__(self, title, author, year, publisher, num_copies, publication_date):
+    __slots__ = ("_book_list", "book_id", "title", "author", "year", "publisher",
+                 "num_copies", "publication_date", "available_copies", "times_borrowed")
+
+    id_allocator = BookIdAllocator()
+
+    def __init__(self, title, author, year, publisher, num_copies, publication_date, book_id=None,
+                 id_allocator=None):
         """
-        Initialize a new Book instance.
+        Initialize a new Book instance. Unless an ID is given, a new one is
+        allocated, from id_allocator if given and the class-wide allocator
+        otherwise, once the other fields are valid, so rejected books use up
+        no IDs; a given ID is never allocated to another book afterwards.
         """
-        self.book_id = self._generate_book_id()
+        self._book_list = None
         self.set_title(title)
         self.set_author(author)
         self.set_year(year)
         self.set_publisher(publisher)
         self.set_num_copies(num_copies)
         self.set_publication_date(publication_date)
+        if book_id is None:
+            book_id = self._generate_book_id(id_allocator)
+        else:
+            Book.id_allocator.observe(book_id)
+        self.book_id = book_id
         self.available_copies = num_copies
-
-    def _generate_book_id(self):
-        """Generate a random book ID."""
-        return f"BK{random.randint(10000, 99999)}"
+        self.times_borrowed = 0
+
+    def _generate_book_id(self, id_allocator=None):
+        """Allocate a new book ID from id_allocator, or the class-wide allocator."""
+        return (id_allocator or Book.id_allocator).next_id()
+
+    def _update_field(self, field, value):
+        """Set a field and let the owning BookList re-index it and record the change."""
+        old_value = getattr(self, field, None)
+        setattr(self, field, value)
+        if self._book_list is not None:
+            self._book_list._on_book_changed(self, field, old_value, value)
+
+    def _change_available(self, delta):
+        """Lend (negative delta) or return copies and let the owning BookList update its rankings."""
+        self.available_copies += delta
+        if delta < 0:
+            self.times_borrowed -= delta
+        if self._book_list is not None:
+            self._book_list._on_availability_changed(self, delta)
 
     def set_title(self, title):
         if not isinstance(title, str) or not title:
             raise ValueError("Title must be a non-empty string")
-        self.title = title
+        self._update_field("title", title)
 
     def set_author(self, author):
         if not isinstance(author, str) or not author:
             raise ValueError("Author must be a non-empty string")
-        self.author = author
+        self._update_field("author", author)
 
     def set_year(self, year):
         if not isinstance(year, int) or year < 0:
             raise ValueError("Year must be a positive integer")
-        self.year = year
+        self._update_field("year", year)
 
     def set_publisher(self, publisher):
         if not isinstance(publisher, str) or not publisher:
             raise ValueError("Publisher must be a non-empty string")
-        self.publisher = publisher
+        self._update_field("publisher", publisher)
 
     def set_num_copies(self, num_copies):
         if not isinstance(num_copies, int) or num_copies < 0:
             raise ValueError("Number of copies must be a non-negative integer")
-        self.num_copies = num_copies
+        self._update_field("num_copies", num_copies)
 
     def set_publication_date(self, publication_date):
         if not isinstance(publication_date, datetime):
             raise ValueError("Publication date must be a datetime object")
-        self.publication_date = publication_date
+        self._update_field("publication_date", publication_date)
 
     def get_title(self):
         return self.title
@@ -71,19 +233,565 @@ class Book:
     def get_available_copies(self):
         return self.available_copies
 
+    def get_times_borrowed(self):
+        return self.times_borrowed
+
     def get_publication_date(self):
         return self.publication_date
 
-class BookList:
+class NGramIndex:
     """
-    Manages a collection of Book objects.
+    Inverted index from character n-grams to the keys whose value contains them.
+    """
+
+    def __init__(self, n=3):
+        """
+        Initialize a new NGramIndex instance.
+        """
+        self.n = n
+        self.values = {}  # {key: lowercased value}
+        self.postings = {}  # {gram: set(keys)}
+        self._iterating = {}  # {id(values or posting set): searches iterating it}
+        self._lock = threading.RLock()  # re-entrant: a search finalised by the GC mid-write releases its collection
+
+    def _grams(self, value):
+        """Return the set of n-grams in a lowercased value."""
+        return {value[i:i + self.n] for i in range(len(value) - self.n + 1)}
+
+    def _own(self, collection):
+        """Return a collection safe to change in place (a copy while a search iterates it); the caller holds the lock."""
+        return collection.copy() if id(collection) in self._iterating else collection
+
+    def add(self, key, value):
+        """
+        Index a value under the given key, replacing any previous value.
+        """
+        with self._lock:
+            if key in self.values:
+                self._remove(key)
+            value = value.lower()
+            self.values = self._own(self.values)
+            self.values[key] = value
+            for gram in self._grams(value):
+                keys = self.postings.get(gram)
+                if keys is None:
+                    self.postings[gram] = {key}
+                else:
+                    keys = self.postings[gram] = self._own(keys)
+                    keys.add(key)
+
+    def remove(self, key):
+        """
+        Remove a key and its value from the index.
+        """
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        """Remove a key; the caller holds the lock."""
+        if key not in self.values:
+            return
+        self.values = self._own(self.values)
+        value = self.values.pop(key)
+        for gram in self._grams(value):
+            keys = self._own(self.postings[gram])
+            keys.discard(key)
+            if keys:
+                self.postings[gram] = keys
+            else:
+                del self.postings[gram]
+
+    def search(self, query):
+        """
+        Return the keys whose value contains the query, ignoring case.
+        """
+        return list(self.iter_search(query))
+
+    def iter_search(self, query):
+        """
+        Yield the keys whose value contains the query, ignoring case, as they
+        are found, so a caller that only wants the first few can stop early.
+        Nothing is copied up front: while the search runs, changes to the
+        index go to copies of the collections it is iterating.
+        """
+        query = query.lower()
+        values = self.values
+        if len(query) < self.n:
+            # Too short to have an n-gram; scan the pre-lowercased values instead.
+            return self._iterate(values, lambda key: query in values[key])
+        postings = []
+        for gram in self._grams(query):
+            keys = self.postings.get(gram)
+            if not keys:
+                return iter(())
+            postings.append(keys)
+        postings.sort(key=len)
+        candidates, others = postings[0], postings[1:]
+        return self._iterate(candidates, lambda key: all(key in keys for keys in others)
+                             and query in values.get(key, ""))
+
+    def _iterate(self, collection, matches):
+        """Yield the keys in a collection that pass matches, keeping writers off the collection meanwhile."""
+        with self._lock:
+            self._iterating[id(collection)] = self._iterating.get(id(collection), 0) + 1
+        try:
+            for key in collection:
+                if matches(key):
+                    yield key
+        finally:
+            with self._lock:
+                count = self._iterating.pop(id(collection)) - 1
+                if count:
+                    self._iterating[id(collection)] = count
+
+    def estimate(self, query):
+        """
+        Return an upper bound on the number of keys matching the query: the
+        size of its rarest n-gram's posting set, or every key for short queries.
+        """
+        query = query.lower()
+        if len(query) < self.n:
+            return len(self.values)
+        return min(len(self.postings.get(gram, ())) for gram in self._grams(query))
+
+    def candidates(self, query):
+        """
+        Return the posting set of the query's rarest n-gram, a superset of the
+        keys that match it, or None for queries too short to have an n-gram.
+        The set belongs to the index and must not be modified.
+        """
+        query = query.lower()
+        if len(query) < self.n:
+            return None
+        return min((self.postings.get(gram, set()) for gram in self._grams(query)), key=len)
+
+class SortedIndex:
+    """
+    Keeps (key, value) pairs in key order for bisect-based lookups and range queries.
     """
 
     def __init__(self):
         """
-        Initialize a new BookList instance.
+        Initialize a new SortedIndex instance.
+        """
+        self.entries = []  # [(key, value)] sorted
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, key, value):
+        """
+        Insert a (key, value) pair.
         """
-        self.books = {}
+        insort(self.entries, (key, value))
+
+    def add_many(self, pairs):
+        """
+        Insert many (key, value) pairs with one sort rather than one insertion each.
+        """
+        self.entries.extend(pairs)
+        self.entries.sort()
+
+    def remove(self, key, value):
+        """
+        Remove a (key, value) pair if it is present.
+        """
+        i = bisect_left(self.entries, (key, value))
+        if i < len(self.entries) and self.entries[i] == (key, value):
+            del self.entries[i]
+
+    def range(self, low=None, high=None):
+        """
+        Return the values whose key is in [low, high), in key order.
+        """
+        start = 0 if low is None else bisect_left(self.entries, (low,))
+        end = len(self.entries) if high is None else bisect_left(self.entries, (high,))
+        return [value for _, value in self.entries[start:end]]
+
+    def count(self, low=None, high=None):
+        """
+        Return the number of entries whose key is in [low, high).
+        """
+        start = 0 if low is None else bisect_left(self.entries, (low,))
+        end = len(self.entries) if high is None else bisect_left(self.entries, (high,))
+        return max(end - start, 0)
+
+    def largest(self, n):
+        """
+        Return the values of the n largest keys, largest first.
+        """
+        if n <= 0:
+            return []
+        return [value for _, value in reversed(self.entries[-n:])]
+
+class _TrieNode:
+    """
+    One node of a PrefixIndex: its children, the keys whose value ends here,
+    and the best-ranked keys in its subtree (None when it must be rebuilt).
+    """
+
+    __slots__ = ("children", "keys", "top")
+
+    def __init__(self):
+        self.children = {}
+        self.keys = set()
+        self.top = []
+
+class PrefixIndex:
+    """
+    Trie over normalised values for typeahead. Every node keeps the
+    `capacity` best-scored keys below it, so a completion costs the length
+    of the prefix plus the number of results rather than a scan. Values
+    are only indexed to max_depth characters; longer prefixes filter the
+    keys stored at that depth.
+    """
+
+    def __init__(self, capacity=10, max_depth=32):
+        """
+        Initialize a new PrefixIndex instance.
+        """
+        self.capacity = capacity
+        self.max_depth = max_depth
+        self.values = {}  # {key: normalised value}
+        self.scores = {}  # {key: score}, higher first
+        self.root = _TrieNode()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalise(value):
+        """
+        Lowercase a value and collapse its whitespace.
+        """
+        return " ".join(value.lower().split())
+
+    def _rank(self, key):
+        """Sort key putting higher scores first, then values and keys alphabetically."""
+        return (-self.scores[key], self.values[key], key)
+
+    def _path(self, value, create=False):
+        """Return the nodes from the root down to a value's node, or None if it is missing."""
+        node = self.root
+        path = [node]
+        for char in value[:self.max_depth]:
+            child = node.children.get(char)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[char] = _TrieNode()
+            node = child
+            path.append(node)
+        return path
+
+    def _offer(self, node, key):
+        """Place a key in a node's top list if it ranks high enough."""
+        top = node.top
+        if top is None:
+            return
+        if key in top:
+            top.remove(key)
+        rank = self._rank(key)
+        i = len(top)
+        while i > 0 and self._rank(top[i - 1]) > rank:
+            i -= 1
+        if i < self.capacity:
+            top.insert(i, key)
+            del top[self.capacity:]
+
+    def _withdraw(self, node, key):
+        """Take a key out of a node's top list, marking it for rebuild if the list was full."""
+        top = node.top
+        if top is not None and key in top:
+            if len(top) < self.capacity:
+                top.remove(key)
+            else:
+                node.top = None
+
+    def _subtree_keys(self, node):
+        """Return every key stored at or below a node."""
+        keys = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            keys.extend(node.keys)
+            stack.extend(node.children.values())
+        return keys
+
+    def add(self, key, value, score):
+        """
+        Index a value under the given key and score, replacing any previous value.
+        """
+        with self._lock:
+            if key in self.values:
+                self._remove(key)
+            value = self.normalise(value)
+            self.values[key] = value
+            self.scores[key] = score
+            path = self._path(value, create=True)
+            path[-1].keys.add(key)
+            for node in path:
+                self._offer(node, key)
+
+    def remove(self, key):
+        """
+        Remove a key and its value from the index.
+        """
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        """Remove a key; the caller holds the lock."""
+        value = self.values.get(key)
+        if value is None:
+            return
+        path = self._path(value)
+        path[-1].keys.discard(key)
+        for node in path:
+            self._withdraw(node, key)
+        del self.values[key]
+        del self.scores[key]
+        for depth in range(len(path) - 1, 0, -1):
+            node = path[depth]
+            if node.keys or node.children:
+                break
+            del path[depth - 1].children[value[depth - 1]]
+
+    def set_score(self, key, score):
+        """
+        Change the score of an indexed key.
+        """
+        with self._lock:
+            old_score = self.scores.get(key)
+            if old_score is None or old_score == score:
+                return
+            self.scores[key] = score
+            for node in self._path(self.values[key]):
+                if score > old_score:
+                    self._offer(node, key)
+                elif node.top is not None and key in node.top:
+                    self._withdraw(node, key)
+                    self._offer(node, key)
+
+    def complete(self, prefix, k=10):
+        """
+        Return up to k keys whose value starts with prefix, best score first.
+        """
+        if k <= 0:
+            return []
+        normalised = self.normalise(prefix)
+        if normalised and prefix[-1].isspace():
+            normalised += " "
+        prefix = normalised
+        with self._lock:
+            path = self._path(prefix)
+            if path is None:
+                return []
+            node = path[-1]
+            if len(prefix) > self.max_depth or k > self.capacity:
+                keys = [key for key in self._subtree_keys(node) if self.values[key].startswith(prefix)]
+                keys.sort(key=self._rank)
+                return keys[:k]
+            if node.top is None:
+                node.top = sorted(self._subtree_keys(node), key=self._rank)[:self.capacity]
+            return node.top[:k]
+
+class SearchCache:
+    """
+    Bounded LRU cache of search results, each tagged with the collection
+    version it was computed at. An entry from an older version, or older
+    than ttl seconds, is treated as a miss and dropped.
+    """
+
+    def __init__(self, max_entries=1024, ttl=None):
+        """
+        Initialize a new SearchCache instance; max_entries=0 disables caching.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # {key: (version, stored_at, result)}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        """
+        Return the result cached for key at the given version, or None.
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                cached_version, stored_at, result = entry
+                if cached_version == version and (self.ttl is None or time.monotonic() - stored_at < self.ttl):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, version, result):
+        """
+        Cache a result computed at the given version, evicting the least recently used entry if full.
+        """
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self.entries[key] = (version, time.monotonic(), result)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Drop every entry and reset the statistics.
+        """
+        with self._lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+    def get_stats(self):
+        """
+        Return the hit and miss counts, hit rate and current size.
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+class BookList(Observable):
+    """
+    Manages a collection of Book objects.
+    """
+
+    TEXT_FIELDS = ("title", "author", "publisher")
+    TYPEAHEAD_FIELDS = ("title", "author")
+    AGGREGATE_FIELDS = ("author", "publisher", "year")
+    TYPEAHEAD_RANKINGS = ("popularity", "year")
+    SEARCH_ORDERINGS = ("title", "year", "availability")
+    INDEXES = TEXT_FIELDS + ("publication_date", "totals")
+
+    def __init__(self, books=None, cache_size=1024, cache_ttl=None):
+        """
+        Initialize a new BookList instance, optionally over an existing book
+        mapping (such as a memory-mapped catalog) whose indexes are each built
+        the first time a query needs them.
+        Up to cache_size search results are cached (0 disables the cache), for
+        at most cache_ttl seconds if given.
+        """
+        self.books = {} if books is None else books
+        self.id_allocator = Book.id_allocator  # issues the IDs of books created for this list
+        self._observers = []
+        self._text_indexes = {field: NGramIndex() for field in self.TEXT_FIELDS}
+        self._date_index = SortedIndex()  # (publication ordinal, book_id)
+        self._unbuilt = set() if books is None else set(self.INDEXES)  # indexes not built yet
+        self._typeahead = {}  # {(field, rank_by): PrefixIndex}, built on first use
+        self._totals = {field: {} for field in self.AGGREGATE_FIELDS}  # {field: {value: [books, copies, available]}}
+        self._totals_lock = threading.Lock()
+        self.version = 0  # bumped on every change to the catalog; invalidates cached searches
+        self._search_cache = SearchCache(cache_size, cache_ttl)
+
+    def _column(self, field):
+        """Return (book_id, value) pairs for one field of every book, from the mapped column if there is one."""
+        column = getattr(self.books, "column", None)
+        if column is not None:
+            return column(field)
+        return ((book_id, getattr(book, field)) for book_id, book in self.books.items())
+
+    def _ensure_indexed(self, *indexes):
+        """Build the named indexes if the collection was opened without them, reading only the columns they cover."""
+        for name in indexes:
+            if name not in self._unbuilt:
+                continue
+            self._unbuilt.discard(name)
+            if name in self._text_indexes:
+                index = self._text_indexes[name]
+                for book_id, value in self._column(name):
+                    index.add(book_id, value)
+            elif name == "publication_date":
+                self._date_index.add_many((date.toordinal(), book_id)
+                                          for book_id, date in self._column("publication_date"))
+            else:
+                fields = self.AGGREGATE_FIELDS + ("num_copies", "available_copies")
+                with self._totals_lock:
+                    for row in zip(*map(self._column, fields)):
+                        values = [value for _, value in row]
+                        for field, value in zip(self.AGGREGATE_FIELDS, values):
+                            self._add_totals(field, value, 1, values[-2], values[-1])
+
+    def _index_book(self, book):
+        """Add a book to the indexes that have been built."""
+        book._book_list = self
+        for field, index in self._text_indexes.items():
+            if field not in self._unbuilt:
+                index.add(book.book_id, getattr(book, field))
+        if "publication_date" not in self._unbuilt:
+            self._date_index.add(book.publication_date.toordinal(), book.book_id)
+        for (field, rank_by), index in self._typeahead.items():
+            index.add(book.book_id, getattr(book, field), self._typeahead_score(book, rank_by))
+        if "totals" not in self._unbuilt:
+            with self._totals_lock:
+                for field in self.AGGREGATE_FIELDS:
+                    self._add_totals(field, getattr(book, field), 1, book.num_copies, book.available_copies)
+
+    def _unindex_book(self, book):
+        """Remove a book from the indexes that have been built."""
+        book._book_list = None
+        for field, index in self._text_indexes.items():
+            if field not in self._unbuilt:
+                index.remove(book.book_id)
+        if "publication_date" not in self._unbuilt:
+            self._date_index.remove(book.publication_date.toordinal(), book.book_id)
+        for index in self._typeahead.values():
+            index.remove(book.book_id)
+        if "totals" not in self._unbuilt:
+            with self._totals_lock:
+                for field in self.AGGREGATE_FIELDS:
+                    self._add_totals(field, getattr(book, field), -1, -book.num_copies, -book.available_copies)
+
+    def _add_totals(self, field, value, books, copies, available):
+        """Adjust the running totals for one author, publisher or year; the caller holds the totals lock."""
+        totals = self._totals[field].setdefault(value, [0, 0, 0])
+        totals[0] += books
+        totals[1] += copies
+        totals[2] += available
+        if not totals[0]:
+            del self._totals[field][value]
+
+    def _on_book_changed(self, book, field, old_value, new_value):
+        """Keep the indexes in sync when a book in the collection is modified."""
+        self.version += 1
+        if field in self._unbuilt:
+            pass
+        elif field in self._text_indexes:
+            self._text_indexes[field].add(book.book_id, new_value)
+        elif field == "publication_date":
+            self._date_index.remove(old_value.toordinal(), book.book_id)
+            self._date_index.add(new_value.toordinal(), book.book_id)
+        for (indexed_field, rank_by), index in self._typeahead.items():
+            if indexed_field == field:
+                index.add(book.book_id, new_value, self._typeahead_score(book, rank_by))
+            elif rank_by == field:
+                index.set_score(book.book_id, new_value)
+        if "totals" in self._unbuilt:
+            pass
+        elif field == "num_copies":
+            with self._totals_lock:
+                for aggregate_field in self.AGGREGATE_FIELDS:
+                    self._add_totals(aggregate_field, getattr(book, aggregate_field), 0, new_value - old_value, 0)
+        elif field in self._totals:
+            with self._totals_lock:
+                self._add_totals(field, old_value, -1, -book.num_copies, -book.available_copies)
+                self._add_totals(field, new_value, 1, book.num_copies, book.available_copies)
+        self._notify("update_book", book_id=book.book_id, field=field, value=new_value)
+
+    def _on_availability_changed(self, book, delta):
+        """Update the running totals, and the popularity typeahead ranking when a book is lent."""
+        if "totals" not in self._unbuilt:
+            with self._totals_lock:
+                for field in self.AGGREGATE_FIELDS:
+                    self._add_totals(field, getattr(book, field), 0, 0, delta)
+        if delta < 0:
+            for (field, rank_by), index in self._typeahead.items():
+                if rank_by == "popularity":
+                    index.set_score(book.book_id, book.times_borrowed)
 
     def add_book(self, book):
         """
@@ -91,34 +799,308 @@ class BookList:
         """
         if not isinstance(book, Book):
             raise ValueError("Only Book objects can be added to the collection")
+        if book.book_id in self.books:
+            raise ValueError(f"A book with ID {book.book_id} already exists")
+        Book.id_allocator.observe(book.book_id)
         self.books[book.book_id] = book
+        self.version += 1
+        self._index_book(book)
+        self._notify("add_book", book=book)
+
+    def add_books(self, books):
+        """
+        Add a batch of books to the collection. Nothing is added unless every
+        item is a Book with an ID that is not already in use.
+        """
+        books = list(books)
+        if not all(isinstance(book, Book) for book in books):
+            raise ValueError("Only Book objects can be added to the collection")
+        book_ids = set()
+        for book in books:
+            if book.book_id in book_ids or book.book_id in self.books:
+                raise ValueError(f"A book with ID {book.book_id} already exists")
+            book_ids.add(book.book_id)
+        for book in books:
+            self.add_book(book)
 
     def search_book(self, query, search_type):
         """
         Search for a book by title, author, publisher, or publication date.
         """
-        results = []
-        for book in self.books.values():
-            if search_type == "title" and query.lower() in book.get_title().lower():
-                results.append(book)
-            elif search_type == "author" and query.lower() in book.get_author().lower():
-                results.append(book)
-            elif search_type == "publisher" and query.lower() in book.get_publisher().lower():
-                results.append(book)
-            elif search_type == "publication_date" and query == book.get_publication_date().strftime("%Y-%m-%d"):
-                results.append(book)
-        return results
+        return self._books_for(self._match_ids(query, search_type))
+
+    def _match_ids(self, query, search_type, stream=False):
+        """Return the IDs of the books matching a search from the cache, or from the indexes (lazily if stream)."""
+        if search_type in self._text_indexes:
+            key = (query.lower(), search_type)
+        elif search_type == "publication_date":
+            key = (query, search_type)
+        else:
+            return []
+        version = self.version
+        book_ids = self._search_cache.get(key, version)
+        if book_ids is None:
+            if stream and search_type in self._text_indexes:
+                self._ensure_indexed(search_type)
+                return self._text_indexes[search_type].iter_search(query)
+            book_ids = self._search(query, search_type)
+            self._search_cache.put(key, version, book_ids)
+        return book_ids
+
+    def _order_key(self, order_by):
+        """Return the sort key function over book IDs for a search ordering; ties are broken by book ID."""
+        if order_by is not None and order_by not in self.SEARCH_ORDERINGS:
+            raise ValueError(f"Search ordering must be one of: {', '.join(self.SEARCH_ORDERINGS)}")
+        books = self.books
+        if order_by == "title":
+            self._ensure_indexed("title")
+            titles = self._text_indexes["title"]
+            return lambda book_id: (titles.values[book_id], book_id)
+        if order_by == "year":
+            return lambda book_id: (books[book_id].year, book_id)
+        if order_by == "availability":
+            return lambda book_id: (books[book_id].available_copies, book_id)
+        return lambda book_id: (book_id,)
+
+    def iter_search_book(self, query, search_type, order_by=None, descending=False, offset=0, limit=None):
+        """
+        Return an iterator over the books search_book would return, skipping
+        the first offset and stopping after limit. With order_by ("title",
+        "year" or "availability") they come in that order, ties by book ID,
+        and only offset + limit matches are kept in a heap while the rest are
+        scanned. Without it, matches are streamed from the index in no
+        particular order, so a short page of a common query stops early.
+        """
+        if not isinstance(offset, int) or offset < 0:
+            raise ValueError("Offset must be a non-negative integer")
+        if limit is not None and (not isinstance(limit, int) or limit < 0):
+            raise ValueError("Limit must be a non-negative integer")
+        if order_by is None:
+            book_ids = islice(self._match_ids(query, search_type, stream=True), offset,
+                              None if limit is None else offset + limit)
+        else:
+            key = self._order_key(order_by)
+            book_ids = self._match_ids(query, search_type)
+            if limit is None:
+                book_ids = sorted(book_ids, key=key, reverse=descending)[offset:]
+            else:
+                pick = heapq.nlargest if descending else heapq.nsmallest
+                book_ids = pick(offset + limit, book_ids, key=key)[offset:]
+        books = self.books
+        return (books[book_id] for book_id in book_ids)
+
+    def search_book_page(self, query, search_type, limit=20, cursor=None, order_by=None, descending=False):
+        """
+        Return one page of search results as (books, cursor), ordered by
+        order_by ("title", "year" or "availability") or by book ID. Pass the
+        returned cursor back to get the next page; it is None after the last
+        page. Pages start after the last book shown rather than at a count,
+        so changes to the catalog between calls do not skip or repeat books,
+        and each page costs one pass over the matches with a heap of limit.
+        """
+        if not isinstance(limit, int) or limit < 1:
+            raise ValueError("Limit must be a positive integer")
+        key = self._order_key(order_by)
+        book_ids = self._match_ids(query, search_type)
+        if cursor is not None:
+            if not isinstance(cursor, (list, tuple)):
+                raise ValueError("Invalid search cursor")
+            cursor = tuple(cursor)
+            book_ids = (book_id for book_id in book_ids
+                        if (key(book_id) < cursor if descending else key(book_id) > cursor))
+        pick = heapq.nlargest if descending else heapq.nsmallest
+        try:
+            page = pick(limit + 1, book_ids, key=key)
+        except TypeError:
+            raise ValueError("Invalid search cursor")
+        next_cursor = list(key(page[limit - 1])) if len(page) > limit else None
+        return self._books_for(page[:limit]), next_cursor
+
+    def find_books(self, title=None, author=None, publisher=None, start_date=None, end_date=None, available=None):
+        """
+        Yield the books matching every given condition: the title, author and
+        publisher contain the given text (ignoring case), the publication date
+        is between start_date and end_date (inclusive; either may be left
+        out), and copies are available (available=True) or not (False).
+        Candidates come from the condition whose index promises the fewest
+        matches; the other conditions are checked against each candidate.
+        """
+        for value in (start_date, end_date):
+            if value is not None and not isinstance(value, datetime):
+                raise ValueError("Start and end dates must be datetime objects")
+        # Each step: (estimated matches, function returning candidate IDs or None, posting set or None, test)
+        plan = []
+        for field, text in (("title", title), ("author", author), ("publisher", publisher)):
+            if text is not None:
+                self._ensure_indexed(field)
+                index = self._text_indexes[field]
+                text = text.lower()
+                postings = index.candidates(text)
+                plan.append((index.estimate(text), None if postings is None else (lambda postings=postings: postings),
+                             postings, lambda book, index=index, text=text: text in index.values[book.book_id]))
+        if start_date is not None or end_date is not None:
+            self._ensure_indexed("publication_date")
+            low = None if start_date is None else start_date.toordinal()
+            high = None if end_date is None else end_date.toordinal() + 1
+            plan.append((self._date_index.count(low, high), lambda: self._date_index.range(low, high), None,
+                         lambda book: (low is None or book.publication_date.toordinal() >= low)
+                         and (high is None or book.publication_date.toordinal() < high)))
+        if available is not None:
+            plan.append((len(self.books), None, None, lambda book: (book.available_copies > 0) == available))
+        if not plan:
+            raise ValueError("At least one search condition must be given")
+        plan.sort(key=lambda step: (step[1] is None, step[0]))
+        return self._stream_books(plan)
+
+    def _stream_books(self, plan):
+        """Yield the books that pass every test in a query plan, taking candidates from its first step."""
+        estimate, candidates, _, _ = plan[0]
+        if estimate == 0:
+            return
+        book_ids = list(self.books) if candidates is None else candidates()
+        # Narrow the candidates by the other posting sets at C speed before testing books one by one.
+        postings = [step[2] for step in plan[1:] if step[2] is not None]
+        if postings:
+            book_ids = set(book_ids).intersection(*postings)
+        elif candidates is not None:
+            book_ids = list(book_ids)
+        tests = [test for _, _, _, test in plan]
+        for book_id in book_ids:
+            book = self.books.get(book_id)
+            if book is not None and all(test(book) for test in tests):
+                yield book
+
+    def search_book_regex(self, pattern, search_type="title"):
+        """
+        Return the books whose title, author or publisher matches a regular
+        expression, ignoring case. This scans every book.
+        """
+        if search_type not in self._text_indexes:
+            raise ValueError(f"Search type must be one of: {', '.join(self.TEXT_FIELDS)}")
+        try:
+            compiled = re.compile(pattern, re.IGNORECASE)
+        except re.error as e:
+            raise ValueError(f"Invalid regular expression: {e}")
+        self._ensure_indexed(search_type)
+        values = self._text_indexes[search_type].values
+        return self._books_for([book_id for book_id, value in values.items() if compiled.search(value)])
+
+    def _search(self, query, search_type):
+        """Return the IDs of the books matching a search, using the indexes."""
+        if search_type in self._text_indexes:
+            self._ensure_indexed(search_type)
+            return self._text_indexes[search_type].search(query)
+        try:
+            day = datetime.strptime(query, "%Y-%m-%d")
+        except ValueError:
+            return []
+        # Only the date written exactly as it is printed matches, not "2000-1-1".
+        if day.strftime("%Y-%m-%d") != query:
+            return []
+        self._ensure_indexed("publication_date")
+        return self._date_index.range(day.toordinal(), day.toordinal() + 1)
+
+    @staticmethod
+    def _typeahead_score(book, rank_by):
+        """Return the score a book is ranked by in a typeahead index."""
+        return book.times_borrowed if rank_by == "popularity" else book.year
+
+    def typeahead(self, prefix, field="title", k=10, rank_by="popularity"):
+        """
+        Return up to k books whose title or author starts with prefix
+        (ignoring case and repeated spaces), most borrowed or newest first.
+        """
+        if field not in self.TYPEAHEAD_FIELDS:
+            raise ValueError(f"Typeahead field must be one of: {', '.join(self.TYPEAHEAD_FIELDS)}")
+        if rank_by not in self.TYPEAHEAD_RANKINGS:
+            raise ValueError(f"Typeahead ranking must be one of: {', '.join(self.TYPEAHEAD_RANKINGS)}")
+        index = self._typeahead.get((field, rank_by))
+        if index is None:
+            index = PrefixIndex()
+            for book in self.books.values():
+                index.add(book.book_id, getattr(book, field), self._typeahead_score(book, rank_by))
+            self._typeahead[(field, rank_by)] = index
+        return self._books_for(index.complete(prefix, k))
+
+    def get_copy_totals(self, field, value):
+        """
+        Return the number of books, total copies and available copies for
+        one author, publisher or year, e.g. get_copy_totals("publisher", "Penguin").
+        """
+        if field not in self.AGGREGATE_FIELDS:
+            raise ValueError(f"Totals field must be one of: {', '.join(self.AGGREGATE_FIELDS)}")
+        self._ensure_indexed("totals")
+        with self._totals_lock:
+            books, copies, available = self._totals[field].get(value, (0, 0, 0))
+        return {"books": books, "num_copies": copies, "available_copies": available}
+
+    def get_all_copy_totals(self, field):
+        """
+        Return {author, publisher or year: totals} for every value of the field.
+        """
+        if field not in self.AGGREGATE_FIELDS:
+            raise ValueError(f"Totals field must be one of: {', '.join(self.AGGREGATE_FIELDS)}")
+        self._ensure_indexed("totals")
+        with self._totals_lock:
+            return {value: {"books": books, "num_copies": copies, "available_copies": available}
+                    for value, (books, copies, available) in self._totals[field].items()}
+
+    def get_search_cache_stats(self):
+        """
+        Return the search cache's hit and miss counts, hit rate and size.
+        """
+        return self._search_cache.get_stats()
 
-    def remove_book(self, title):
+    def _books_for(self, book_ids):
+        """Return the Book objects for a list of book IDs."""
+        return [self.books[book_id] for book_id in book_ids]
+
+    def get_books_published_between(self, start_date, end_date):
+        """
+        Return the books published between two dates (inclusive), oldest first.
+        """
+        if not isinstance(start_date, datetime) or not isinstance(end_date, datetime):
+            raise ValueError("Start and end dates must be datetime objects")
+        self._ensure_indexed("publication_date")
+        return self._books_for(self._date_index.range(start_date.toordinal(), end_date.toordinal() + 1))
+
+    def get_books_published_in_year(self, year):
+        """
+        Return the books published in the given year, oldest first.
+        """
+        if not isinstance(year, int) or year < 1:
+            raise ValueError("Year must be a positive integer")
+        return self.get_books_published_between(datetime(year, 1, 1), datetime(year, 12, 31))
+
+    def get_newest_books(self, n):
+        """
+        Return the n most recently published books, newest first.
+        """
+        self._ensure_indexed("publication_date")
+        return self._books_for(self._date_index.largest(n))
+
+    def remove_book(self, title, loans=None):
         """
-        Remove a book from the collection by its title.
+        Remove a book from the collection by its title. If loans is given,
+        a book that still has copies on loan is not removed.
         """
-        for book_id, book in list(self.books.items()):
+        self._ensure_indexed("title")
+        for book_id in self._text_indexes["title"].search(title):
+            book = self.books[book_id]
             if book.get_title().lower() == title.lower():
-                del self.books[book_id]
+                if loans is not None and loans.is_on_loan(book):
+                    raise ValueError(f"Book {book_id} still has copies on loan")
+                self._remove_book(book)
                 return True
         raise ValueError(f"No book found with title: {title}")
 
+    def _remove_book(self, book):
+        """Remove a book from the collection and its indexes."""
+        del self.books[book.book_id]
+        self.version += 1
+        self._unindex_book(book)
+        self._notify("remove_book", book_id=book.book_id)
+
     def get_total_books(self):
         """
         Return the total number of books in the collection.
@@ -130,19 +1112,30 @@ class User:
     Represents a user in the library system.
     """
 
+    __slots__ = ("_user_list", "username", "firstname", "surname", "house_number",
+                 "street_name", "postcode", "email", "date_of_birth")
+
     def __init__(self, username, firstname, surname, house_number, street_name, postcode, email, date_of_birth):
         """
         Initialize a new User instance.
         """
+        self._user_list = None
         self.username = username
         self.set_firstname(firstname)
         self.set_surname(surname)
-        self.house_number = house_number
-        self.street_name = street_name
-        self.postcode = postcode
+        self.set_house_number(house_number)
+        self.set_street_name(street_name)
+        self.set_postcode(postcode)
         self.set_email(email)
         self.set_date_of_birth(date_of_birth)
 
+    def _update_field(self, field, value):
+        """Set a field and let the owning UserList re-index it and record the change."""
+        old_value = getattr(self, field, None)
+        setattr(self, field, value)
+        if self._user_list is not None:
+            self._user_list._on_user_changed(self, field, old_value, value)
+
     def get_username(self):
         return self.username
 
@@ -170,33 +1163,88 @@ class User:
     def set_firstname(self, firstname):
         if not isinstance(firstname, str) or not firstname:
             raise ValueError("First name must be a non-empty string")
-        self.firstname = firstname
+        self._update_field("firstname", firstname)
 
     def set_surname(self, surname):
         if not isinstance(surname, str) or not surname:
             raise ValueError("Surname must be a non-empty string")
-        self.surname = surname
+        self._update_field("surname", surname)
 
     def set_email(self, email):
         if not isinstance(email, str) or '@' not in email:
             raise ValueError("Invalid email address")
-        self.email = email
+        self._update_field("email", email)
+
+    def set_house_number(self, house_number):
+        self._update_field("house_number", house_number)
+
+    def set_street_name(self, street_name):
+        self._update_field("street_name", street_name)
+
+    def set_postcode(self, postcode):
+        self._update_field("postcode", str(postcode))
 
     def set_date_of_birth(self, date_of_birth):
         if not isinstance(date_of_birth, datetime):
             raise ValueError("Date of birth must be a datetime object")
-        self.date_of_birth = date_of_birth
+        self._update_field("date_of_birth", date_of_birth)
 
-class UserList:
+class UserList(Observable):
     """
     Manages a collection of User objects.
     """
 
+    INDEXED_FIELDS = ("firstname", "surname", "email", "postcode")
+
     def __init__(self):
         """
         Initialize a new UserList instance.
         """
         self.users = {}
+        self._observers = []
+        self._field_indexes = {field: {} for field in self.INDEXED_FIELDS}  # {field: {key: set(usernames)}}
+
+    @staticmethod
+    def _index_key(field, value):
+        """Normalise a field value for case-insensitive lookup."""
+        key = value.lower()
+        if field == "postcode":
+            key = "".join(key.split())
+        return key
+
+    def _index_field(self, field, value, username):
+        """Add a username to the index entry for a field value."""
+        key = self._index_key(field, value)
+        self._field_indexes[field].setdefault(key, set()).add(username)
+
+    def _unindex_field(self, field, value, username):
+        """Remove a username from the index entry for a field value."""
+        index = self._field_indexes[field]
+        key = self._index_key(field, value)
+        usernames = index.get(key)
+        if usernames is not None:
+            usernames.discard(username)
+            if not usernames:
+                del index[key]
+
+    def _index_user(self, user):
+        """Add a user to the secondary indexes."""
+        user._user_list = self
+        for field in self.INDEXED_FIELDS:
+            self._index_field(field, getattr(user, field), user.get_username())
+
+    def _unindex_user(self, user):
+        """Remove a user from the secondary indexes."""
+        user._user_list = None
+        for field in self.INDEXED_FIELDS:
+            self._unindex_field(field, getattr(user, field), user.get_username())
+
+    def _on_user_changed(self, user, field, old_value, new_value):
+        """Keep the indexes in sync when a user in the collection is modified."""
+        if field in self._field_indexes:
+            self._unindex_field(field, old_value, user.get_username())
+            self._index_field(field, new_value, user.get_username())
+        self._notify("update_user", username=user.get_username(), field=field, value=new_value)
 
     def add_user(self, user):
         """
@@ -204,19 +1252,60 @@ class UserList:
         """
         if not isinstance(user, User):
             raise ValueError("Only User objects can be added to the collection")
+        existing = self.users.get(user.get_username())
+        if existing is not None:
+            self._unindex_user(existing)
         self.users[user.get_username()] = user
+        self._index_user(user)
+        self._notify("add_user", user=user)
+
+    def add_users(self, users):
+        """
+        Add a batch of users to the collection. Nothing is added unless every item is a User.
+        """
+        users = list(users)
+        if not all(isinstance(user, User) for user in users):
+            raise ValueError("Only User objects can be added to the collection")
+        for user in users:
+            self.add_user(user)
 
     def remove_user(self, firstname):
         """
         Remove a user from the collection by first name.
         """
-        matching_users = [user for user in self.users.values() if user.get_firstname().lower() == firstname.lower()]
+        matching_users = self.find_users(firstname=firstname)
         if len(matching_users) > 1:
             raise ValueError(f"Multiple users found with first name: {firstname}. Please use a unique identifier.")
         elif len(matching_users) == 0:
             raise ValueError(f"No user found with first name: {firstname}")
         else:
-            del self.users[matching_users[0].get_username()]
+            self._remove_user(matching_users[0])
+
+    def _remove_user(self, user):
+        """Remove a user from the collection and its indexes."""
+        del self.users[user.get_username()]
+        self._unindex_user(user)
+        self._notify("remove_user", username=user.get_username())
+
+    def find_users(self, firstname=None, surname=None, email=None, postcode=None):
+        """
+        Return the users matching every given field, ignoring case (and spaces in postcodes).
+        """
+        criteria = {"firstname": firstname, "surname": surname, "email": email, "postcode": postcode}
+        matches = []
+        for field, value in criteria.items():
+            if value is None:
+                continue
+            usernames = self._field_indexes[field].get(self._index_key(field, value))
+            if not usernames:
+                return []
+            matches.append(usernames)
+        if not matches:
+            raise ValueError("At least one search field must be given")
+        matches.sort(key=len)
+        smallest, others = matches[0], matches[1:]
+        return [self.users[username] for username in smallest
+                if all(username in usernames for usernames in others)]
 
     def get_user_count(self):
         """
@@ -232,16 +1321,407 @@ class UserList:
             raise ValueError(f"No user found with username: {username}")
         return self.users[username]
 
-class Loans:
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+class LoanTable(MutableMapping):
     """
-    Manages book loans in the library system.
+    A compact {username: {book_id: due_date}} mapping. Usernames and book IDs
+    are interned to integer handles and each loan is one slot in parallel
+    arrays of user handle, book handle and due date (microseconds since
+    1970), so a loan costs a few dozen bytes instead of a dict entry and a
+    datetime object.
     """
 
     def __init__(self):
         """
-        Initialize a new Loans instance.
+        Initialize a new LoanTable instance.
+        """
+        self._usernames = []  # [username] by handle
+        self._user_handles = {}  # {username: handle}
+        self._book_ids = []  # [book_id] by handle
+        self._book_handles = {}  # {book_id: handle}
+        self._user_column = array("l")  # user handle by slot, -1 when free
+        self._book_column = array("l")  # book handle by slot
+        self._due_column = array("q")  # due date by slot
+        self._free_slots = array("l")
+        self._user_slots = {}  # {user handle: array of slots}
+        # Each book's loans form a doubly linked list through their slots.
+        self._book_first = array("i")  # first slot by book handle, -1 when none
+        self._book_next = array("i")  # next slot of the same book by slot, -1 at the end
+        self._book_prev = array("i")  # previous slot of the same book by slot, -1 at the start
+
+    @staticmethod
+    def _intern(value, values, handles):
+        """Return the handle for a value, assigning the next one if it is new."""
+        handle = handles.get(value)
+        if handle is None:
+            handle = handles[value] = len(values)
+            values.append(value)
+        return handle
+
+    def _find_slot(self, user_handle, book_id):
+        """Return the slot of a user's loan of a book, or None."""
+        book_handle = self._book_handles.get(book_id)
+        if book_handle is None:
+            return None
+        for slot in self._user_slots[user_handle]:
+            if self._book_column[slot] == book_handle:
+                return slot
+        return None
+
+    def _slot(self, username, book_id):
+        """Return the slot of a loan, or None."""
+        user_handle = self._user_handles.get(username)
+        if user_handle is None or user_handle not in self._user_slots:
+            return None
+        return self._find_slot(user_handle, book_id)
+
+    def _put(self, user_handle, book_id, due_date):
+        """Store a loan, reusing the existing slot if the user already has the book."""
+        due = (due_date - EPOCH) // MICROSECOND
+        slot = self._find_slot(user_handle, book_id)
+        if slot is not None:
+            self._due_column[slot] = due
+            return
+        book_handle = self._intern(book_id, self._book_ids, self._book_handles)
+        if book_handle == len(self._book_first):
+            self._book_first.append(-1)
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._user_column[slot] = user_handle
+            self._book_column[slot] = book_handle
+            self._due_column[slot] = due
+        else:
+            slot = len(self._user_column)
+            self._user_column.append(user_handle)
+            self._book_column.append(book_handle)
+            self._due_column.append(due)
+            self._book_next.append(-1)
+            self._book_prev.append(-1)
+        self._user_slots[user_handle].append(slot)
+        first = self._book_first[book_handle]
+        self._book_next[slot] = first
+        self._book_prev[slot] = -1
+        if first != -1:
+            self._book_prev[first] = slot
+        self._book_first[book_handle] = slot
+
+    def _free(self, user_handle, slot):
+        """Release a loan's slot."""
+        slots = self._user_slots[user_handle]
+        del slots[slots.index(slot)]
+        previous, following = self._book_prev[slot], self._book_next[slot]
+        if previous == -1:
+            self._book_first[self._book_column[slot]] = following
+        else:
+            self._book_next[previous] = following
+        if following != -1:
+            self._book_prev[following] = previous
+        self._user_column[slot] = -1
+        self._free_slots.append(slot)
+
+    def _due_date(self, slot):
+        """Return the due date stored in a slot."""
+        return EPOCH + self._due_column[slot] * MICROSECOND
+
+    def _loan(self, slot):
+        """Return the (username, book_id) pair stored in a slot."""
+        return self._usernames[self._user_column[slot]], self._book_ids[self._book_column[slot]]
+
+    def holders(self, book_id):
+        """
+        Return {username: due_date} for every loan of a book.
+        """
+        holders = {}
+        book_handle = self._book_handles.get(book_id)
+        slot = -1 if book_handle is None else self._book_first[book_handle]
+        while slot != -1:
+            holders[self._usernames[self._user_column[slot]]] = self._due_date(slot)
+            slot = self._book_next[slot]
+        return holders
+
+    def is_lent(self, book_id):
+        """
+        Return True if the book has at least one loan.
+        """
+        book_handle = self._book_handles.get(book_id)
+        return book_handle is not None and self._book_first[book_handle] != -1
+
+    def __getitem__(self, username):
+        user_handle = self._user_handles.get(username)
+        if user_handle is None or user_handle not in self._user_slots:
+            raise KeyError(username)
+        return _UserLoans(self, user_handle)
+
+    def __setitem__(self, username, loans):
+        loans = dict(loans)
+        if username in self:
+            del self[username]
+        user_handle = self._intern(username, self._usernames, self._user_handles)
+        self._user_slots[user_handle] = array("l")
+        for book_id, due_date in loans.items():
+            self._put(user_handle, book_id, due_date)
+
+    def __delitem__(self, username):
+        user_handle = self._user_handles.get(username)
+        if user_handle is None or user_handle not in self._user_slots:
+            raise KeyError(username)
+        for slot in list(self._user_slots[user_handle]):
+            self._free(user_handle, slot)
+        del self._user_slots[user_handle]
+
+    def __iter__(self):
+        for user_handle in list(self._user_slots):
+            yield self._usernames[user_handle]
+
+    def __len__(self):
+        return len(self._user_slots)
+
+    def setdefault(self, username, default=None):
+        if username not in self:
+            self[username] = {} if default is None else default
+        return self[username]
+
+class _UserLoans(MutableMapping):
+    """
+    A {book_id: due_date} view of one user's loans in a LoanTable.
+    """
+
+    __slots__ = ("_table", "_user_handle")
+
+    def __init__(self, table, user_handle):
+        self._table = table
+        self._user_handle = user_handle
+
+    def __getitem__(self, book_id):
+        slot = self._table._find_slot(self._user_handle, book_id)
+        if slot is None:
+            raise KeyError(book_id)
+        return self._table._due_date(slot)
+
+    def __setitem__(self, book_id, due_date):
+        self._table._put(self._user_handle, book_id, due_date)
+
+    def __delitem__(self, book_id):
+        slot = self._table._find_slot(self._user_handle, book_id)
+        if slot is None:
+            raise KeyError(book_id)
+        self._table._free(self._user_handle, slot)
+
+    def __iter__(self):
+        table = self._table
+        for slot in list(table._user_slots[self._user_handle]):
+            yield table._book_ids[table._book_column[slot]]
+
+    def __len__(self):
+        return len(self._table._user_slots[self._user_handle])
+
+class CompactDueIndex:
+    """
+    Due-date index over a LoanTable, with the same interface as SortedIndex.
+    Entries are kept sorted by (due second, slot) in two parallel arrays.
+    """
+
+    def __init__(self, table):
+        """
+        Initialize a new CompactDueIndex instance.
+        """
+        self.table = table
+        self.seconds = array("q")  # due second by entry
+        self.slots = array("i")  # loan slot by entry
+
+    def __len__(self):
+        return len(self.seconds)
+
+    @staticmethod
+    def _second(due_date):
+        """Return whole seconds since 1970 for a due date."""
+        return (due_date - EPOCH) // timedelta(seconds=1)
+
+    def _position(self, second, slot):
+        """Return where a (second, slot) entry is or would be inserted."""
+        low = bisect_left(self.seconds, second)
+        high = bisect_right(self.seconds, second, low)
+        return bisect_left(self.slots, slot, low, high)
+
+    def _entry(self, due_date, loan):
+        """Return the (second, slot) entry of a loan stored in the table."""
+        slot = self.table._slot(*loan)
+        if slot is None:
+            raise KeyError(loan)
+        return self._second(due_date), slot
+
+    def add(self, due_date, loan):
+        """
+        Index a loan that is already stored in the table.
+        """
+        second, slot = self._entry(due_date, loan)
+        i = self._position(second, slot)
+        self.seconds.insert(i, second)
+        self.slots.insert(i, slot)
+
+    def remove(self, due_date, loan):
+        """
+        Remove a loan from the index; call before removing it from the table.
+        """
+        second, slot = self._entry(due_date, loan)
+        i = self._position(second, slot)
+        if i < len(self.seconds) and self.seconds[i] == second and self.slots[i] == slot:
+            del self.seconds[i]
+            del self.slots[i]
+
+    def range(self, low=None, high=None):
+        """
+        Return the (username, book_id) loans due in [low, high), in due-date order.
+        """
+        start = 0 if low is None else bisect_left(self.seconds, self._second(low))
+        end = len(self.seconds) if high is None else bisect_right(self.seconds, self._second(high))
+        loans = []
+        for slot in self.slots[start:end]:
+            due_date = self.table._due_date(slot)
+            # Entries share a second with the bounds; compare the exact due dates there.
+            if (low is None or due_date >= low) and (high is None or due_date < high):
+                loans.append(self.table._loan(slot))
+        return loans
+
+    def largest(self, n):
+        """
+        Return the n loans due last, latest first.
+        """
+        if n <= 0:
+            return []
+        return [self.table._loan(slot) for slot in reversed(self.slots[-n:])]
+
+class HoldQueue:
+    """
+    Users waiting for a copy of one book. Each priority level (lower numbers
+    are served first) is a FIFO deque of (username, ticket) entries with
+    consecutive tickets. A cancelled hold stays queued until it reaches the
+    front, so a user's position is worked out from ticket numbers rather
+    than by walking the queue.
+    """
+
+    def __init__(self):
+        """
+        Initialize a new HoldQueue instance.
+        """
+        self.levels = {}  # {priority: deque([(username, ticket)])}
+        self.holds = {}  # {username: (priority, ticket, expires_at)}
+        self._next_ticket = {}  # {priority: ticket for the next hold}
+        self._cancelled = {}  # {priority: sorted tickets of cancelled holds still queued}
+
+    def __len__(self):
+        return len(self.holds)
+
+    def __contains__(self, username):
+        return username in self.holds
+
+    def add(self, username, priority, expires_at):
+        """
+        Queue a hold behind every hold of the same or a more urgent priority.
+        """
+        if priority not in self.levels:
+            self.levels[priority] = deque()
+            self._next_ticket[priority] = 0
+            self._cancelled[priority] = []
+        ticket = self._next_ticket[priority]
+        self._next_ticket[priority] = ticket + 1
+        self.levels[priority].append((username, ticket))
+        self.holds[username] = (priority, ticket, expires_at)
+
+    def cancel(self, username):
+        """
+        Withdraw a user's hold.
+        """
+        priority, ticket, _ = self.holds.pop(username)
+        insort(self._cancelled[priority], ticket)
+        self._prune(priority)
+
+    def _prune(self, priority):
+        """Drop cancelled holds from the front of a level, and the level itself once it is empty."""
+        level = self.levels[priority]
+        cancelled = self._cancelled[priority]
+        while level and cancelled and level[0][1] == cancelled[0]:
+            level.popleft()
+            cancelled.pop(0)
+        if not level:
+            del self.levels[priority], self._next_ticket[priority], self._cancelled[priority]
+
+    def pop(self, now):
+        """
+        Remove and return the user whose hold is next, or None if there is
+        none. Holds that expired before now are dropped on the way.
+        """
+        while self.levels:
+            priority = min(self.levels)
+            username, _ = self.levels[priority].popleft()
+            _, _, expires_at = self.holds.pop(username)
+            self._prune(priority)
+            if expires_at > now:
+                return username
+        return None
+
+    def position(self, username):
         """
-        self.loans = {}  # {username: {book_id: due_date}}
+        Return a user's 1-based place in the queue. Expired holds ahead of
+        it are counted until they reach the front.
+        """
+        priority, ticket, _ = self.holds[username]
+        ahead = sum(len(level) - len(self._cancelled[level_priority])
+                    for level_priority, level in self.levels.items() if level_priority < priority)
+        head = self.levels[priority][0][1]
+        return ahead + ticket - head - bisect_left(self._cancelled[priority], ticket) + 1
+
+    def entries(self):
+        """
+        Return (username, priority, expires_at) for every hold, in the order they will be served.
+        """
+        return [(username, priority, self.holds[username][2])
+                for priority in sorted(self.levels)
+                for username, ticket in self.levels[priority]
+                if self.holds.get(username, (None, None))[:2] == (priority, ticket)]
+
+class Loans(Observable):
+    """
+    Manages book loans in the library system.
+
+    Safe to use from many threads. Each borrow or return holds the lock
+    stripe of its user and then of its book, so operations on different
+    users and books run in parallel while availability checks and updates
+    for one book are serialised. The shared loan map and due-date index are
+    only held for the moment it takes to update them.
+    """
+
+    LOCK_STRIPES = 64
+    HANDOVER_DAYS = 14  # loan period when a returned copy goes to the next hold
+
+    def __init__(self, compact=False):
+        """
+        Initialize a new Loans instance. With compact=True loans are kept in
+        an array-backed LoanTable, which uses far less memory per loan.
+        """
+        if compact:
+            self.loans = LoanTable()
+            self._due_index = CompactDueIndex(self.loans)
+        else:
+            self.loans = {}  # {username: {book_id: due_date}}
+            self._due_index = SortedIndex()  # (due_date, (username, book_id))
+        # {book_id: {username: due_date}}, kept in step with loans; a LoanTable indexes its own holders.
+        self._holders = None if compact else {}
+        self._holds = {}  # {book_id: HoldQueue}
+        self._observers = []
+        self._user_locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        self._book_locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        self._state_lock = threading.Lock()
+
+    def _user_lock(self, username):
+        """Return the lock stripe guarding a user's loans."""
+        return self._user_locks[hash(username) % self.LOCK_STRIPES]
+
+    def _book_lock(self, book_id):
+        """Return the lock stripe guarding a book's available copies."""
+        return self._book_locks[hash(book_id) % self.LOCK_STRIPES]
 
     def borrow_book(self, user, book, days=14):
         """
@@ -250,34 +1730,265 @@ class Loans:
         if not isinstance(user, User) or not isinstance(book, Book):
             raise ValueError("Invalid user or book object")
         
-        if book.get_available_copies() <= 0:
-            raise ValueError("No available copies of this book")
-        
         username = user.get_username()
         book_id = book.book_id
         
-        if username not in self.loans:
-            self.loans[username] = {}
-        
-        if book_id in self.loans[username]:
-            raise ValueError("User already has this book on loan")
-        
-        due_date = datetime.now() + timedelta(days=days)
-        self.loans[username][book_id] = due_date
-        book.available_copies -= 1
+        with self._user_lock(username), self._book_lock(book_id):
+            if book.get_available_copies() <= 0:
+                raise ValueError("No available copies of this book")
+            
+            if book_id in self.loans.get(username, {}):
+                raise ValueError("User already has this book on loan")
+            
+            due_date = datetime.now() + timedelta(days=days)
+            self._add_loan(username, book_id, due_date)
+            book._change_available(-1)
+            self._notify("borrow_book", username=username, book_id=book_id, due_date=due_date)
+
+    def _add_loan(self, username, book_id, due_date):
+        """Record a loan in the loan map, the holder index and the due-date index."""
+        with self._state_lock:
+            self._record_loan(username, book_id, due_date)
+
+    def _record_loan(self, username, book_id, due_date):
+        """Record a loan, fulfilling any hold the user had on the book; the caller holds the state lock."""
+        self.loans.setdefault(username, {})[book_id] = due_date
+        if self._holders is not None:
+            self._holders.setdefault(book_id, {})[username] = due_date
+        try:
+            self._due_index.add(due_date, (username, book_id))
+        except Exception:
+            # Leave no half-recorded loan behind if the due date cannot be indexed.
+            del self.loans[username][book_id]
+            self._drop_holder(username, book_id)
+            raise
+        queue = self._holds.get(book_id)
+        if queue is not None and username in queue:
+            self._drop_hold(queue, username, book_id)
 
     def return_book(self, user, book):
         """
-        Un-assign a book previously assigned to a user.
+        Un-assign a book previously assigned to a user. If anyone has a hold
+        on the book, the copy is lent straight to the next of them; returns
+        that user's username, or None.
         """
         username = user.get_username()
         book_id = book.book_id
         
-        if username not in self.loans or book_id not in self.loans[username]:
-            raise ValueError("This book is not on loan to this user")
-        
+        with self._user_lock(username), self._book_lock(book_id):
+            if book_id not in self.loans.get(username, {}):
+                raise ValueError("This book is not on loan to this user")
+            
+            self._remove_loan(username, book_id)
+            book._change_available(1)
+            self._notify("return_book", username=username, book_id=book_id)
+            return self._hand_over(book)
+
+    def _hand_over(self, book):
+        """Lend a just-returned copy to the next unexpired hold, if any; the caller holds the book's stripe."""
+        book_id = book.book_id
+        if book_id not in self._holds:
+            return None
+        now = datetime.now()
+        with self._state_lock:
+            queue = self._holds[book_id]
+            username = queue.pop(now)
+            if not queue:
+                del self._holds[book_id]
+            if username is None:
+                return None
+            due_date = now + timedelta(days=self.HANDOVER_DAYS)
+            self._record_loan(username, book_id, due_date)
+        book._change_available(-1)
+        self._notify("borrow_book", username=username, book_id=book_id, due_date=due_date)
+        return username
+
+    def _remove_loan(self, username, book_id):
+        """Drop a loan from the loan map, the holder index and the due-date index."""
+        with self._state_lock:
+            self._drop_loan(username, book_id)
+
+    def _drop_loan(self, username, book_id):
+        """Drop a loan; the caller holds the state lock."""
+        due_date = self.loans[username][book_id]
+        self._due_index.remove(due_date, (username, book_id))
         del self.loans[username][book_id]
-        book.available_copies += 1
+        self._drop_holder(username, book_id)
+
+    def _drop_holder(self, username, book_id):
+        """Drop a loan from the holder index, if this Loans keeps one."""
+        if self._holders is None:
+            return
+        holders = self._holders[book_id]
+        del holders[username]
+        if not holders:
+            del self._holders[book_id]
+
+    def _lock_all(self, loans):
+        """Acquire the user stripes, then the book stripes, for a batch in a fixed order."""
+        users = sorted({hash(user.get_username()) % self.LOCK_STRIPES for user, _ in loans})
+        books = sorted({hash(book.book_id) % self.LOCK_STRIPES for _, book in loans})
+        locks = [self._user_locks[i] for i in users] + [self._book_locks[i] for i in books]
+        for lock in locks:
+            lock.acquire()
+        return locks
+
+    @staticmethod
+    def _check_batch(loans):
+        """Validate a batch of (user, book) pairs and return it as a list."""
+        loans = list(loans)
+        seen = set()
+        for user, book in loans:
+            if not isinstance(user, User) or not isinstance(book, Book):
+                raise ValueError("Invalid user or book object")
+            key = (user.get_username(), book.book_id)
+            if key in seen:
+                raise ValueError(f"Duplicate loan in batch: {key[0]} / {key[1]}")
+            seen.add(key)
+        return loans
+
+    def borrow_many(self, loans, days=14):
+        """
+        Assign many books at once from (user, book) pairs. Every pair is
+        checked before anything changes, and either all loans are made or
+        none are. Returns the due date.
+        """
+        loans = self._check_batch(loans)
+        locks = self._lock_all(loans)
+        try:
+            wanted = {}
+            for user, book in loans:
+                if book.book_id in self.loans.get(user.get_username(), {}):
+                    raise ValueError(f"User {user.get_username()} already has book {book.book_id} on loan")
+                wanted[book] = wanted.get(book, 0) + 1
+            for book, count in wanted.items():
+                if book.get_available_copies() < count:
+                    raise ValueError(f"Not enough available copies of book {book.book_id}")
+            
+            due_date = datetime.now() + timedelta(days=days)
+            with self._state_lock:
+                for user, book in loans:
+                    self._record_loan(user.get_username(), book.book_id, due_date)
+            for book, count in wanted.items():
+                book._change_available(-count)
+            self._notify("borrow_many", loans=[(user.get_username(), book.book_id) for user, book in loans],
+                         due_date=due_date)
+            return due_date
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def return_many(self, loans):
+        """
+        Un-assign many books at once from (user, book) pairs. Every pair must
+        be on loan; either all are returned or none are.
+        """
+        loans = self._check_batch(loans)
+        locks = self._lock_all(loans)
+        try:
+            returned = {}
+            for user, book in loans:
+                if book.book_id not in self.loans.get(user.get_username(), {}):
+                    raise ValueError(f"Book {book.book_id} is not on loan to user {user.get_username()}")
+                returned[book] = returned.get(book, 0) + 1
+            
+            with self._state_lock:
+                for user, book in loans:
+                    self._drop_loan(user.get_username(), book.book_id)
+            for book, count in returned.items():
+                book._change_available(count)
+            self._notify("return_many", loans=[(user.get_username(), book.book_id) for user, book in loans])
+            for book, count in returned.items():
+                for _ in range(count):
+                    if self._hand_over(book) is None:
+                        break
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def place_hold(self, user, book, priority=0, days=30):
+        """
+        Queue a user for the next copy of a book that has none available.
+        Holds with a lower priority number are served first, and holds of
+        equal priority in the order they were placed. The hold lapses after
+        the given number of days. Returns the user's place in the queue.
+        """
+        if not isinstance(user, User) or not isinstance(book, Book):
+            raise ValueError("Invalid user or book object")
+        if not isinstance(priority, int) or priority < 0:
+            raise ValueError("Priority must be a non-negative integer")
+        username = user.get_username()
+        book_id = book.book_id
+        
+        with self._user_lock(username), self._book_lock(book_id):
+            if book.get_available_copies() > 0:
+                raise ValueError("Copies of this book are available to borrow")
+            if book_id in self.loans.get(username, {}):
+                raise ValueError("User already has this book on loan")
+            now = datetime.now()
+            queue = self._holds.get(book_id)
+            if queue is not None and username in queue:
+                if queue.holds[username][2] > now:
+                    raise ValueError("User already has a hold on this book")
+                self._remove_hold(username, book_id)
+                self._notify("cancel_hold", username=username, book_id=book_id)
+            expires_at = now + timedelta(days=days)
+            self._add_hold(username, book_id, priority, expires_at)
+            self._notify("place_hold", username=username, book_id=book_id, priority=priority, expires_at=expires_at)
+            return self._holds[book_id].position(username)
+
+    def _add_hold(self, username, book_id, priority, expires_at):
+        """Queue a hold unless the user already has one on the book."""
+        with self._state_lock:
+            queue = self._holds.setdefault(book_id, HoldQueue())
+            if username not in queue:
+                queue.add(username, priority, expires_at)
+
+    def _remove_hold(self, username, book_id):
+        """Withdraw a hold if it exists."""
+        with self._state_lock:
+            queue = self._holds.get(book_id)
+            if queue is not None and username in queue:
+                self._drop_hold(queue, username, book_id)
+
+    def _drop_hold(self, queue, username, book_id):
+        """Withdraw a hold; the caller holds the state lock."""
+        queue.cancel(username)
+        if not queue:
+            del self._holds[book_id]
+
+    def cancel_hold(self, user, book):
+        """
+        Withdraw a user's hold on a book.
+        """
+        username = user.get_username()
+        book_id = book.book_id
+        
+        with self._user_lock(username), self._book_lock(book_id):
+            queue = self._holds.get(book_id)
+            if queue is None or username not in queue:
+                raise ValueError("User has no hold on this book")
+            self._remove_hold(username, book_id)
+            self._notify("cancel_hold", username=username, book_id=book_id)
+
+    def get_hold_position(self, user, book):
+        """
+        Return the user's 1-based place in the queue for a book.
+        """
+        with self._state_lock:
+            queue = self._holds.get(book.book_id)
+            username = user.get_username()
+            if queue is None or username not in queue or queue.holds[username][2] <= datetime.now():
+                raise ValueError("User has no hold on this book")
+            return queue.position(username)
+
+    def get_hold_count(self, book):
+        """
+        Return the number of holds queued for a book, including any that
+        have expired but not yet reached the front.
+        """
+        queue = self._holds.get(book.book_id)
+        return 0 if queue is None else len(queue)
 
     def get_user_loan_count(self, user):
         """
@@ -286,31 +1997,129 @@ class Loans:
         username = user.get_username()
         return len(self.loans.get(username, {}))
 
+    def get_book_holders(self, book):
+        """
+        Return {username: due_date} for everyone who has a copy of the book on loan.
+        """
+        with self._state_lock:
+            if self._holders is None:
+                return self.loans.holders(book.book_id)
+            return dict(self._holders.get(book.book_id, {}))
+
+    def is_on_loan(self, book):
+        """
+        Return True if any copy of the book is on loan.
+        """
+        if self._holders is None:
+            with self._state_lock:
+                return self.loans.is_lent(book.book_id)
+        return book.book_id in self._holders
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold every user and book lock stripe for the duration of a with block.
+        No borrow, return or hand-over runs meanwhile, so the loans from
+        snapshot() and the books' available copies read inside it agree.
+        """
+        locks = self._user_locks + self._book_locks
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def snapshot(self):
+        """
+        Return (loans, holds) copied at one instant: loans as (username,
+        book_id, due_date) tuples and holds as (book_id, username, priority,
+        expires_at) tuples, in the order they will be served.
+        """
+        with self._state_lock:
+            loans = [(username, book_id, due_date)
+                     for username, books in self.loans.items()
+                     for book_id, due_date in books.items()]
+            holds = [(book_id, username, priority, expires_at)
+                     for book_id, queue in self._holds.items()
+                     for username, priority, expires_at in queue.entries()]
+        return loans, holds
+
     def get_overdue_books(self, user_list):
         """
         Print out all overdue books along with the users' username and first name.
         """
-        overdue_loans = []
-        current_date = datetime.now()
-        
-        for username, books in self.loans.items():
-            user = user_list.get_user_by_username(username)
-            for book_id, due_date in books.items():
-                if current_date > due_date:
-                    overdue_loans.append({
-                        'username': username,
-                        'firstname': user.get_firstname(),
-                        'book_id': book_id,
-                        'due_date': due_date
-                    })
-        
-        return overdue_loans
-
-def main():
-    book_list = BookList()
-    user_list = UserList()
-    loans = Loans()
+        return self._describe_loans(None, datetime.now(), user_list)
 
+    def get_books_due_within(self, days, user_list):
+        """
+        Return the loans that fall due within the next number of days, soonest first.
+        """
+        if not isinstance(days, (int, float)) or days < 0:
+            raise ValueError("Days must be a non-negative number")
+        current_date = datetime.now()
+        return self._describe_loans(current_date, current_date + timedelta(days=days), user_list)
+
+    def _describe_loans(self, low, high, user_list):
+        """Build records for the loans due in [low, high), looking each borrower up once."""
+        with self._state_lock:
+            loans = [(username, book_id, self.loans[username][book_id])
+                     for username, book_id in self._due_index.range(low, high)]
+        users = {}
+        records = []
+        for username, book_id, due_date in loans:
+            if username not in users:
+                users[username] = user_list.get_user_by_username(username)
+            records.append({
+                'username': username,
+                'firstname': users[username].get_firstname(),
+                'book_id': book_id,
+                'due_date': due_date
+            })
+        return records
+
+def main(data_dir=None, compact=False, metrics=False, sqlite=None, batch=None, stop_on_error=False):
+    if sqlite is not None and (data_dir is not None or compact):
+        raise ValueError("A SQLite database cannot be combined with a data directory or compact loans")
+    db = None
+    if sqlite is not None:
+        from sqlite_backend import open_library
+        db, book_list, user_list, loans = open_library(sqlite)
+    else:
+        book_list = BookList()
+        user_list = UserList()
+        loans = Loans(compact=compact)
+    storage = None
+    if data_dir is not None:
+        from storage import LibraryStorage
+        storage = LibraryStorage(data_dir, book_list, user_list, loans)
+        storage.open()
+    registry = None
+    if metrics:
+        from metrics import MetricsRegistry
+        registry = MetricsRegistry()
+        registry.instrument(book_list, user_list, loans)
+
+    failed = 0
+    try:
+        if batch is None:
+            run_menu(book_list, user_list, loans)
+        else:
+            from batch import run_batch_file
+            from library_service import LibraryService
+            failed = run_batch_file(LibraryService(book_list, user_list, loans, registry), batch, stop_on_error)
+    finally:
+        if storage is not None:
+            storage.close()
+        if db is not None:
+            db.close()
+        if registry is not None:
+            # Batch output on stdout is JSON Lines, so the report goes to stderr.
+            print(registry.report(), file=sys.stdout if batch is None else sys.stderr)
+    return failed
+
+def run_menu(book_list, user_list, loans):
     while True:
         print("\nLibrary Management System")
         print("1. Manage Books")
@@ -321,7 +2130,7 @@ def main():
         choice = input("Enter your choice: ")
         
         if choice == '1':
-            manage_books(book_list)
+            manage_books(book_list, loans)
         elif choice == '2':
             manage_users(user_list)
         elif choice == '3':
@@ -332,7 +2141,7 @@ def main():
         else:
             print("Invalid choice. Please try again.")
 
-def manage_books(book_list):
+def manage_books(book_list, loans):
     while True:
         print("\nManage Books")
         print("1. Add a book")
@@ -348,7 +2157,7 @@ def manage_books(book_list):
         elif choice == '2':
             modify_book(book_list)
         elif choice == '3':
-            remove_book(book_list)
+            remove_book(book_list, loans)
         elif choice == '4':
             search_book(book_list)
         elif choice == '5':
@@ -365,9 +2174,13 @@ def add_book(book_list):
     pub_date = input("Enter publication date (YYYY-MM-DD): ")
     publication_date = datetime.strptime(pub_date, "%Y-%m-%d")
     
-    new_book = Book(title, author, year, publisher, num_copies, publication_date)
-    book_list.add_book(new_book)
-    print("Book added successfully.")
+    new_book = Book(title, author, year, publisher, num_copies, publication_date,
+                    id_allocator=book_list.id_allocator)
+    try:
+        book_list.add_book(new_book)
+        print("Book added successfully.")
+    except ValueError as e:
+        print(str(e))
 
 def modify_book(book_list):
     title = input("Enter the title of the book to modify: ")
@@ -416,20 +2229,23 @@ def modify_book(book_list):
     
     print("Book modified successfully.")
 
-def remove_book(book_list):
+def remove_book(book_list, loans):
     title = input("Enter the title of the book to remove: ")
     try:
-        book_list.remove_book(title)
+        book_list.remove_book(title, loans)
         print("Book removed successfully.")
     except ValueError as e:
         print(str(e))
 
+SEARCH_PAGE_SIZE = 10
+
 def search_book(book_list):
     print("\nSearch Book")
     print("1. Search by title")
     print("2. Search by author")
     print("3. Search by publisher")
     print("4. Search by publication date")
+    print("5. Search by several fields")
     
     choice = input("Enter your choice: ")
     
@@ -445,11 +2261,55 @@ def search_book(book_list):
     elif choice == '4':
         query = input("Enter publication date (YYYY-MM-DD) to search: ")
         search_type = "publication_date"
+    elif choice == '5':
+        find_books(book_list)
+        return
     else:
         print("Invalid choice.")
         return
     
-    results = book_list.search_book(query, search_type)
+    order_by = input("Order by (title/year/availability, blank for none): ").lower() or None
+    cursor = None
+    shown = 0
+    while True:
+        try:
+            results, cursor = book_list.search_book_page(query, search_type, SEARCH_PAGE_SIZE, cursor, order_by)
+        except ValueError as e:
+            print(str(e))
+            return
+        if not results and not shown:
+            print("No books found matching the search criteria.")
+            return
+        if not shown:
+            print("\nSearch Results:")
+        for book in results:
+            print(f"Title: {book.get_title()}, Author: {book.get_author()}, Year: {book.get_year()}, "
+                  f"Available: {book.get_available_copies()}")
+        shown += len(results)
+        if cursor is None or input("Press Enter for more results, or q to stop: ").lower() == 'q':
+            return
+
+
+def find_books(book_list):
+    print("\nSearch by Several Fields (leave a field blank to ignore it)")
+    criteria = {
+        "title": input("Title contains: "),
+        "author": input("Author contains: "),
+        "publisher": input("Publisher contains: "),
+    }
+    criteria = {field: value for field, value in criteria.items() if value}
+    try:
+        for field, prompt in (("start_date", "Published on or after (YYYY-MM-DD): "),
+                              ("end_date", "Published on or before (YYYY-MM-DD): ")):
+            value = input(prompt)
+            if value:
+                criteria[field] = datetime.strptime(value, "%Y-%m-%d")
+        if input("Only books with copies available? (y/n): ").lower() == 'y':
+            criteria["available"] = True
+        results = list(book_list.find_books(**criteria))
+    except ValueError as e:
+        print(str(e))
+        return
     if results:
         print("\nSearch Results:")
         for book in results:
@@ -465,7 +2325,8 @@ def manage_users(user_list):
         print("2. Modify a user")
         print("3. Remove a user")
         print("4. View user details")
-        print("5. Back to main menu")
+        print("5. Find users")
+        print("6. Back to main menu")
         
         choice = input("Enter your choice: ")
         
@@ -478,6 +2339,8 @@ def manage_users(user_list):
         elif choice == '4':
             view_user_details(user_list)
         elif choice == '5':
+            find_users(user_list)
+        elif choice == '6':
             break
         else:
             print("Invalid choice. Please try again.")
@@ -522,13 +2385,13 @@ def modify_user(user_list):
         user.set_surname(new_surname)
     elif choice == '3':
         new_house_number = input("Enter new house number: ")
-        user.house_number = new_house_number
+        user.set_house_number(new_house_number)
     elif choice == '4':
         new_street_name = input("Enter new street name: ")
-        user.street_name = new_street_name
+        user.set_street_name(new_street_name)
     elif choice == '5':
         new_postcode = input("Enter new postcode: ")
-        user.postcode = new_postcode
+        user.set_postcode(new_postcode)
     else:
         print("Invalid choice.")
         return
@@ -556,6 +2419,27 @@ def view_user_details(user_list):
     except ValueError:
         print("User not found.")
 
+def find_users(user_list):
+    print("\nFind Users (leave a field blank to ignore it)")
+    criteria = {
+        "firstname": input("First name: "),
+        "surname": input("Surname: "),
+        "email": input("Email address: "),
+        "postcode": input("Postcode: "),
+    }
+    try:
+        users = user_list.find_users(**{field: value for field, value in criteria.items() if value})
+    except ValueError as e:
+        print(str(e))
+        return
+    if users:
+        print("\nMatching Users:")
+        for user in users:
+            print(f"Username: {user.get_username()}, Name: {user.get_firstname()} {user.get_surname()}, "
+                  f"Email: {user.get_email()}, Postcode: {user.get_postcode()}")
+    else:
+        print("No users found matching the search criteria.")
+
 def manage_loans(loans, book_list, user_list):
     while True:
         print("\nManage Loans")
@@ -609,6 +2493,12 @@ def borrow_book(loans, book_list, user_list):
         print("Book borrowed successfully.")
     except ValueError as e:
         print(str(e))
+        if book.get_available_copies() <= 0 and input("Place a hold on this book? (y/n): ").lower() == 'y':
+            try:
+                position = loans.place_hold(user, book)
+                print(f"Hold placed. Position in queue: {position}")
+            except ValueError as e:
+                print(str(e))
 
 def return_book(loans, book_list, user_list):
     username = input("Enter the username of the borrower: ")
@@ -635,8 +2525,10 @@ def return_book(loans, book_list, user_list):
         book = books[0]
     
     try:
-        loans.return_book(user, book)
+        next_user = loans.return_book(user, book)
         print("Book returned successfully.")
+        if next_user is not None:
+            print(f"The copy has been lent to {next_user}, who had a hold on it.")
     except ValueError as e:
         print(str(e))
 
@@ -664,4 +2556,17 @@ def view_overdue_books(loans, user_list):
         print("No overdue books found.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="Library Management System")
+    parser.add_argument("--data-dir", help="directory for the durable write-ahead log and snapshots")
+    parser.add_argument("--compact", action="store_true", help="keep loans in the compact array-backed table")
+    parser.add_argument("--metrics", action="store_true", help="print operation call counts and latencies on exit")
+    parser.add_argument("--sqlite", help="keep books, users and loans in this SQLite database file")
+    parser.add_argument("--batch", metavar="FILE", help="run the commands in FILE (- for standard input) instead of the menu")
+    parser.add_argument("--stop-on-error", action="store_true", help="stop a batch at the first command that fails")
+    args = parser.parse_args()
+    # Run the imported module's main so that Book and User here are the
+    # same classes the storage backends import.
+    import book_management
+    if book_management.main(args.data_dir, args.compact, args.metrics, args.sqlite, args.batch, args.stop_on_error):
+        sys.exit(1)
\ No newline at end of file
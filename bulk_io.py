@@ -0,0 +1,222 @@
+import csv
+import json
+from datetime import datetime
+from functools import lru_cache
+
+from book_management import Book, User
+from storage import BOOK_FIELDS, USER_FIELDS, book_to_record, user_to_record
+
+BOOK_COLUMNS = ("book_id",) + BOOK_FIELDS + ("available_copies", "times_borrowed")
+USER_COLUMNS = ("username",) + USER_FIELDS
+
+
+class ImportReport:
+    """
+    Outcome of a bulk import: how many rows were read and imported, and the
+    errors for rejected rows (only the first max_errors are kept).
+    """
+
+    def __init__(self, max_errors=1000):
+        """
+        Initialize a new ImportReport instance.
+        """
+        self.rows = 0
+        self.imported = 0
+        self.error_count = 0
+        self.errors = []  # [(row number, message)]
+        self.max_errors = max_errors
+
+    def add_error(self, row_number, message):
+        """
+        Record a rejected row.
+        """
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((row_number, message))
+
+    def __repr__(self):
+        return f"ImportReport(rows={self.rows}, imported={self.imported}, errors={self.error_count})"
+
+
+@lru_cache(maxsize=8192)
+def parse_date(text):
+    """
+    Parse a YYYY-MM-DD date (a longer ISO timestamp is cut to its date part).
+    Feeds repeat the same dates constantly, so results are cached.
+    """
+    return datetime.strptime(text[:10], "%Y-%m-%d")
+
+
+def _as_date(value):
+    return value if isinstance(value, datetime) else parse_date(str(value))
+
+
+def _as_int(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    return int(str(value).strip())
+
+
+def _detect_format(path, fmt):
+    """Return 'csv' or 'jsonl', inferring it from the file extension when not given."""
+    if fmt is None:
+        fmt = "csv" if str(path).lower().endswith(".csv") else "jsonl"
+    if fmt not in ("csv", "jsonl"):
+        raise ValueError(f"Unsupported format: {fmt}")
+    return fmt
+
+
+def _read_rows(source, fmt):
+    """Yield (row number, row) pairs from an open file; JSON Lines rows are left undecoded."""
+    if fmt == "csv":
+        yield from enumerate(csv.DictReader(source), start=2)
+    else:
+        for row_number, line in enumerate(source, start=1):
+            if line.strip():
+                yield row_number, line
+
+
+def _open(path_or_file, mode):
+    """Return (file, should_close) for a path or an already open file."""
+    if hasattr(path_or_file, "read") or hasattr(path_or_file, "write"):
+        return path_or_file, False
+    return open(path_or_file, mode, encoding="utf-8", newline=""), True
+
+
+def _row_error(error):
+    """Return the message reported for a row that could not be imported."""
+    if isinstance(error, KeyError):
+        return f"Missing column: {error}"
+    if isinstance(error, (TypeError, ValueError)):
+        return str(error)
+    return f"{type(error).__name__}: {error}"
+
+
+def _import(source, fmt, build, add_batch, exists, batch_size, max_errors):
+    """Stream rows from source, building and inserting entities in batches."""
+    report = ImportReport(max_errors)
+    f, should_close = _open(source, "r")
+    fmt = _detect_format(getattr(f, "name", source), fmt)
+    batch = []
+    batch_keys = set()
+    try:
+        for row_number, row in _read_rows(f, fmt):
+            report.rows += 1
+            try:
+                if isinstance(row, str):
+                    row = json.loads(row)
+                key, entity = build(row)
+                if key in batch_keys or exists(key):
+                    raise ValueError(f"Duplicate key: {key}")
+            except Exception as e:
+                # Whatever a malformed row raises, only that row is rejected.
+                report.add_error(row_number, _row_error(e))
+                continue
+            batch.append(entity)
+            batch_keys.add(key)
+            if len(batch) >= batch_size:
+                add_batch(batch)
+                report.imported += len(batch)
+                batch, batch_keys = [], set()
+        if batch:
+            add_batch(batch)
+            report.imported += len(batch)
+    finally:
+        if should_close:
+            f.close()
+    return report
+
+
+def _book_from_row(row, id_allocator=None):
+    """
+    Build a Book from an import row, validating it with the Book setters.
+    Every field is checked before a new ID is allocated, so rejected rows
+    leave no gaps in the IDs.
+    """
+    num_copies = _as_int(row["num_copies"])
+    available = None
+    if row.get("available_copies") not in (None, ""):
+        available = _as_int(row["available_copies"])
+        if available < 0 or available > num_copies:
+            raise ValueError("Available copies must be between 0 and the number of copies")
+    times_borrowed = None
+    if row.get("times_borrowed") not in (None, ""):
+        times_borrowed = _as_int(row["times_borrowed"])
+        if times_borrowed < 0:
+            raise ValueError("Times borrowed must be a non-negative integer")
+    book = Book(row["title"], row["author"], _as_int(row["year"]), row["publisher"], num_copies,
+                _as_date(row["publication_date"]),
+                book_id=str(row["book_id"]) if row.get("book_id") else None, id_allocator=id_allocator)
+    if available is not None:
+        book.available_copies = available
+    if times_borrowed is not None:
+        book.times_borrowed = times_borrowed
+    return book.book_id, book
+
+
+def _user_from_row(row):
+    """Build a User from an import row, validating it with the User setters."""
+    username = row["username"]
+    if not isinstance(username, str) or not username:
+        raise ValueError("Username must be a non-empty string")
+    user = User(username, row["firstname"], row["surname"], str(row["house_number"]),
+                row["street_name"], row["postcode"], row["email"], _as_date(row["date_of_birth"]))
+    return username, user
+
+
+def import_books(source, book_list, fmt=None, batch_size=1000, max_errors=1000):
+    """
+    Stream books from a CSV or JSON Lines file (path or open file) into a
+    BookList in batches. Rows that fail validation or reuse an existing
+    book_id are skipped and reported.
+    """
+    return _import(source, fmt, lambda row: _book_from_row(row, book_list.id_allocator), book_list.add_books,
+                   lambda book_id: book_id in book_list.books, batch_size, max_errors)
+
+
+def import_users(source, user_list, fmt=None, batch_size=1000, max_errors=1000):
+    """
+    Stream users from a CSV or JSON Lines file (path or open file) into a
+    UserList in batches. Rows that fail validation or reuse an existing
+    username are skipped and reported.
+    """
+    return _import(source, fmt, _user_from_row, user_list.add_users,
+                   lambda username: username in user_list.users, batch_size, max_errors)
+
+
+def _export(records, columns, destination, fmt):
+    """Stream records to a CSV or JSON Lines file and return how many were written."""
+    f, should_close = _open(destination, "w")
+    fmt = _detect_format(getattr(f, "name", destination), fmt)
+    count = 0
+    try:
+        if fmt == "csv":
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            for record in records:
+                writer.writerow(record)
+                count += 1
+        else:
+            for record in records:
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+                count += 1
+    finally:
+        if should_close:
+            f.close()
+    return count
+
+
+def export_books(book_list, destination, fmt=None):
+    """
+    Write every book to a CSV or JSON Lines file, one record at a time.
+    """
+    return _export((book_to_record(book) for book in book_list.books.values()),
+                   BOOK_COLUMNS, destination, fmt)
+
+
+def export_users(user_list, destination, fmt=None):
+    """
+    Write every user to a CSV or JSON Lines file, one record at a time.
+    """
+    return _export((user_to_record(user) for user in user_list.users.values()),
+                   USER_COLUMNS, destination, fmt)
@@ -0,0 +1,322 @@
+import mmap
+import struct
+from array import array
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta
+
+from book_management import Book, BookList
+
+# File layout (little-endian):
+#   header: magic, version, row count, next book ID number
+#   for each string field: row_count + 1 heap offsets (uint64); field i of row r
+#       is heap[offsets[r]:offsets[r + 1]], UTF-8 encoded
+#   for each int field (year, copies, available copies, times borrowed):
+#       row_count int32 values
+#   publication dates: row_count int64 microseconds since datetime.min
+#   string heap
+# Every column starts on an 8-byte boundary and rows are sorted by book_id so
+# a record can be found by binary search without loading an index.
+MAGIC = b"LMSCAT\x00\x01"
+VERSION = 3
+HEADER = struct.Struct("<8sIxxxxQQ")
+STRING_FIELDS = ("book_id", "title", "author", "publisher")
+INT_FIELDS = ("year", "num_copies", "available_copies", "times_borrowed")
+INT_RANGE = (-2**31, 2**31 - 1)
+EPOCH = datetime.min
+
+
+def _padded(size):
+    """Round a byte count up to the next multiple of eight."""
+    return (size + 7) & ~7
+
+
+def _layout(row_count):
+    """Return the byte offset of every column and of the string heap."""
+    offsets = {}
+    position = _padded(HEADER.size)
+    for field in STRING_FIELDS:
+        offsets[field] = position
+        position += _padded((row_count + 1) * 8)
+    for field in INT_FIELDS:
+        offsets[field] = position
+        position += _padded(row_count * 4)
+    offsets["publication_date"] = position
+    position += _padded(row_count * 8)
+    offsets["heap"] = position
+    return offsets
+
+
+def write_catalog(books, path):
+    """
+    Write books to a columnar catalog file that open_catalog can memory-map.
+    Nothing is written if a count or year does not fit in a 32-bit column.
+    """
+    encoded = sorted(((book.book_id.encode("utf-8"), book) for book in books), key=lambda item: item[0])
+    row_count = len(encoded)
+    layout = _layout(row_count)
+    heaps = {field: bytearray() for field in STRING_FIELDS}
+    string_offsets = {field: array("Q") for field in STRING_FIELDS}
+    ints = {field: array("i") for field in INT_FIELDS}
+    dates = array("q")
+    next_number = 1
+
+    for book_id, book in encoded:
+        number = Book.id_allocator.number(book.book_id)
+        if number is not None:
+            next_number = max(next_number, number + 1)
+        values = (book_id, book.title.encode("utf-8"), book.author.encode("utf-8"), book.publisher.encode("utf-8"))
+        for field, value in zip(STRING_FIELDS, values):
+            string_offsets[field].append(len(heaps[field]))
+            heaps[field] += value
+        for field in INT_FIELDS:
+            value = getattr(book, field)
+            if not INT_RANGE[0] <= value <= INT_RANGE[1]:
+                raise ValueError(f"The {field} of book {book.book_id} does not fit in a catalog file")
+            ints[field].append(value)
+        dates.append((book.publication_date - EPOCH) // timedelta(microseconds=1))
+
+    # Offsets are relative to each field's heap; make them absolute within the combined heap.
+    base = 0
+    for field in STRING_FIELDS:
+        column = string_offsets[field]
+        column.append(len(heaps[field]))
+        for i in range(len(column)):
+            column[i] += base
+        base += len(heaps[field])
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, row_count, next_number))
+        for field in STRING_FIELDS:
+            f.seek(layout[field])
+            f.write(string_offsets[field].tobytes())
+        for field in INT_FIELDS:
+            f.seek(layout[field])
+            f.write(ints[field].tobytes())
+        f.seek(layout["publication_date"])
+        f.write(dates.tobytes())
+        f.seek(layout["heap"])
+        for field in STRING_FIELDS:
+            f.write(heaps[field])
+
+
+class MappedCatalog(MutableMapping):
+    """
+    A {book_id: Book} mapping backed by a memory-mapped catalog file.
+
+    Records are read straight from the mapped columns. A Book is created the
+    first time a record is looked up by ID and kept so that later changes to
+    it stick; iterating over values() hands out short-lived copies of
+    untouched records instead, so scans do not grow memory. A copy that is
+    changed is kept from then on, or its change is applied to the book
+    already kept for that ID. Books added, replaced or removed after opening
+    live in memory only; the file is never written to.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize a new MappedCatalog instance over the given file.
+        """
+        self.path = path
+        self.book_list = None
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, row_count, next_number = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"Not a catalog file: {path}")
+        self.row_count = row_count
+        Book.id_allocator.advance(next_number)
+        layout = _layout(row_count)
+        view = memoryview(self._mm)
+        self._strings = {field: view[layout[field]:layout[field] + (row_count + 1) * 8].cast("Q")
+                         for field in STRING_FIELDS}
+        self._ints = {field: view[layout[field]:layout[field] + row_count * 4].cast("i")
+                      for field in INT_FIELDS}
+        self._dates = view[layout["publication_date"]:layout["publication_date"] + row_count * 8].cast("q")
+        self._heap = view[layout["heap"]:]
+        self._view = view
+        self._overlay = {}  # {book_id: Book} touched or added books
+        self._added = set()  # book_ids that are not in the file
+        self._deleted = set()  # book_ids in the file that have been removed
+
+    def _raw_string(self, field, row):
+        """Return the encoded bytes of a string field."""
+        offsets = self._strings[field]
+        return self._heap[offsets[row]:offsets[row + 1]]
+
+    def _string(self, field, row):
+        """Return the decoded value of a string field."""
+        return str(self._raw_string(field, row), "utf-8")
+
+    def _row(self, book_id):
+        """Return the row holding a book ID, or None, by binary search over the sorted ID column."""
+        key = book_id.encode("utf-8")
+        low, high = 0, self.row_count
+        while low < high:
+            middle = (low + high) // 2
+            if bytes(self._raw_string("book_id", middle)) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.row_count and self._raw_string("book_id", low) == key:
+            return low
+        return None
+
+    def _book(self, row, owner):
+        """Create a Book view of a row without re-running the setter validation."""
+        book = Book.__new__(Book)
+        book._book_list = owner
+        book.book_id = self._string("book_id", row)
+        book.title = self._string("title", row)
+        book.author = self._string("author", row)
+        book.publisher = self._string("publisher", row)
+        for field in INT_FIELDS:
+            setattr(book, field, self._ints[field][row])
+        book.publication_date = EPOCH + timedelta(microseconds=self._dates[row])
+        return book
+
+    def _keep(self, book):
+        """Return the Book kept for a changed copy's ID, keeping the copy itself if there is none yet."""
+        if book.book_id in self._deleted:
+            book._book_list = None
+            return None
+        kept = self._overlay.setdefault(book.book_id, book)
+        if kept is book:
+            book._book_list = self.book_list
+        return kept
+
+    def _on_book_changed(self, book, field, old_value, new_value):
+        """Keep a copy from items() once it is changed, so the change is not lost."""
+        kept = self._keep(book)
+        if kept is book:
+            if self.book_list is not None:
+                self.book_list._on_book_changed(book, field, old_value, new_value)
+        elif kept is not None:
+            kept._update_field(field, new_value)
+
+    def _on_availability_changed(self, book, delta):
+        """Keep a copy from items() once copies of it are lent or returned."""
+        kept = self._keep(book)
+        if kept is book:
+            if self.book_list is not None:
+                self.book_list._on_availability_changed(book, delta)
+        elif kept is not None:
+            kept._change_available(delta)
+
+    def __getitem__(self, book_id):
+        book = self._overlay.get(book_id)
+        if book is not None:
+            return book
+        if book_id in self._deleted:
+            raise KeyError(book_id)
+        row = self._row(book_id)
+        if row is None:
+            raise KeyError(book_id)
+        book = self._overlay[book_id] = self._book(row, self.book_list)
+        return book
+
+    def __contains__(self, book_id):
+        if book_id in self._overlay:
+            return True
+        return book_id not in self._deleted and self._row(book_id) is not None
+
+    def __setitem__(self, book_id, book):
+        if book_id not in self._overlay and book_id not in self._deleted and self._row(book_id) is None:
+            self._added.add(book_id)
+        self._deleted.discard(book_id)
+        self._overlay[book_id] = book
+
+    def __delitem__(self, book_id):
+        if book_id not in self:
+            raise KeyError(book_id)
+        self._overlay.pop(book_id, None)
+        if book_id in self._added:
+            self._added.discard(book_id)
+        else:
+            self._deleted.add(book_id)
+
+    def __len__(self):
+        return self.row_count - len(self._deleted) + len(self._added)
+
+    def __iter__(self):
+        for row in range(self.row_count):
+            book_id = self._string("book_id", row)
+            if book_id not in self._deleted:
+                yield book_id
+        yield from list(self._added)
+
+    def items(self):
+        """
+        Yield (book_id, Book) pairs; untouched records are copies, which are
+        kept once they are changed.
+        """
+        for row in range(self.row_count):
+            book_id = self._string("book_id", row)
+            if book_id in self._deleted:
+                continue
+            book = self._overlay.get(book_id)
+            yield book_id, book if book is not None else self._book(row, self)
+        for book_id in list(self._added):
+            yield book_id, self._overlay[book_id]
+
+    def values(self):
+        """
+        Yield every Book; untouched records are copies, which are kept once
+        they are changed.
+        """
+        for _, book in self.items():
+            yield book
+
+    def column(self, field):
+        """
+        Yield (book_id, value) for one field of every book, reading untouched
+        records straight from the mapped column instead of creating Books.
+        """
+        for row in range(self.row_count):
+            book_id = self._string("book_id", row)
+            if book_id in self._deleted:
+                continue
+            book = self._overlay.get(book_id)
+            if book is not None:
+                yield book_id, getattr(book, field)
+            elif field in STRING_FIELDS:
+                yield book_id, self._string(field, row)
+            elif field in INT_FIELDS:
+                yield book_id, self._ints[field][row]
+            else:
+                yield book_id, EPOCH + timedelta(microseconds=self._dates[row])
+        for book_id in list(self._added):
+            yield book_id, getattr(self._overlay[book_id], field)
+
+    def materialized_count(self):
+        """
+        Return how many books are held in memory rather than read from the file.
+        """
+        return len(self._overlay)
+
+    def close(self):
+        """
+        Release the memory map. Books already materialised remain usable.
+        """
+        for column in getattr(self, "_strings", {}).values():
+            column.release()
+        for column in getattr(self, "_ints", {}).values():
+            column.release()
+        for name in ("_dates", "_heap", "_view"):
+            view = getattr(self, name, None)
+            if view is not None:
+                view.release()
+        self._mm.close()
+        self._file.close()
+
+
+def open_catalog(path):
+    """
+    Return a BookList over a memory-mapped catalog file. Nothing is read
+    until a book is looked up, and each search index is built from the
+    columns it covers the first time a query needs it.
+    """
+    catalog = MappedCatalog(path)
+    book_list = BookList(catalog)
+    catalog.book_list = book_list
+    return book_list
@@ -0,0 +1,244 @@
+import logging
+from itertools import islice
+
+from book_management import Book, User
+from storage import BOOK_FIELDS, USER_FIELDS, book_to_record, decode_value, format_datetime, user_to_record
+
+logger = logging.getLogger(__name__)
+
+
+class LibraryService:
+    """
+    Runs named library operations with JSON-style parameters and results,
+    so front-ends (the network server, batch scripts) share one dispatcher.
+    Every operation returns plain dicts, lists, strings and numbers.
+    """
+
+    def __init__(self, book_list, user_list, loans, metrics=None, searcher=None):
+        """
+        Initialize a new LibraryService instance. Pass a MetricsRegistry as
+        metrics to serve it through the metrics operation, and a
+        ShardedSearch as searcher to run searches on it instead of book_list.
+        """
+        self.book_list = book_list
+        self.user_list = user_list
+        self.loans = loans
+        self.metrics = metrics
+        self.searcher = book_list if searcher is None else searcher
+        self.operations = {
+            name[3:]: getattr(self, name) for name in dir(self) if name.startswith("op_")
+        }
+
+    def execute(self, operation, params=None):
+        """
+        Run one operation and return its result. Raises ValueError for
+        unknown operations, bad parameters and failed library operations.
+        """
+        handler = self.operations.get(operation)
+        if handler is None:
+            raise ValueError(f"Unknown operation: {operation}")
+        params = params or {}
+        if not isinstance(params, dict):
+            raise ValueError("Parameters must be an object")
+        try:
+            return handler(**params)
+        except TypeError as e:
+            raise ValueError(f"Invalid parameters for {operation}: {e}")
+        except KeyError as e:
+            raise ValueError(f"Not found: {e}")
+
+    def handle(self, request):
+        """
+        Run a request dict ({"op": ..., "params": ..., "id": ...}) and return
+        a response dict, reporting any error in the response instead of raising.
+        """
+        response = {}
+        if isinstance(request, dict) and "id" in request:
+            response["id"] = request["id"]
+        try:
+            if not isinstance(request, dict):
+                raise ValueError("Request must be an object")
+            response["result"] = self.execute(request.get("op"), request.get("params"))
+            response["ok"] = True
+        except ValueError as e:
+            response["ok"] = False
+            response["error"] = str(e)
+        except Exception as e:
+            # A bad parameter type can fail deep inside an operation; report it
+            # like any other error so one request cannot drop the connection,
+            # but log it, as it may also be a bug.
+            logger.exception("Unexpected error in operation %r", request.get("op"))
+            response["ok"] = False
+            response["error"] = f"{type(e).__name__}: {e}"
+        return response
+
+    # Helpers
+
+    def _book(self, book_id):
+        book = self.book_list.books.get(book_id)
+        if book is None:
+            raise ValueError(f"No book found with ID: {book_id}")
+        return book
+
+    @staticmethod
+    def _books(books):
+        return [book_to_record(book) for book in books]
+
+    @staticmethod
+    def _loans(records):
+        return [dict(record, due_date=format_datetime(record["due_date"])) for record in records]
+
+    # Books
+
+    def op_add_book(self, title, author, year, publisher, num_copies, publication_date, book_id=None):
+        book = Book(title, author, year, publisher, num_copies,
+                    decode_value("publication_date", publication_date), book_id=book_id,
+                    id_allocator=self.book_list.id_allocator)
+        self.book_list.add_book(book)
+        return book_to_record(book)
+
+    def op_update_book(self, book_id, field, value):
+        if field not in BOOK_FIELDS:
+            raise ValueError(f"Unknown book field: {field}")
+        book = self._book(book_id)
+        getattr(book, "set_" + field)(decode_value(field, value))
+        return book_to_record(book)
+
+    def op_remove_book(self, title):
+        return self.book_list.remove_book(title, self.loans)
+
+    def op_get_book(self, book_id):
+        return book_to_record(self._book(book_id))
+
+    def op_search_book(self, query, search_type="title", order_by=None, descending=False, offset=0, limit=None):
+        if order_by is None and not offset and limit is None:
+            return self._books(self.searcher.search_book(query, search_type))
+        return self._books(self.book_list.iter_search_book(query, search_type, order_by, descending, offset, limit))
+
+    def op_search_book_page(self, query, search_type="title", limit=20, cursor=None, order_by=None, descending=False):
+        books, cursor = self.book_list.search_book_page(query, search_type, limit, cursor, order_by, descending)
+        return {"books": self._books(books), "cursor": cursor}
+
+    def op_find_books(self, title=None, author=None, publisher=None, start_date=None, end_date=None, available=None,
+                      limit=None):
+        dates = [None if value is None else decode_value("publication_date", value) for value in (start_date, end_date)]
+        books = self.book_list.find_books(title, author, publisher, *dates, available=available)
+        return self._books(islice(books, limit))
+
+    def op_search_book_regex(self, pattern, search_type="title"):
+        return self._books(self.searcher.search_book_regex(pattern, search_type))
+
+    def op_typeahead(self, prefix, field="title", k=10, rank_by="popularity"):
+        return self._books(self.book_list.typeahead(prefix, field, k, rank_by))
+
+    def op_books_published_between(self, start_date, end_date):
+        return self._books(self.book_list.get_books_published_between(
+            decode_value("publication_date", start_date), decode_value("publication_date", end_date)))
+
+    def op_books_published_in_year(self, year):
+        return self._books(self.book_list.get_books_published_in_year(year))
+
+    def op_newest_books(self, n=10):
+        return self._books(self.book_list.get_newest_books(n))
+
+    def op_copy_totals(self, field, value=None):
+        if value is None:
+            return [dict(totals, value=key) for key, totals in self.book_list.get_all_copy_totals(field).items()]
+        return self.book_list.get_copy_totals(field, value)
+
+    def op_total_books(self):
+        return self.book_list.get_total_books()
+
+    # Users
+
+    def op_add_user(self, username, firstname, surname, house_number, street_name, postcode, email, date_of_birth):
+        user = User(username, firstname, surname, house_number, street_name, postcode, email,
+                    decode_value("date_of_birth", date_of_birth))
+        self.user_list.add_user(user)
+        return user_to_record(user)
+
+    def op_update_user(self, username, field, value):
+        if field not in USER_FIELDS:
+            raise ValueError(f"Unknown user field: {field}")
+        user = self.user_list.get_user_by_username(username)
+        getattr(user, "set_" + field)(decode_value(field, value))
+        return user_to_record(user)
+
+    def op_remove_user(self, firstname):
+        self.user_list.remove_user(firstname)
+        return True
+
+    def op_get_user(self, username):
+        return user_to_record(self.user_list.get_user_by_username(username))
+
+    def op_find_users(self, firstname=None, surname=None, email=None, postcode=None):
+        users = self.user_list.find_users(firstname=firstname, surname=surname, email=email, postcode=postcode)
+        return [user_to_record(user) for user in users]
+
+    def op_user_count(self):
+        return self.user_list.get_user_count()
+
+    # Loans
+
+    def op_borrow_book(self, username, book_id, days=14):
+        self.loans.borrow_book(self.user_list.get_user_by_username(username), self._book(book_id), days)
+        return format_datetime(self.loans.loans[username][book_id])
+
+    def op_return_book(self, username, book_id):
+        self.loans.return_book(self.user_list.get_user_by_username(username), self._book(book_id))
+        return True
+
+    def op_place_hold(self, username, book_id, priority=0, days=30):
+        return self.loans.place_hold(self.user_list.get_user_by_username(username), self._book(book_id), priority, days)
+
+    def op_cancel_hold(self, username, book_id):
+        self.loans.cancel_hold(self.user_list.get_user_by_username(username), self._book(book_id))
+        return True
+
+    def op_hold_position(self, username, book_id):
+        return self.loans.get_hold_position(self.user_list.get_user_by_username(username), self._book(book_id))
+
+    def op_hold_count(self, book_id):
+        return self.loans.get_hold_count(self._book(book_id))
+
+    def _pairs(self, loans):
+        return [(self.user_list.get_user_by_username(loan["username"]), self._book(loan["book_id"]))
+                for loan in loans]
+
+    def op_borrow_many(self, loans, days=14):
+        return format_datetime(self.loans.borrow_many(self._pairs(loans), days))
+
+    def op_return_many(self, loans):
+        self.loans.return_many(self._pairs(loans))
+        return True
+
+    def op_user_loans(self, username):
+        user = self.user_list.get_user_by_username(username)
+        books = self.loans.loans.get(user.get_username(), {})
+        return [{"book_id": book_id, "due_date": format_datetime(due_date)} for book_id, due_date in books.items()]
+
+    def op_book_holders(self, book_id):
+        holders = self.loans.get_book_holders(self._book(book_id))
+        return [{"username": username, "due_date": format_datetime(due_date)}
+                for username, due_date in holders.items()]
+
+    def op_overdue_books(self):
+        return self._loans(self.loans.get_overdue_books(self.user_list))
+
+    def op_books_due_within(self, days):
+        return self._loans(self.loans.get_books_due_within(days, self.user_list))
+
+    # Metrics
+
+    def op_metrics(self, format="json", reset=False):
+        if self.metrics is None:
+            raise ValueError("Metrics are not enabled")
+        if format == "json":
+            result = self.metrics.snapshot()
+        elif format == "prometheus":
+            result = self.metrics.prometheus()
+        else:
+            raise ValueError(f"Unknown metrics format: {format}")
+        if reset:
+            self.metrics.reset()
+        return result
@@ -0,0 +1,297 @@
+import functools
+import threading
+import time
+from bisect import bisect_left
+from collections.abc import Iterator
+
+# Upper bounds of the latency buckets in microseconds; the last bucket is unbounded.
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1_000, 2_000, 5_000, 10_000, 20_000, 50_000,
+                   100_000, 200_000, 500_000, 1_000_000, float("inf"))
+# Upper bounds of the result-size buckets (number of items returned).
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1_000, 10_000, 100_000, float("inf"))
+
+INSTRUMENTED_METHODS = {
+    "BookList": ("add_book", "add_books", "search_book", "iter_search_book", "search_book_page", "search_book_regex",
+                 "find_books", "typeahead",
+                 "remove_book", "get_total_books", "get_copy_totals", "get_all_copy_totals",
+                 "get_books_published_between", "get_books_published_in_year", "get_newest_books"),
+    "UserList": ("add_user", "add_users", "remove_user", "find_users", "get_user_count", "get_user_by_username"),
+    "Loans": ("borrow_book", "return_book", "borrow_many", "return_many", "place_hold", "cancel_hold",
+              "get_hold_position", "get_hold_count", "get_user_loan_count",
+              "get_book_holders", "is_on_loan", "get_overdue_books", "get_books_due_within"),
+}
+# The SQLite backend implements the same interfaces.
+INSTRUMENTED_METHODS.update({"SQLite" + name: methods for name, methods in list(INSTRUMENTED_METHODS.items())})
+
+
+class Histogram:
+    """
+    Counts observations in fixed buckets.
+    """
+
+    def __init__(self, bounds):
+        """
+        Initialize a new Histogram instance.
+        """
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+
+    def observe(self, value):
+        """
+        Count one observation.
+        """
+        self.counts[bisect_left(self.bounds, value)] += 1
+
+    def percentile(self, fraction):
+        """
+        Return the upper bound of the bucket holding the given fraction (0-1)
+        of observations, or None if nothing has been observed.
+        """
+        total = sum(self.counts)
+        if not total:
+            return None
+        target = fraction * total
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return self.bounds[-1]
+
+
+class OperationStats:
+    """
+    Call count, error count, latency and result-size histograms for one operation.
+    """
+
+    def __init__(self):
+        """
+        Initialize a new OperationStats instance.
+        """
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """
+        Discard everything recorded so far.
+        """
+        with self.lock:
+            self.calls = 0
+            self.errors = 0
+            self.total_us = 0.0
+            self.total_size = 0
+            self.latency = Histogram(LATENCY_BUCKETS)
+            self.result_sizes = Histogram(SIZE_BUCKETS)
+
+    def record(self, elapsed_us, size, failed):
+        """
+        Record one call.
+        """
+        with self.lock:
+            self.calls += 1
+            self.total_us += elapsed_us
+            self.latency.observe(elapsed_us)
+            if failed:
+                self.errors += 1
+            elif size is not None:
+                self.total_size += size
+                self.result_sizes.observe(size)
+
+    def summary(self):
+        """
+        Return the statistics as a JSON-serialisable dict.
+        """
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "mean_us": self.total_us / self.calls if self.calls else 0,
+                "p50_us": self.latency.percentile(0.5),
+                "p99_us": self.latency.percentile(0.99),
+                "latency_buckets_us": dict(zip(map(str, self.latency.bounds), self.latency.counts)),
+                "result_size_p50": self.result_sizes.percentile(0.5),
+                "result_size_buckets": dict(zip(map(str, self.result_sizes.bounds), self.result_sizes.counts)),
+            }
+
+
+class MeasuredIterator:
+    """
+    Wraps an iterator returned by an instrumented method. The call is
+    recorded once the iterator is exhausted, fails or is closed, with the
+    time spent producing items (not the time the caller spends between
+    them) and the number of items produced. An iterator that is abandoned
+    without being closed is not recorded.
+    """
+
+    def __init__(self, iterator, stats, elapsed):
+        """
+        Initialize a new MeasuredIterator instance; elapsed is the time in
+        seconds the call that returned the iterator took.
+        """
+        self._iterator = iterator
+        self._stats = stats
+        self._elapsed = elapsed
+        self._count = 0
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            item = next(self._iterator)
+        except StopIteration:
+            self._elapsed += time.perf_counter() - start
+            self._finish(False)
+            raise
+        except Exception:
+            self._elapsed += time.perf_counter() - start
+            self._finish(True)
+            raise
+        self._elapsed += time.perf_counter() - start
+        self._count += 1
+        return item
+
+    def _finish(self, failed):
+        """Record the call the first time the iterator ends."""
+        if not self._done:
+            self._done = True
+            self._stats.record(self._elapsed * 1_000_000, self._count, failed)
+
+    def close(self):
+        """
+        Stop iterating early and record the call.
+        """
+        close = getattr(self._iterator, "close", None)
+        if close is not None:
+            close()
+        self._finish(False)
+
+
+class MetricsRegistry:
+    """
+    Collects per-operation metrics from instrumented BookList, UserList and
+    Loans instances. Set enabled to False to pause collection; instrumented
+    methods then only pay for one attribute check.
+    """
+
+    def __init__(self, enabled=True):
+        """
+        Initialize a new MetricsRegistry instance.
+        """
+        self.enabled = enabled
+        self.operations = {}
+        self._lock = threading.Lock()
+
+    def stats(self, name):
+        """
+        Return the OperationStats for an operation, creating it on first use.
+        """
+        stats = self.operations.get(name)
+        if stats is None:
+            with self._lock:
+                stats = self.operations.setdefault(name, OperationStats())
+        return stats
+
+    def wrap(self, name, method):
+        """
+        Return method wrapped so that each call is recorded under name. An
+        iterator result is recorded once it has been consumed; see
+        MeasuredIterator.
+        """
+        stats = self.stats(name)
+
+        @functools.wraps(method)
+        def instrumented(*args, **kwargs):
+            if not self.enabled:
+                return method(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+            except Exception:
+                stats.record((time.perf_counter() - start) * 1_000_000, None, True)
+                raise
+            if isinstance(result, Iterator):
+                return MeasuredIterator(result, stats, time.perf_counter() - start)
+            size = len(result) if isinstance(result, (list, tuple, dict, set)) else None
+            stats.record((time.perf_counter() - start) * 1_000_000, size, False)
+            return result
+
+        instrumented.uninstrumented = method
+        return instrumented
+
+    def instrument(self, *collections):
+        """
+        Instrument the public operations of BookList, UserList and Loans instances.
+        """
+        for collection in collections:
+            class_name = type(collection).__name__
+            for method_name in INSTRUMENTED_METHODS.get(class_name, ()):
+                method = getattr(collection, method_name)
+                if hasattr(method, "uninstrumented"):
+                    continue
+                setattr(collection, method_name, self.wrap(f"{class_name}.{method_name}", method))
+
+    @staticmethod
+    def uninstrument(*collections):
+        """
+        Remove the instrumentation added by instrument().
+        """
+        for collection in collections:
+            for method_name in INSTRUMENTED_METHODS.get(type(collection).__name__, ()):
+                if hasattr(getattr(collection, method_name), "uninstrumented"):
+                    delattr(collection, method_name)
+
+    def reset(self):
+        """
+        Discard everything recorded so far. The stats objects are cleared in
+        place because instrumented methods hold on to them.
+        """
+        with self._lock:
+            for stats in self.operations.values():
+                stats.clear()
+
+    def snapshot(self):
+        """
+        Return every operation's statistics as a JSON-serialisable dict.
+        """
+        return {name: stats.summary() for name, stats in sorted(self.operations.items())}
+
+    def report(self):
+        """
+        Return a plain-text table of the operations that have been called.
+        """
+        lines = [f"{'operation':40} {'calls':>9} {'errors':>7} {'mean us':>10} {'p50 us':>9} {'p99 us':>9} {'size p50':>9}"]
+        for name, summary in self.snapshot().items():
+            if summary["calls"]:
+                size = summary["result_size_p50"]
+                lines.append(f"{name:40} {summary['calls']:9d} {summary['errors']:7d} {summary['mean_us']:10.1f} "
+                             f"{summary['p50_us']:9} {summary['p99_us']:9} {'-' if size is None else size:>9}")
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            "# TYPE library_operation_calls_total counter",
+            "# TYPE library_operation_errors_total counter",
+            "# TYPE library_operation_latency_microseconds histogram",
+            "# TYPE library_operation_result_size histogram",
+        ]
+        for name, stats in sorted(self.operations.items()):
+            label = f'operation="{name}"'
+            with stats.lock:
+                lines.append(f"library_operation_calls_total{{{label}}} {stats.calls}")
+                lines.append(f"library_operation_errors_total{{{label}}} {stats.errors}")
+                for metric, histogram, total in (("latency_microseconds", stats.latency, stats.total_us),
+                                                 ("result_size", stats.result_sizes, stats.total_size)):
+                    cumulative = 0
+                    for bound, count in zip(histogram.bounds, histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else bound
+                        lines.append(f'library_operation_{metric}_bucket{{{label},le="{le}"}} {cumulative}')
+                    lines.append(f"library_operation_{metric}_count{{{label}}} {cumulative}")
+                    lines.append(f"library_operation_{metric}_sum{{{label}}} {total:g}")
+        return "\n".join(lines) + "\n"
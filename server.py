@@ -0,0 +1,146 @@
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from book_management import BookList, Loans, UserList
+from library_service import LibraryService
+
+
+class LibraryServer:
+    """
+    asyncio server exposing a LibraryService over a JSON Lines protocol on
+    TCP or a Unix socket.
+
+    Each request is one line holding {"op": ..., "params": {...}, "id": ...};
+    each response is one line holding {"id": ..., "ok": true, "result": ...}
+    or {"id": ..., "ok": false, "error": ...}. Clients may pipeline: requests
+    on a connection are answered in order without waiting for each reply to
+    be read. A line holding a JSON array is a batch and is answered with an
+    array of responses. All connections share one library. Operations run
+    on a worker thread, one at a time by default as the collections do not
+    support concurrent writes, so a slow search or a disk or database write
+    never stalls the event loop serving the other connections.
+    """
+
+    def __init__(self, service, max_line=1 << 20, workers=1):
+        """
+        Initialize a new LibraryServer instance.
+        """
+        self.service = service
+        self.max_line = max_line
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="library-op")
+
+    def handle_line(self, line):
+        """
+        Decode one request line and return the encoded response line.
+        """
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            response = {"ok": False, "error": f"Invalid JSON: {e}"}
+        else:
+            if isinstance(request, list):
+                response = [self.service.handle(item) for item in request]
+            else:
+                response = self.service.handle(request)
+        return (json.dumps(response, separators=(",", ":")) + "\n").encode("utf-8")
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serve one client until it disconnects.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (asyncio.LimitOverrunError, ValueError):
+                    writer.write(b'{"ok":false,"error":"Request line too long"}\n')
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    writer.write(await loop.run_in_executor(self.executor, self.handle_line, line))
+                    # Only waits when the client is not reading its responses fast enough.
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=8765, path=None):
+        """
+        Start listening on a TCP port, or on a Unix socket if path is given.
+        """
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle_connection, path=path, limit=self.max_line)
+        return await asyncio.start_server(self.handle_connection, host, port, limit=self.max_line)
+
+    async def serve_forever(self, host="127.0.0.1", port=8765, path=None):
+        """
+        Start the server and serve until cancelled.
+        """
+        server = await self.start(host, port, path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Library Management System network service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="listen on this Unix socket path instead of TCP")
+    parser.add_argument("--data-dir", help="directory for the durable write-ahead log and snapshots")
+    parser.add_argument("--compact", action="store_true", help="keep loans in the compact array-backed table")
+    parser.add_argument("--metrics", action="store_true", help="record operation metrics, served by the metrics op")
+    parser.add_argument("--search-workers", type=int, help="run title/author/publisher scans in this many processes")
+    parser.add_argument("--sqlite", help="keep books, users and loans in this SQLite database file")
+    args = parser.parse_args()
+    if args.sqlite is not None and (args.data_dir is not None or args.compact):
+        parser.error("--sqlite cannot be combined with --data-dir or --compact")
+
+    db = None
+    if args.sqlite is not None:
+        from sqlite_backend import open_library
+        db, book_list, user_list, loans = open_library(args.sqlite)
+    else:
+        book_list = BookList()
+        user_list = UserList()
+        loans = Loans(compact=args.compact)
+    storage = None
+    if args.data_dir is not None:
+        from storage import LibraryStorage
+        storage = LibraryStorage(args.data_dir, book_list, user_list, loans)
+        storage.open()
+
+    metrics = None
+    if args.metrics:
+        from metrics import MetricsRegistry
+        metrics = MetricsRegistry()
+        metrics.instrument(book_list, user_list, loans)
+
+    searcher = None
+    if args.search_workers:
+        from sharded_search import ShardedSearch
+        searcher = ShardedSearch(book_list, args.search_workers)
+
+    server = LibraryServer(LibraryService(book_list, user_list, loans, metrics, searcher))
+    try:
+        asyncio.run(server.serve_forever(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if searcher is not None:
+            searcher.close()
+        if storage is not None:
+            storage.close()
+        if db is not None:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
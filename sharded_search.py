@@ -0,0 +1,167 @@
+import multiprocessing
+import os
+import re
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import Future
+
+from book_management import BookList
+
+
+def _shard_worker(conn, records):
+    """Hold one shard of lowercased book fields and answer scans over it until closed."""
+    shard = {field: {} for field in BookList.TEXT_FIELDS}
+    for book_id, values in records:
+        for field, value in zip(BookList.TEXT_FIELDS, values):
+            shard[field][book_id] = value.lower()
+    del records
+    while True:
+        message = conn.recv()
+        op = message[0]
+        if op == "add":
+            _, book_id, values = message
+            for field, value in zip(BookList.TEXT_FIELDS, values):
+                shard[field][book_id] = value.lower()
+        elif op == "remove":
+            for values in shard.values():
+                values.pop(message[1], None)
+        elif op == "update":
+            _, book_id, field, value = message
+            shard[field][book_id] = value.lower()
+        elif op == "search":
+            _, field, query = message
+            conn.send([book_id for book_id, value in shard[field].items() if query in value])
+        elif op == "regex":
+            _, field, pattern = message
+            compiled = re.compile(pattern, re.IGNORECASE)
+            conn.send([book_id for book_id, value in shard[field].items() if compiled.search(value)])
+        elif op == "close":
+            break
+    conn.close()
+
+
+class ShardedSearch:
+    """
+    Runs substring and regular-expression scans over a BookList in parallel
+    worker processes.
+
+    The books' title, author and publisher are partitioned by book ID over
+    the workers, each of which keeps its shard in memory. Changes to the
+    BookList are forwarded to the owning worker as they happen, over the same
+    pipe as queries, so every query sees every earlier change. A query is
+    sent to all workers at once and their matches are merged, so full scans
+    scale with the number of cores. Queries from several threads overlap:
+    the lock is only held while a query is sent, and each worker's replies
+    are matched to queries in the order they were sent. Publication date
+    searches are answered by the BookList's own index.
+
+    Workers are started with the forkserver (or spawn) method, so they do
+    not inherit a copy of the threads and locks of the process creating them.
+    """
+
+    def __init__(self, book_list, workers=None):
+        """
+        Initialize a new ShardedSearch instance, starting one worker process
+        per shard (one per CPU by default).
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError("Number of workers must be a positive integer")
+        self.book_list = book_list
+        self._lock = threading.Lock()
+        shards = [[] for _ in range(workers)]
+        for book_id, book in book_list.books.items():
+            shards[self._shard_of(book_id, workers)].append(
+                (book_id, tuple(getattr(book, field) for field in BookList.TEXT_FIELDS)))
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        self._connections = []
+        self._processes = []
+        self._pending = [deque() for _ in range(workers)]  # futures of each worker's unanswered queries
+        self._receive_locks = [threading.Lock() for _ in range(workers)]
+        for records in shards:
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_shard_worker, args=(child_conn, records), daemon=True)
+            process.start()
+            child_conn.close()
+            self._connections.append(parent_conn)
+            self._processes.append(process)
+        book_list.add_observer(self._on_book_event)
+
+    @staticmethod
+    def _shard_of(book_id, workers):
+        """Return the shard a book ID belongs to; stable across processes, unlike hash()."""
+        return zlib.crc32(book_id.encode("utf-8")) % workers
+
+    def _send(self, book_id, message):
+        """Forward a change to the worker holding a book."""
+        with self._lock:
+            self._connections[self._shard_of(book_id, len(self._connections))].send(message)
+
+    def _on_book_event(self, event, data):
+        if event == "add_book":
+            book = data["book"]
+            self._send(book.book_id, ("add", book.book_id,
+                                      tuple(getattr(book, field) for field in BookList.TEXT_FIELDS)))
+        elif event == "remove_book":
+            self._send(data["book_id"], ("remove", data["book_id"]))
+        elif event == "update_book" and data["field"] in BookList.TEXT_FIELDS:
+            self._send(data["book_id"], ("update", data["book_id"], data["field"], data["value"]))
+
+    def _receive(self, index, future):
+        """Wait for one worker's reply to a query, handing replies to earlier queries to their futures."""
+        with self._receive_locks[index]:
+            while not future.done():
+                self._pending[index].popleft().set_result(self._connections[index].recv())
+        return future.result()
+
+    def _scan(self, message):
+        """Send a query to every worker and return the merged matches in book ID order."""
+        futures = []
+        with self._lock:
+            for conn, pending in zip(self._connections, self._pending):
+                conn.send(message)
+                future = Future()
+                pending.append(future)
+                futures.append(future)
+        book_ids = []
+        for index, future in enumerate(futures):
+            book_ids.extend(self._receive(index, future))
+        book_ids.sort()
+        books = self.book_list.books
+        return [books[book_id] for book_id in book_ids if book_id in books]
+
+    def search_book(self, query, search_type):
+        """
+        Search for a book by title, author, publisher, or publication date.
+        """
+        if search_type in BookList.TEXT_FIELDS:
+            return self._scan(("search", search_type, query.lower()))
+        return self.book_list.search_book(query, search_type)
+
+    def search_book_regex(self, pattern, search_type="title"):
+        """
+        Return the books whose title, author or publisher matches a regular
+        expression, ignoring case.
+        """
+        if search_type not in BookList.TEXT_FIELDS:
+            raise ValueError(f"Search type must be one of: {', '.join(BookList.TEXT_FIELDS)}")
+        try:
+            re.compile(pattern, re.IGNORECASE)
+        except re.error as e:
+            raise ValueError(f"Invalid regular expression: {e}")
+        return self._scan(("regex", search_type, pattern))
+
+    def close(self):
+        """
+        Stop following the BookList and shut the worker processes down.
+        """
+        self.book_list.remove_observer(self._on_book_event)
+        with self._lock:
+            for conn in self._connections:
+                conn.send(("close",))
+                conn.close()
+        for process in self._processes:
+            process.join()
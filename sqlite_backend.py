@@ -0,0 +1,1085 @@
+import queue
+import re
+import sqlite3
+import threading
+from collections.abc import Mapping
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from book_management import Book, BookIdAllocator, IdBlock, BookList, Loans, Observable, PrefixIndex, User, UserList
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    book_id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    author TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    publisher TEXT NOT NULL,
+    num_copies INTEGER NOT NULL,
+    publication_date TEXT NOT NULL,
+    available_copies INTEGER NOT NULL,
+    times_borrowed INTEGER NOT NULL DEFAULT 0,
+    publication_day INTEGER NOT NULL,
+    title_key TEXT NOT NULL,
+    author_key TEXT NOT NULL,
+    publisher_key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS books_title_key ON books (title_key);
+CREATE INDEX IF NOT EXISTS books_author_key ON books (author_key);
+CREATE INDEX IF NOT EXISTS books_author ON books (author);
+CREATE INDEX IF NOT EXISTS books_publisher ON books (publisher);
+CREATE INDEX IF NOT EXISTS books_year ON books (year);
+CREATE INDEX IF NOT EXISTS books_publication_day ON books (publication_day, book_id);
+
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    firstname TEXT NOT NULL,
+    surname TEXT NOT NULL,
+    house_number TEXT NOT NULL,
+    street_name TEXT NOT NULL,
+    postcode TEXT NOT NULL,
+    email TEXT NOT NULL,
+    date_of_birth TEXT NOT NULL,
+    firstname_key TEXT NOT NULL,
+    surname_key TEXT NOT NULL,
+    email_key TEXT NOT NULL,
+    postcode_key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_firstname_key ON users (firstname_key);
+CREATE INDEX IF NOT EXISTS users_surname_key ON users (surname_key);
+CREATE INDEX IF NOT EXISTS users_email_key ON users (email_key);
+CREATE INDEX IF NOT EXISTS users_postcode_key ON users (postcode_key);
+
+CREATE TABLE IF NOT EXISTS loans (
+    username TEXT NOT NULL,
+    book_id TEXT NOT NULL,
+    due_date TEXT NOT NULL,
+    PRIMARY KEY (username, book_id)
+);
+CREATE INDEX IF NOT EXISTS loans_book_id ON loans (book_id);
+CREATE INDEX IF NOT EXISTS loans_due_date ON loans (due_date);
+
+CREATE TABLE IF NOT EXISTS holds (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    book_id TEXT NOT NULL,
+    username TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    expires_at TEXT NOT NULL,
+    UNIQUE (book_id, username)
+);
+CREATE INDEX IF NOT EXISTS holds_queue ON holds (book_id, priority, seq);
+
+CREATE TABLE IF NOT EXISTS sequences (
+    name TEXT PRIMARY KEY,
+    next INTEGER NOT NULL
+);
+"""
+
+BOOK_COLUMNS = ("book_id", "title", "author", "year", "publisher", "num_copies", "publication_date",
+                "available_copies", "times_borrowed")
+USER_COLUMNS = ("username", "firstname", "surname", "house_number", "street_name", "postcode", "email",
+                "date_of_birth")
+DATE_COLUMNS = ("publication_date", "date_of_birth")
+
+
+def _encode_date(value):
+    """Format a datetime so that its text sorts in time order."""
+    return value.isoformat(timespec="microseconds")
+
+
+def _like_pattern(text):
+    """Return a LIKE pattern matching values that contain text literally."""
+    return "%" + re.sub(r"([\\%_])", r"\\\1", text.lower()) + "%"
+
+
+def _regexp(pattern, value):
+    """SQLite REGEXP function: case-insensitive re.search."""
+    return value is not None and re.search(pattern, value, re.IGNORECASE) is not None
+
+
+class SQLiteDatabase:
+    """
+    A SQLite file shared by SQLiteBookList, SQLiteUserList and SQLiteLoans.
+
+    The database runs in WAL mode, so readers never block the writer or each
+    other. Writes go through one connection, one transaction at a time; each
+    transaction starts with BEGIN IMMEDIATE so that writers in other
+    processes queue up instead of failing part-way. Reads borrow a
+    connection from a pool of up to pool_size connections.
+    """
+
+    def __init__(self, path, pool_size=4, timeout=30.0):
+        """
+        Initialize a new SQLiteDatabase instance, creating the tables if needed.
+        """
+        if path == ":memory:":
+            raise ValueError("SQLiteDatabase needs a file path; every connection to :memory: is a separate database")
+        self.path = path
+        self.timeout = timeout
+        self._writer = self._connect()
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._writer.execute("PRAGMA synchronous=NORMAL")
+        self._writer.executescript(SCHEMA)
+        self._write_lock = threading.RLock()
+        self._readers = queue.LifoQueue()
+        self._reader_slots = threading.Semaphore(pool_size)
+        self._all_readers = []
+
+    def _connect(self):
+        """Open a connection with autocommit, explicit transactions and the REGEXP function."""
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        conn.create_function("regexp", 2, _regexp, deterministic=True)
+        return conn
+
+    @contextmanager
+    def read(self):
+        """
+        Borrow a pooled connection for reading.
+        """
+        self._reader_slots.acquire()
+        try:
+            try:
+                conn = self._readers.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+                self._all_readers.append(conn)
+            try:
+                yield conn
+            finally:
+                self._readers.put(conn)
+        finally:
+            self._reader_slots.release()
+
+    @contextmanager
+    def write(self):
+        """
+        Run a block as one write transaction, rolled back if it raises.
+        Nested calls join the outer transaction.
+        """
+        with self._write_lock:
+            conn = self._writer
+            if conn.in_transaction:
+                yield conn
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self):
+        """
+        Close every connection.
+        """
+        for conn in self._all_readers:
+            conn.close()
+        self._writer.close()
+
+
+class SQLiteIdAllocator(BookIdAllocator):
+    """
+    A BookIdAllocator whose counter lives in the database, so processes
+    sharing the file never issue the same book ID. next_id() hands out IDs
+    from blocks reserved in one write transaction each, doubling in size up
+    to MAX_BLOCK, so creating many books costs few transactions; the unused
+    rest of a block is skipped when the process exits.
+    """
+
+    MAX_BLOCK = 1024
+
+    def __init__(self, db, prefix="BK", width=5):
+        """
+        Initialize a new SQLiteIdAllocator instance. A database written
+        before the counter existed is scanned once to start it past the
+        stored IDs.
+        """
+        super().__init__(prefix, width)
+        self.db = db
+        self._block = None
+        self._block_size = 1
+        with db.write() as conn:
+            created = conn.execute("INSERT OR IGNORE INTO sequences VALUES ('book_id', 1)").rowcount
+            if created:
+                digits = f"SUBSTR(book_id, {len(prefix) + 1})"
+                conn.execute("UPDATE sequences SET next = (SELECT COALESCE(MAX(CAST(" + digits + " AS INTEGER)), 0) + 1 "
+                             "FROM books WHERE book_id GLOB ? AND " + digits + " NOT GLOB '*[^0-9]*') "
+                             "WHERE name = 'book_id'", (prefix + "[0-9]*",))
+
+    def _take(self, count):
+        """Move the stored counter on by count and return the first number taken."""
+        with self.db.write() as conn:
+            start = conn.execute("SELECT next FROM sequences WHERE name = 'book_id'").fetchone()[0]
+            conn.execute("UPDATE sequences SET next = ? WHERE name = 'book_id'", (start + count,))
+        self._next = max(self._next, start + count)
+        return start
+
+    def next_id(self):
+        """
+        Return a new, never before issued book ID.
+        """
+        with self._lock:
+            if self._block is None or not self._block.remaining():
+                start = self._take(self._block_size)
+                self._block = IdBlock(self.prefix, self.width, start, start + self._block_size)
+                self._block_size = min(self._block_size * 2, self.MAX_BLOCK)
+            return self._block.next_id()
+
+    def reserve(self, count):
+        """
+        Reserve count consecutive IDs and return them as an IdBlock.
+        """
+        if not isinstance(count, int) or count < 1:
+            raise ValueError("Count must be a positive integer")
+        start = self._take(count)
+        return IdBlock(self.prefix, self.width, start, start + count)
+
+    def advance(self, number):
+        """
+        Make sure the next issued ID is numbered at least number.
+        """
+        with self._lock:
+            # IDs left in the current block below number must not be handed out either.
+            if self._block is not None and self._block._next < number:
+                self._block._next = min(number, self._block.end)
+        # The stored counter only grows, so numbers below one already seen need no write.
+        if number <= self._next:
+            return
+        with self.db.write() as conn:
+            conn.execute("UPDATE sequences SET next = MAX(next, ?) WHERE name = 'book_id'", (number,))
+        self._next = number
+
+    def peek(self):
+        """
+        Return the number the next issued ID will have.
+        """
+        with self.db.read() as conn:
+            return conn.execute("SELECT next FROM sequences WHERE name = 'book_id'").fetchone()[0]
+
+
+class _Rows(Mapping):
+    """
+    A read-only {key: object} view of a table, so callers that look records
+    up with .get() or iterate over values() work unchanged.
+    """
+
+    def __init__(self, owner, table, key):
+        self._owner = owner
+        self._table = table
+        self._key = key
+
+    def __getitem__(self, key):
+        with self._owner.db.read() as conn:
+            row = conn.execute(f"SELECT * FROM {self._table} WHERE {self._key} = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self._owner._from_row(row)
+
+    def __contains__(self, key):
+        with self._owner.db.read() as conn:
+            return conn.execute(f"SELECT 1 FROM {self._table} WHERE {self._key} = ?", (key,)).fetchone() is not None
+
+    def __iter__(self):
+        with self._owner.db.read() as conn:
+            keys = [row[0] for row in conn.execute(f"SELECT {self._key} FROM {self._table}")]
+        return iter(keys)
+
+    def __len__(self):
+        with self._owner.db.read() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {self._table}").fetchone()[0]
+
+    def items(self):
+        """
+        Yield (key, object) pairs from a single scan of the table.
+        """
+        with self._owner.db.read() as conn:
+            for row in conn.execute(f"SELECT * FROM {self._table}"):
+                yield row[0], self._owner._from_row(row)
+
+    def values(self):
+        """
+        Yield every object from a single scan of the table.
+        """
+        for _, value in self.items():
+            yield value
+
+
+class SQLiteBookList(Observable):
+    """
+    A BookList kept in a SQLite database instead of in memory.
+
+    Books handed out are snapshots of their rows; the Book setters write
+    changes straight back to the database. New books should take their IDs
+    from id_allocator, which draws on the database's counter, rather than
+    from the process-wide Book.id_allocator.
+    """
+
+    TEXT_FIELDS = BookList.TEXT_FIELDS
+    TYPEAHEAD_FIELDS = BookList.TYPEAHEAD_FIELDS
+    TYPEAHEAD_RANKINGS = BookList.TYPEAHEAD_RANKINGS
+    AGGREGATE_FIELDS = BookList.AGGREGATE_FIELDS
+    SEARCH_ORDERINGS = BookList.SEARCH_ORDERINGS
+    ORDER_COLUMNS = {"title": "title_key", "year": "year", "availability": "available_copies"}
+
+    def __init__(self, db):
+        """
+        Initialize a new SQLiteBookList instance over a SQLiteDatabase.
+        """
+        self.db = db
+        self.books = _Rows(self, "books", "book_id")
+        self.id_allocator = SQLiteIdAllocator(db)
+        self._observers = []
+
+    def _from_row(self, row):
+        """Build a Book owned by this list from a books row without re-running the setter validation."""
+        book = Book.__new__(Book)
+        book._book_list = self
+        for field, value in zip(BOOK_COLUMNS, row):
+            setattr(book, field, datetime.fromisoformat(value) if field in DATE_COLUMNS else value)
+        return book
+
+    def _select(self, where="", params=(), order="", limit=None):
+        """Return the books matching a WHERE clause."""
+        sql = "SELECT * FROM books" + (f" WHERE {where}" if where else "") + (f" ORDER BY {order}" if order else "")
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        with self.db.read() as conn:
+            return [self._from_row(row) for row in conn.execute(sql, params)]
+
+    @staticmethod
+    def _record(book):
+        """Return the column values of a books row."""
+        return (book.book_id, book.title, book.author, book.year, book.publisher, book.num_copies,
+                _encode_date(book.publication_date), book.available_copies, book.times_borrowed,
+                book.publication_date.toordinal(), book.title.lower(), book.author.lower(), book.publisher.lower())
+
+    def _on_book_changed(self, book, field, old_value, new_value):
+        """Write a Book setter's change to the database."""
+        assignments = {field: _encode_date(new_value) if field in DATE_COLUMNS else new_value}
+        if field in self.TEXT_FIELDS:
+            assignments[field + "_key"] = new_value.lower()
+        elif field == "publication_date":
+            assignments["publication_day"] = new_value.toordinal()
+        columns = ", ".join(f"{column} = ?" for column in assignments)
+        with self.db.write() as conn:
+            conn.execute(f"UPDATE books SET {columns} WHERE book_id = ?", (*assignments.values(), book.book_id))
+        self._notify("update_book", book_id=book.book_id, field=field, value=new_value)
+
+    def _on_availability_changed(self, book, delta):
+        """Write a change in available copies made through Book._change_available."""
+        with self.db.write() as conn:
+            conn.execute("UPDATE books SET available_copies = ?, times_borrowed = ? WHERE book_id = ?",
+                         (book.available_copies, book.times_borrowed, book.book_id))
+
+    def add_book(self, book):
+        """
+        Add a book to the collection.
+        """
+        self.add_books([book])
+
+    def add_books(self, books):
+        """
+        Add a batch of books to the collection in one transaction. Nothing is
+        added unless every item is a Book with an ID that is not already in use.
+        """
+        books = list(books)
+        if not all(isinstance(book, Book) for book in books):
+            raise ValueError("Only Book objects can be added to the collection")
+        book_ids = set()
+        for book in books:
+            if book.book_id in book_ids:
+                raise ValueError(f"A book with ID {book.book_id} already exists")
+            book_ids.add(book.book_id)
+        try:
+            with self.db.write() as conn:
+                conn.executemany(f"INSERT INTO books VALUES ({', '.join('?' * 13)})",
+                                 [self._record(book) for book in books])
+                # Explicit IDs move the counter on in the same transaction as the insert.
+                numbers = [number for number in map(self.id_allocator.number, book_ids) if number is not None]
+                if numbers:
+                    self.id_allocator.advance(max(numbers) + 1)
+        except sqlite3.IntegrityError:
+            for book in books:
+                if book.book_id in self.books:
+                    raise ValueError(f"A book with ID {book.book_id} already exists")
+            raise
+        for book in books:
+            book._book_list = self
+            self._notify("add_book", book=book)
+
+    def search_book(self, query, search_type):
+        """
+        Search for a book by title, author, publisher, or publication date.
+        """
+        condition = self._search_condition(query, search_type)
+        if condition is None:
+            return []
+        return self._select(*condition, "book_id")
+
+    def _search_condition(self, query, search_type):
+        """Return the WHERE clause and parameters of a search, or None if nothing can match."""
+        if search_type in self.TEXT_FIELDS:
+            return f"{search_type}_key LIKE ? ESCAPE '\\'", (_like_pattern(query),)
+        if search_type == "publication_date":
+            try:
+                day = datetime.strptime(query, "%Y-%m-%d")
+            except ValueError:
+                return None
+            if day.strftime("%Y-%m-%d") != query:
+                return None
+            return "publication_day = ?", (day.toordinal(),)
+        return None
+
+    def _order_columns(self, order_by):
+        """Return the columns a search ordering sorts by; ties are broken by book ID."""
+        if order_by is None:
+            return ["book_id"]
+        if order_by not in self.SEARCH_ORDERINGS:
+            raise ValueError(f"Search ordering must be one of: {', '.join(self.SEARCH_ORDERINGS)}")
+        return [self.ORDER_COLUMNS[order_by], "book_id"]
+
+    def iter_search_book(self, query, search_type, order_by=None, descending=False, offset=0, limit=None):
+        """
+        Return an iterator over the books search_book would return, skipping
+        the first offset and stopping after limit, optionally ordered by
+        "title", "year" or "availability" (ties by book ID). SQLite sorts
+        with a bounded top-k when a limit is given.
+        """
+        if not isinstance(offset, int) or offset < 0:
+            raise ValueError("Offset must be a non-negative integer")
+        if limit is not None and (not isinstance(limit, int) or limit < 0):
+            raise ValueError("Limit must be a non-negative integer")
+        columns = None if order_by is None else self._order_columns(order_by)
+        condition = self._search_condition(query, search_type)
+        if condition is None:
+            return iter(())
+        where, params = condition
+        if columns is not None:
+            where += " ORDER BY " + ", ".join(f"{column} {'DESC' if descending else 'ASC'}" for column in columns)
+        return self._stream(f"{where} LIMIT ? OFFSET ?", (*params, -1 if limit is None else limit, offset))
+
+    def search_book_page(self, query, search_type, limit=20, cursor=None, order_by=None, descending=False):
+        """
+        Return one page of search results as (books, cursor), ordered by
+        order_by ("title", "year" or "availability") or by book ID. Pass the
+        returned cursor back to get the next page; it is None after the last
+        page. Each page is an index-backed range query starting after the
+        last book shown.
+        """
+        if not isinstance(limit, int) or limit < 1:
+            raise ValueError("Limit must be a positive integer")
+        columns = self._order_columns(order_by)
+        condition = self._search_condition(query, search_type)
+        if condition is None:
+            return [], None
+        where, params = condition
+        if cursor is not None:
+            if not isinstance(cursor, (list, tuple)) or len(cursor) != len(columns):
+                raise ValueError("Invalid search cursor")
+            where += f" AND ({', '.join(columns)}) {'<' if descending else '>'} ({', '.join('?' * len(columns))})"
+            params = (*params, *cursor)
+        direction = "DESC" if descending else "ASC"
+        order = ", ".join(f"{column} {direction}" for column in columns)
+        books = self._select(where, params, order, limit + 1)
+        next_cursor = None
+        if len(books) > limit:
+            last = books[limit - 1]
+            values = {"title_key": last.title.lower(), "year": last.year,
+                      "available_copies": last.available_copies, "book_id": last.book_id}
+            next_cursor = [values[column] for column in columns]
+        return books[:limit], next_cursor
+
+    def search_book_regex(self, pattern, search_type="title"):
+        """
+        Return the books whose title, author or publisher matches a regular
+        expression, ignoring case. This scans every book.
+        """
+        if search_type not in self.TEXT_FIELDS:
+            raise ValueError(f"Search type must be one of: {', '.join(self.TEXT_FIELDS)}")
+        try:
+            re.compile(pattern, re.IGNORECASE)
+        except re.error as e:
+            raise ValueError(f"Invalid regular expression: {e}")
+        return self._select(f"{search_type} REGEXP ?", (pattern,))
+
+    def find_books(self, title=None, author=None, publisher=None, start_date=None, end_date=None, available=None):
+        """
+        Yield the books matching every given condition, as BookList.find_books
+        does. SQLite's query planner picks the index to drive the search.
+        """
+        for value in (start_date, end_date):
+            if value is not None and not isinstance(value, datetime):
+                raise ValueError("Start and end dates must be datetime objects")
+        conditions, params = [], []
+        for field, text in (("title", title), ("author", author), ("publisher", publisher)):
+            if text is not None:
+                conditions.append(f"{field}_key LIKE ? ESCAPE '\\'")
+                params.append(_like_pattern(text))
+        if start_date is not None:
+            conditions.append("publication_day >= ?")
+            params.append(start_date.toordinal())
+        if end_date is not None:
+            conditions.append("publication_day <= ?")
+            params.append(end_date.toordinal())
+        if available is not None:
+            conditions.append("available_copies > 0" if available else "available_copies <= 0")
+        if not conditions:
+            raise ValueError("At least one search condition must be given")
+        return self._stream(" AND ".join(conditions), params)
+
+    def _stream(self, where, params):
+        """Yield the books matching a WHERE clause as the cursor produces them."""
+        with self.db.read() as conn:
+            for row in conn.execute(f"SELECT * FROM books WHERE {where}", params):
+                yield self._from_row(row)
+
+    def typeahead(self, prefix, field="title", k=10, rank_by="popularity"):
+        """
+        Return up to k books whose title or author starts with prefix
+        (ignoring case), most borrowed or newest first.
+        """
+        if field not in self.TYPEAHEAD_FIELDS:
+            raise ValueError(f"Typeahead field must be one of: {', '.join(self.TYPEAHEAD_FIELDS)}")
+        if rank_by not in self.TYPEAHEAD_RANKINGS:
+            raise ValueError(f"Typeahead ranking must be one of: {', '.join(self.TYPEAHEAD_RANKINGS)}")
+        if k <= 0:
+            return []
+        low = PrefixIndex.normalise(prefix)
+        if low and prefix[-1].isspace():
+            low += " "
+        score = "times_borrowed" if rank_by == "popularity" else "year"
+        return self._select(f"{field}_key >= ? AND {field}_key < ?", (low, low + "\U0010ffff"),
+                            f"{score} DESC, {field}_key, book_id", k)
+
+    def get_books_published_between(self, start_date, end_date):
+        """
+        Return the books published between two dates (inclusive), oldest first.
+        """
+        if not isinstance(start_date, datetime) or not isinstance(end_date, datetime):
+            raise ValueError("Start and end dates must be datetime objects")
+        return self._select("publication_day >= ? AND publication_day <= ?",
+                            (start_date.toordinal(), end_date.toordinal()), "publication_day, book_id")
+
+    def get_books_published_in_year(self, year):
+        """
+        Return the books published in the given year, oldest first.
+        """
+        if not isinstance(year, int) or year < 1:
+            raise ValueError("Year must be a positive integer")
+        return self.get_books_published_between(datetime(year, 1, 1), datetime(year, 12, 31))
+
+    def get_newest_books(self, n):
+        """
+        Return the n most recently published books, newest first.
+        """
+        if n <= 0:
+            return []
+        return self._select(order="publication_day DESC, book_id DESC", limit=n)
+
+    def remove_book(self, title, loans=None):
+        """
+        Remove a book from the collection by its title. If loans is given,
+        a book that still has copies on loan is not removed.
+        """
+        books = self._select("title_key = ?", (title.lower(),), "book_id", 1)
+        if not books:
+            raise ValueError(f"No book found with title: {title}")
+        book = books[0]
+        if loans is not None and loans.is_on_loan(book):
+            raise ValueError(f"Book {book.book_id} still has copies on loan")
+        self._remove_book(book)
+        return True
+
+    def _remove_book(self, book):
+        """Delete a book's row."""
+        with self.db.write() as conn:
+            conn.execute("DELETE FROM books WHERE book_id = ?", (book.book_id,))
+        book._book_list = None
+        self._notify("remove_book", book_id=book.book_id)
+
+    def get_total_books(self):
+        """
+        Return the total number of books in the collection.
+        """
+        return len(self.books)
+
+    def get_copy_totals(self, field, value):
+        """
+        Return the number of books, total copies and available copies for
+        one author, publisher or year.
+        """
+        if field not in self.AGGREGATE_FIELDS:
+            raise ValueError(f"Totals field must be one of: {', '.join(self.AGGREGATE_FIELDS)}")
+        with self.db.read() as conn:
+            books, copies, available = conn.execute(
+                f"SELECT COUNT(*), TOTAL(num_copies), TOTAL(available_copies) FROM books WHERE {field} = ?",
+                (value,)).fetchone()
+        return {"books": books, "num_copies": int(copies), "available_copies": int(available)}
+
+    def get_all_copy_totals(self, field):
+        """
+        Return {author, publisher or year: totals} for every value of the field.
+        """
+        if field not in self.AGGREGATE_FIELDS:
+            raise ValueError(f"Totals field must be one of: {', '.join(self.AGGREGATE_FIELDS)}")
+        with self.db.read() as conn:
+            rows = conn.execute(f"SELECT {field}, COUNT(*), SUM(num_copies), SUM(available_copies) "
+                                f"FROM books GROUP BY {field}").fetchall()
+        return {value: {"books": books, "num_copies": copies, "available_copies": available}
+                for value, books, copies, available in rows}
+
+
+class SQLiteUserList(Observable):
+    """
+    A UserList kept in a SQLite database instead of in memory.
+
+    Users handed out are snapshots of their rows; the User setters write
+    changes straight back to the database.
+    """
+
+    INDEXED_FIELDS = UserList.INDEXED_FIELDS
+
+    def __init__(self, db):
+        """
+        Initialize a new SQLiteUserList instance over a SQLiteDatabase.
+        """
+        self.db = db
+        self.users = _Rows(self, "users", "username")
+        self._observers = []
+
+    def _from_row(self, row):
+        """Build a User owned by this list from a users row without re-running the setter validation."""
+        user = User.__new__(User)
+        user._user_list = self
+        for field, value in zip(USER_COLUMNS, row):
+            setattr(user, field, datetime.fromisoformat(value) if field in DATE_COLUMNS else value)
+        return user
+
+    @staticmethod
+    def _record(user):
+        """Return the column values of a users row."""
+        return (user.username, user.firstname, user.surname, user.house_number, user.street_name, user.postcode,
+                user.email, _encode_date(user.date_of_birth),
+                *(UserList._index_key(field, getattr(user, field)) for field in UserList.INDEXED_FIELDS))
+
+    def _on_user_changed(self, user, field, old_value, new_value):
+        """Write a User setter's change to the database."""
+        assignments = {field: _encode_date(new_value) if field in DATE_COLUMNS else new_value}
+        if field in self.INDEXED_FIELDS:
+            assignments[field + "_key"] = UserList._index_key(field, new_value)
+        columns = ", ".join(f"{column} = ?" for column in assignments)
+        with self.db.write() as conn:
+            conn.execute(f"UPDATE users SET {columns} WHERE username = ?", (*assignments.values(), user.username))
+        self._notify("update_user", username=user.get_username(), field=field, value=new_value)
+
+    def add_user(self, user):
+        """
+        Add a user to the collection.
+        """
+        self.add_users([user])
+
+    def add_users(self, users):
+        """
+        Add a batch of users to the collection in one transaction. Nothing is added unless every item is a User.
+        """
+        users = list(users)
+        if not all(isinstance(user, User) for user in users):
+            raise ValueError("Only User objects can be added to the collection")
+        with self.db.write() as conn:
+            conn.executemany(f"INSERT OR REPLACE INTO users VALUES ({', '.join('?' * 12)})",
+                             [self._record(user) for user in users])
+        for user in users:
+            user._user_list = self
+            self._notify("add_user", user=user)
+
+    def remove_user(self, firstname):
+        """
+        Remove a user from the collection by first name.
+        """
+        matching_users = self.find_users(firstname=firstname)
+        if len(matching_users) > 1:
+            raise ValueError(f"Multiple users found with first name: {firstname}. Please use a unique identifier.")
+        elif len(matching_users) == 0:
+            raise ValueError(f"No user found with first name: {firstname}")
+        else:
+            self._remove_user(matching_users[0])
+
+    def _remove_user(self, user):
+        """Delete a user's row."""
+        with self.db.write() as conn:
+            conn.execute("DELETE FROM users WHERE username = ?", (user.get_username(),))
+        user._user_list = None
+        self._notify("remove_user", username=user.get_username())
+
+    def find_users(self, firstname=None, surname=None, email=None, postcode=None):
+        """
+        Return the users matching every given field, ignoring case (and spaces in postcodes).
+        """
+        criteria = {"firstname": firstname, "surname": surname, "email": email, "postcode": postcode}
+        conditions, params = [], []
+        for field, value in criteria.items():
+            if value is not None:
+                conditions.append(f"{field}_key = ?")
+                params.append(UserList._index_key(field, value))
+        if not conditions:
+            raise ValueError("At least one search field must be given")
+        with self.db.read() as conn:
+            return [self._from_row(row)
+                    for row in conn.execute(f"SELECT * FROM users WHERE {' AND '.join(conditions)}", params)]
+
+    def get_user_count(self):
+        """
+        Return the total number of users in the collection.
+        """
+        return len(self.users)
+
+    def get_user_by_username(self, username):
+        """
+        Return the user with the given username.
+        """
+        try:
+            return self.users[username]
+        except KeyError:
+            raise ValueError(f"No user found with username: {username}")
+
+
+class _LoanRows(Mapping):
+    """
+    A read-only {username: {book_id: due_date}} view of the loans table.
+    """
+
+    def __init__(self, db):
+        self._db = db
+
+    def __getitem__(self, username):
+        with self._db.read() as conn:
+            rows = conn.execute("SELECT book_id, due_date FROM loans WHERE username = ?", (username,)).fetchall()
+        if not rows:
+            raise KeyError(username)
+        return {book_id: datetime.fromisoformat(due_date) for book_id, due_date in rows}
+
+    def __iter__(self):
+        with self._db.read() as conn:
+            usernames = [row[0] for row in conn.execute("SELECT DISTINCT username FROM loans")]
+        return iter(usernames)
+
+    def __len__(self):
+        with self._db.read() as conn:
+            return conn.execute("SELECT COUNT(DISTINCT username) FROM loans").fetchone()[0]
+
+    def items(self):
+        """
+        Yield (username, {book_id: due_date}) pairs from a single scan of the table.
+        """
+        with self._db.read() as conn:
+            rows = conn.execute("SELECT username, book_id, due_date FROM loans ORDER BY username").fetchall()
+        current, books = None, {}
+        for username, book_id, due_date in rows:
+            if username != current:
+                if current is not None:
+                    yield current, books
+                current, books = username, {}
+            books[book_id] = datetime.fromisoformat(due_date)
+        if current is not None:
+            yield current, books
+
+
+class SQLiteLoans(Observable):
+    """
+    Loans and holds kept in a SQLite database instead of in memory.
+
+    Every operation is one transaction, so the availability checks hold
+    across threads and processes that share the database file. The Book
+    objects passed in are refreshed with their stored copy counts.
+    """
+
+    HANDOVER_DAYS = Loans.HANDOVER_DAYS
+
+    def __init__(self, db):
+        """
+        Initialize a new SQLiteLoans instance over a SQLiteDatabase.
+        """
+        self.db = db
+        self.loans = _LoanRows(db)
+        self._observers = []
+
+    @staticmethod
+    def _refresh(conn, book):
+        """Copy a book's stored copy counts onto the Book object."""
+        row = conn.execute("SELECT available_copies, times_borrowed FROM books WHERE book_id = ?",
+                           (book.book_id,)).fetchone()
+        if row is not None:
+            book.available_copies, book.times_borrowed = row
+
+    def borrow_book(self, user, book, days=14):
+        """
+        Assign a book to a user.
+        """
+        if not isinstance(user, User) or not isinstance(book, Book):
+            raise ValueError("Invalid user or book object")
+        username = user.get_username()
+        due_date = datetime.now() + timedelta(days=days)
+        with self.db.write() as conn:
+            lent = conn.execute("UPDATE books SET available_copies = available_copies - 1, "
+                                "times_borrowed = times_borrowed + 1 "
+                                "WHERE book_id = ? AND available_copies > 0", (book.book_id,)).rowcount
+            if not lent:
+                raise ValueError("No available copies of this book")
+            try:
+                conn.execute("INSERT INTO loans VALUES (?, ?, ?)", (username, book.book_id, _encode_date(due_date)))
+            except sqlite3.IntegrityError:
+                raise ValueError("User already has this book on loan")
+            conn.execute("DELETE FROM holds WHERE book_id = ? AND username = ?", (book.book_id, username))
+            self._refresh(conn, book)
+        self._notify("borrow_book", username=username, book_id=book.book_id, due_date=due_date)
+
+    def return_book(self, user, book):
+        """
+        Un-assign a book previously assigned to a user. If anyone has a hold
+        on the book, the copy is lent straight to the next of them; returns
+        that user's username, or None.
+        """
+        username = user.get_username()
+        with self.db.write() as conn:
+            returned = conn.execute("DELETE FROM loans WHERE username = ? AND book_id = ?",
+                                    (username, book.book_id)).rowcount
+            if not returned:
+                raise ValueError("This book is not on loan to this user")
+            handed_over = self._hand_over(conn, book.book_id, 1)
+            self._refresh(conn, book)
+        self._notify("return_book", username=username, book_id=book.book_id)
+        for next_user, due_date in handed_over:
+            self._notify("borrow_book", username=next_user, book_id=book.book_id, due_date=due_date)
+        return handed_over[0][0] if handed_over else None
+
+    def _hand_over(self, conn, book_id, copies):
+        """Lend returned copies to the next unexpired holds and put the rest back on the shelf."""
+        now = datetime.now()
+        conn.execute("DELETE FROM holds WHERE book_id = ? AND expires_at <= ?", (book_id, _encode_date(now)))
+        holds = conn.execute("SELECT seq, username FROM holds WHERE book_id = ? ORDER BY priority, seq LIMIT ?",
+                             (book_id, copies)).fetchall()
+        due_date = now + timedelta(days=self.HANDOVER_DAYS)
+        conn.executemany("DELETE FROM holds WHERE seq = ?", [(seq,) for seq, _ in holds])
+        conn.executemany("INSERT INTO loans VALUES (?, ?, ?)",
+                         [(username, book_id, _encode_date(due_date)) for _, username in holds])
+        conn.execute("UPDATE books SET available_copies = available_copies + ?, times_borrowed = times_borrowed + ? "
+                     "WHERE book_id = ?", (copies - len(holds), len(holds), book_id))
+        return [(username, due_date) for _, username in holds]
+
+    def borrow_many(self, loans, days=14):
+        """
+        Assign many books at once from (user, book) pairs. Every pair is
+        checked before anything changes, and either all loans are made or
+        none are. Returns the due date.
+        """
+        loans = Loans._check_batch(loans)
+        due_date = datetime.now() + timedelta(days=days)
+        wanted = {}
+        for _, book in loans:
+            wanted[book.book_id] = wanted.get(book.book_id, 0) + 1
+        with self.db.write() as conn:
+            for user, book in loans:
+                if conn.execute("SELECT 1 FROM loans WHERE username = ? AND book_id = ?",
+                                (user.get_username(), book.book_id)).fetchone():
+                    raise ValueError(f"User {user.get_username()} already has book {book.book_id} on loan")
+            for book_id, count in wanted.items():
+                lent = conn.execute("UPDATE books SET available_copies = available_copies - ?, "
+                                    "times_borrowed = times_borrowed + ? "
+                                    "WHERE book_id = ? AND available_copies >= ?",
+                                    (count, count, book_id, count)).rowcount
+                if not lent:
+                    raise ValueError(f"Not enough available copies of book {book_id}")
+            pairs = [(user.get_username(), book.book_id) for user, book in loans]
+            conn.executemany("INSERT INTO loans VALUES (?, ?, ?)",
+                             [(username, book_id, _encode_date(due_date)) for username, book_id in pairs])
+            conn.executemany("DELETE FROM holds WHERE username = ? AND book_id = ?", pairs)
+            for _, book in loans:
+                self._refresh(conn, book)
+        self._notify("borrow_many", loans=pairs, due_date=due_date)
+        return due_date
+
+    def return_many(self, loans):
+        """
+        Un-assign many books at once from (user, book) pairs. Every pair must
+        be on loan; either all are returned or none are.
+        """
+        loans = Loans._check_batch(loans)
+        returned = {}
+        for _, book in loans:
+            returned[book.book_id] = returned.get(book.book_id, 0) + 1
+        pairs = [(user.get_username(), book.book_id) for user, book in loans]
+        handed_over = []
+        with self.db.write() as conn:
+            for username, book_id in pairs:
+                if not conn.execute("SELECT 1 FROM loans WHERE username = ? AND book_id = ?",
+                                    (username, book_id)).fetchone():
+                    raise ValueError(f"Book {book_id} is not on loan to user {username}")
+            conn.executemany("DELETE FROM loans WHERE username = ? AND book_id = ?", pairs)
+            for book_id, count in returned.items():
+                handed_over.extend((username, book_id, due_date)
+                                   for username, due_date in self._hand_over(conn, book_id, count))
+            for _, book in loans:
+                self._refresh(conn, book)
+        self._notify("return_many", loans=pairs)
+        for username, book_id, due_date in handed_over:
+            self._notify("borrow_book", username=username, book_id=book_id, due_date=due_date)
+
+    def place_hold(self, user, book, priority=0, days=30):
+        """
+        Queue a user for the next copy of a book that has none available.
+        Returns the user's place in the queue.
+        """
+        if not isinstance(user, User) or not isinstance(book, Book):
+            raise ValueError("Invalid user or book object")
+        if not isinstance(priority, int) or priority < 0:
+            raise ValueError("Priority must be a non-negative integer")
+        username = user.get_username()
+        now = datetime.now()
+        expires_at = now + timedelta(days=days)
+        with self.db.write() as conn:
+            row = conn.execute("SELECT available_copies FROM books WHERE book_id = ?", (book.book_id,)).fetchone()
+            if row is not None and row[0] > 0:
+                raise ValueError("Copies of this book are available to borrow")
+            if conn.execute("SELECT 1 FROM loans WHERE username = ? AND book_id = ?",
+                            (username, book.book_id)).fetchone():
+                raise ValueError("User already has this book on loan")
+            conn.execute("DELETE FROM holds WHERE book_id = ? AND username = ? AND expires_at <= ?",
+                         (book.book_id, username, _encode_date(now)))
+            try:
+                conn.execute("INSERT INTO holds (book_id, username, priority, expires_at) VALUES (?, ?, ?, ?)",
+                             (book.book_id, username, priority, _encode_date(expires_at)))
+            except sqlite3.IntegrityError:
+                raise ValueError("User already has a hold on this book")
+            position = self._position(conn, book.book_id, username, now)
+        self._notify("place_hold", username=username, book_id=book.book_id, priority=priority, expires_at=expires_at)
+        return position
+
+    @staticmethod
+    def _position(conn, book_id, username, now):
+        """Return a user's 1-based place among the unexpired holds on a book, or None."""
+        row = conn.execute("SELECT priority, seq FROM holds WHERE book_id = ? AND username = ? AND expires_at > ?",
+                           (book_id, username, _encode_date(now))).fetchone()
+        if row is None:
+            return None
+        priority, seq = row
+        ahead = conn.execute("SELECT COUNT(*) FROM holds WHERE book_id = ? AND expires_at > ? "
+                             "AND (priority < ? OR (priority = ? AND seq < ?))",
+                             (book_id, _encode_date(now), priority, priority, seq)).fetchone()[0]
+        return ahead + 1
+
+    def cancel_hold(self, user, book):
+        """
+        Withdraw a user's hold on a book.
+        """
+        with self.db.write() as conn:
+            cancelled = conn.execute("DELETE FROM holds WHERE book_id = ? AND username = ?",
+                                     (book.book_id, user.get_username())).rowcount
+            if not cancelled:
+                raise ValueError("User has no hold on this book")
+        self._notify("cancel_hold", username=user.get_username(), book_id=book.book_id)
+
+    def get_hold_position(self, user, book):
+        """
+        Return the user's 1-based place in the queue for a book.
+        """
+        with self.db.read() as conn:
+            position = self._position(conn, book.book_id, user.get_username(), datetime.now())
+        if position is None:
+            raise ValueError("User has no hold on this book")
+        return position
+
+    def get_hold_count(self, book):
+        """
+        Return the number of unexpired holds queued for a book.
+        """
+        with self.db.read() as conn:
+            return conn.execute("SELECT COUNT(*) FROM holds WHERE book_id = ? AND expires_at > ?",
+                                (book.book_id, _encode_date(datetime.now()))).fetchone()[0]
+
+    def get_user_loan_count(self, user):
+        """
+        Count and return the total number of books a user is currently borrowing.
+        """
+        with self.db.read() as conn:
+            return conn.execute("SELECT COUNT(*) FROM loans WHERE username = ?",
+                                (user.get_username(),)).fetchone()[0]
+
+    def get_book_holders(self, book):
+        """
+        Return {username: due_date} for everyone who has a copy of the book on loan.
+        """
+        with self.db.read() as conn:
+            rows = conn.execute("SELECT username, due_date FROM loans WHERE book_id = ?", (book.book_id,)).fetchall()
+        return {username: datetime.fromisoformat(due_date) for username, due_date in rows}
+
+    def is_on_loan(self, book):
+        """
+        Return True if any copy of the book is on loan.
+        """
+        with self.db.read() as conn:
+            return conn.execute("SELECT 1 FROM loans WHERE book_id = ? LIMIT 1", (book.book_id,)).fetchone() is not None
+
+    def snapshot(self):
+        """
+        Return (loans, holds) read in one transaction: loans as (username,
+        book_id, due_date) tuples and holds as (book_id, username, priority,
+        expires_at) tuples, in the order they will be served.
+        """
+        with self.db.read() as conn:
+            conn.execute("BEGIN")
+            try:
+                loans = conn.execute("SELECT username, book_id, due_date FROM loans").fetchall()
+                holds = conn.execute("SELECT book_id, username, priority, expires_at FROM holds "
+                                     "ORDER BY book_id, priority, seq").fetchall()
+            finally:
+                conn.execute("COMMIT")
+        return ([(username, book_id, datetime.fromisoformat(due_date)) for username, book_id, due_date in loans],
+                [(book_id, username, priority, datetime.fromisoformat(expires_at))
+                 for book_id, username, priority, expires_at in holds])
+
+    def get_overdue_books(self, user_list):
+        """
+        Return the overdue loans along with the users' username and first name, most overdue first.
+        """
+        return self._describe_loans(None, datetime.now(), user_list)
+
+    def get_books_due_within(self, days, user_list):
+        """
+        Return the loans that fall due within the next number of days, soonest first.
+        """
+        if not isinstance(days, (int, float)) or days < 0:
+            raise ValueError("Days must be a non-negative number")
+        current_date = datetime.now()
+        return self._describe_loans(current_date, current_date + timedelta(days=days), user_list)
+
+    def _describe_loans(self, low, high, user_list):
+        """Build records for the loans due in [low, high), looking each borrower up once."""
+        conditions, params = ["due_date < ?"], [_encode_date(high)]
+        if low is not None:
+            conditions.append("due_date >= ?")
+            params.append(_encode_date(low))
+        with self.db.read() as conn:
+            rows = conn.execute(f"SELECT username, book_id, due_date FROM loans WHERE {' AND '.join(conditions)} "
+                                "ORDER BY due_date, username, book_id", params).fetchall()
+        users = {}
+        records = []
+        for username, book_id, due_date in rows:
+            if username not in users:
+                users[username] = user_list.get_user_by_username(username)
+            records.append({
+                'username': username,
+                'firstname': users[username].get_firstname(),
+                'book_id': book_id,
+                'due_date': datetime.fromisoformat(due_date)
+            })
+        return records
+
+
+def open_library(path, pool_size=4):
+    """
+    Open (creating if needed) a SQLite library file and return the
+    database and its SQLiteBookList, SQLiteUserList and SQLiteLoans.
+    """
+    db = SQLiteDatabase(path, pool_size)
+    return db, SQLiteBookList(db), SQLiteUserList(db), SQLiteLoans(db)
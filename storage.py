@@ -0,0 +1,432 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+from book_management import Book, User
+
+BOOK_FIELDS = ("title", "author", "year", "publisher", "num_copies", "publication_date")
+USER_FIELDS = ("firstname", "surname", "house_number", "street_name", "postcode", "email", "date_of_birth")
+DATE_FIELDS = ("publication_date", "date_of_birth", "due_date")
+
+SNAPSHOT_PREFIX = "snapshot-"
+LOG_PREFIX = "wal-"
+
+
+def format_datetime(value):
+    """Return a datetime as an ISO 8601 string."""
+    return value.isoformat()
+
+
+def parse_datetime(text):
+    """Parse a string produced by format_datetime (or a plain YYYY-MM-DD date)."""
+    if "T" not in text:
+        return datetime.strptime(text, "%Y-%m-%d")
+    if "." in text:
+        return datetime.strptime(text, "%Y-%m-%dT%H:%M:%S.%f")
+    return datetime.strptime(text, "%Y-%m-%dT%H:%M:%S")
+
+
+def encode_value(field, value):
+    """Convert a field value to its JSON representation."""
+    return format_datetime(value) if field in DATE_FIELDS else value
+
+
+def decode_value(field, value):
+    """Convert a JSON field value back to its Python representation."""
+    return parse_datetime(value) if field in DATE_FIELDS else value
+
+
+def book_to_record(book):
+    """
+    Return a JSON-serialisable dict describing a book.
+    """
+    record = {"book_id": book.book_id}
+    for field in BOOK_FIELDS:
+        record[field] = encode_value(field, getattr(book, field))
+    record["available_copies"] = book.available_copies
+    record["times_borrowed"] = book.times_borrowed
+    return record
+
+
+def book_from_record(record):
+    """
+    Build a Book from a dict produced by book_to_record.
+    """
+    values = [decode_value(field, record[field]) for field in BOOK_FIELDS]
+    book = Book(*values, book_id=record["book_id"])
+    book.available_copies = record.get("available_copies", book.num_copies)
+    book.times_borrowed = record.get("times_borrowed", 0)
+    return book
+
+
+def user_to_record(user):
+    """
+    Return a JSON-serialisable dict describing a user.
+    """
+    record = {"username": user.username}
+    for field in USER_FIELDS:
+        record[field] = encode_value(field, getattr(user, field))
+    return record
+
+
+def user_from_record(record):
+    """
+    Build a User from a dict produced by user_to_record.
+    """
+    values = [decode_value(field, record[field]) for field in USER_FIELDS]
+    return User(record["username"], *values)
+
+
+class LibraryStorage:
+    """
+    Durable storage for a library: an append-only write-ahead log of every
+    mutation plus periodic snapshots that let the log be truncated.
+
+    The log is a sequence of segment files (wal-<first lsn>.log) holding one
+    compact JSON record per line. Records are written to the OS immediately
+    and fsynced in batches by a background thread every sync_interval
+    seconds. Once snapshot_every records have been logged since the last
+    snapshot, a new log segment is started and a background thread captures
+    the state and writes it as a snapshot (snapshot-<lsn>.json), after
+    which older segments and snapshots are deleted. Recovery loads the newest
+    snapshot and replays only the log records after it.
+    """
+
+    def __init__(self, directory, book_list, user_list, loans, sync_interval=0.05, snapshot_every=10000):
+        """
+        Initialize a new LibraryStorage instance.
+        """
+        self.directory = directory
+        self.book_list = book_list
+        self.user_list = user_list
+        self.loans = loans
+        self.sync_interval = sync_interval
+        self.snapshot_every = snapshot_every
+        self.lsn = 0  # sequence number of the last logged record
+        self._snapshot_lsn = 0
+        self._log_file = None
+        self._dirty = False
+        self._closed = False
+        self._lock = threading.Lock()
+        self._sync_event = threading.Event()
+        self._sync_thread = None
+        self._snapshot_thread = None
+
+    # Recovery
+
+    def open(self):
+        """
+        Restore the library from disk, then start logging every change to it.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self._snapshot_lsn = self._load_latest_snapshot()
+        self.lsn = self._replay_log(self._snapshot_lsn)
+        self._start_segment()
+        self.book_list.add_observer(self._on_book_event)
+        self.user_list.add_observer(self._on_user_event)
+        self.loans.add_observer(self._on_loan_event)
+        self._sync_thread = threading.Thread(target=self._sync_loop, name="wal-sync", daemon=True)
+        self._sync_thread.start()
+
+    def _files(self, prefix, suffix):
+        """Return (sequence number, path) for the files with the given prefix, in order."""
+        files = []
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name.endswith(suffix):
+                number = name[len(prefix):-len(suffix)]
+                if number.isdigit():
+                    files.append((int(number), os.path.join(self.directory, name)))
+        return sorted(files)
+
+    def _load_latest_snapshot(self):
+        """Load the newest readable snapshot and return its sequence number."""
+        for lsn, path in reversed(self._files(SNAPSHOT_PREFIX, ".json")):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue
+            self._restore_state(state)
+            return lsn
+        return 0
+
+    def _restore_state(self, state):
+        """Populate the collections from a snapshot."""
+        for record in state["books"]:
+            self.book_list.add_book(book_from_record(record))
+        for record in state["users"]:
+            self.user_list.add_user(user_from_record(record))
+        for username, book_id, due_date in state["loans"]:
+            self.loans._add_loan(username, book_id, parse_datetime(due_date))
+        for book_id, username, priority, expires_at in state.get("holds", []):
+            self.loans._add_hold(username, book_id, priority, parse_datetime(expires_at))
+
+    def _replay_log(self, after_lsn):
+        """
+        Apply the logged records newer than after_lsn and return the last
+        sequence number seen. A record torn by a crash mid-write can only be
+        the last one in the log; it is cut off so that new records start on a
+        line of their own. An unreadable record anywhere else is corruption.
+        """
+        last_lsn = after_lsn
+        segments = self._files(LOG_PREFIX, ".log")
+        for _, path in segments:
+            torn_at = None
+            with open(path, "rb") as f:
+                offset = 0
+                for number, line in enumerate(f, 1):
+                    record = self._parse_record(line)
+                    if record is None:
+                        if f.read(1) or path != segments[-1][1]:
+                            raise ValueError(f"Corrupt log record in {path} at line {number}")
+                        torn_at = offset
+                        break
+                    offset += len(line)
+                    if record["lsn"] <= after_lsn:
+                        continue
+                    self._apply(record)
+                    last_lsn = record["lsn"]
+            if torn_at is not None:
+                with open(path, "r+b") as f:
+                    f.truncate(torn_at)
+                    os.fsync(f.fileno())
+        return last_lsn
+
+    @staticmethod
+    def _parse_record(line):
+        """Decode one log line, or return None if it is not a whole record."""
+        if not line.endswith(b"\n"):
+            return None
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+
+    def _apply(self, record):
+        """
+        Re-apply one logged mutation. Replay is idempotent so that a change
+        captured by a snapshot and also logged after it is not applied twice.
+        """
+        op = record["op"]
+        if op == "add_book":
+            if record["book"]["book_id"] not in self.book_list.books:
+                self.book_list.add_book(book_from_record(record["book"]))
+        elif op == "remove_book":
+            book = self.book_list.books.get(record["book_id"])
+            if book is not None:
+                self.book_list._remove_book(book)
+        elif op == "update_book":
+            book = self.book_list.books.get(record["book_id"])
+            if book is not None:
+                field = record["field"]
+                getattr(book, "set_" + field)(decode_value(field, record["value"]))
+        elif op == "add_user":
+            if record["user"]["username"] not in self.user_list.users:
+                self.user_list.add_user(user_from_record(record["user"]))
+        elif op == "remove_user":
+            user = self.user_list.users.get(record["username"])
+            if user is not None:
+                self.user_list._remove_user(user)
+        elif op == "update_user":
+            user = self.user_list.users.get(record["username"])
+            if user is not None:
+                field = record["field"]
+                getattr(user, "set_" + field)(decode_value(field, record["value"]))
+        elif op == "borrow_book":
+            self._replay_borrow(record["username"], record["book_id"], parse_datetime(record["due_date"]))
+        elif op == "return_book":
+            self._replay_return(record["username"], record["book_id"])
+        elif op == "borrow_many":
+            due_date = parse_datetime(record["due_date"])
+            for username, book_id in record["loans"]:
+                self._replay_borrow(username, book_id, due_date)
+        elif op == "return_many":
+            for username, book_id in record["loans"]:
+                self._replay_return(username, book_id)
+        elif op == "place_hold":
+            self.loans._add_hold(record["username"], record["book_id"], record["priority"],
+                                 parse_datetime(record["expires_at"]))
+        elif op == "cancel_hold":
+            self.loans._remove_hold(record["username"], record["book_id"])
+        else:
+            raise ValueError(f"Unknown log record: {op}")
+
+    def _replay_borrow(self, username, book_id, due_date):
+        """Re-apply a logged loan unless it is already in place."""
+        if book_id not in self.loans.loans.get(username, {}):
+            self.loans._add_loan(username, book_id, due_date)
+            book = self.book_list.books.get(book_id)
+            if book is not None:
+                book._change_available(-1)
+
+    def _replay_return(self, username, book_id):
+        """Re-apply a logged return unless the loan is already gone."""
+        if book_id in self.loans.loans.get(username, {}):
+            self.loans._remove_loan(username, book_id)
+            book = self.book_list.books.get(book_id)
+            if book is not None:
+                book._change_available(1)
+
+    # Logging
+
+    def _on_book_event(self, event, data):
+        if event == "add_book":
+            self._append({"op": event, "book": book_to_record(data["book"])})
+        elif event == "update_book":
+            field = data["field"]
+            self._append({"op": event, "book_id": data["book_id"], "field": field,
+                          "value": encode_value(field, data["value"])})
+        else:
+            self._append(dict(data, op=event))
+
+    def _on_user_event(self, event, data):
+        if event == "add_user":
+            self._append({"op": event, "user": user_to_record(data["user"])})
+        elif event == "update_user":
+            field = data["field"]
+            self._append({"op": event, "username": data["username"], "field": field,
+                          "value": encode_value(field, data["value"])})
+        else:
+            self._append(dict(data, op=event))
+
+    def _on_loan_event(self, event, data):
+        if event in ("borrow_many", "return_many"):
+            # A batch is one record so that recovery applies all of it or none of it.
+            record = {"op": event, "loans": [list(loan) for loan in data["loans"]]}
+        else:
+            record = {"op": event, "username": data["username"], "book_id": data["book_id"]}
+        if "due_date" in data:
+            record["due_date"] = format_datetime(data["due_date"])
+        if event == "place_hold":
+            record["priority"] = data["priority"]
+            record["expires_at"] = format_datetime(data["expires_at"])
+        self._append(record)
+
+    def _append(self, record):
+        """Assign the next sequence number to a record and append it to the log."""
+        with self._lock:
+            if self._closed:
+                raise ValueError("Storage has been closed")
+            self.lsn += 1
+            record["lsn"] = self.lsn
+            self._log_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self._dirty = True
+            if self.lsn - self._snapshot_lsn >= self.snapshot_every:
+                self._begin_snapshot()
+
+    def _start_segment(self):
+        """Open a new log segment for records after the current sequence number."""
+        path = os.path.join(self.directory, f"{LOG_PREFIX}{self.lsn + 1:012d}.log")
+        self._log_file = open(path, "a", encoding="utf-8")
+
+    def _sync_loop(self):
+        """Background thread: fsync buffered log records in batches."""
+        while not self._sync_event.wait(self.sync_interval):
+            self.sync()
+
+    def sync(self):
+        """
+        Flush and fsync any log records written since the last sync.
+        """
+        with self._lock:
+            if not self._dirty or self._log_file is None:
+                return
+            self._log_file.flush()
+            os.fsync(self._log_file.fileno())
+            self._dirty = False
+
+    # Snapshots
+
+    def _capture_state(self):
+        """
+        Return the library state as a JSON-serialisable dict. Loans, holds and
+        copy counts are copied while no loan change is half-applied; the state
+        may include changes logged after the snapshot's sequence number, which
+        replay skips or re-applies harmlessly.
+        """
+        with self.loans.locked():
+            loans, holds = self.loans.snapshot()
+            books = [(book, book.available_copies, book.times_borrowed) for book in list(self.book_list.books.values())]
+        records = []
+        for book, available_copies, times_borrowed in books:
+            record = book_to_record(book)
+            record["available_copies"] = available_copies
+            record["times_borrowed"] = times_borrowed
+            records.append(record)
+        return {
+            "books": records,
+            "users": [user_to_record(user) for user in list(self.user_list.users.values())],
+            "loans": [[username, book_id, format_datetime(due_date)] for username, book_id, due_date in loans],
+            "holds": [[book_id, username, priority, format_datetime(expires_at)]
+                      for book_id, username, priority, expires_at in holds],
+        }
+
+    def _begin_snapshot(self):
+        """
+        Roll over to a new log segment and capture and write the snapshot of
+        everything logged so far in the background. Must be called with the lock held.
+        """
+        if self._snapshot_thread is not None and self._snapshot_thread.is_alive():
+            return
+        lsn = self.lsn
+        self._log_file.flush()
+        os.fsync(self._log_file.fileno())
+        self._log_file.close()
+        self._dirty = False
+        self._start_segment()
+        self._snapshot_lsn = lsn
+        self._snapshot_thread = threading.Thread(target=self._write_snapshot, args=(lsn,),
+                                                 name="wal-snapshot", daemon=True)
+        self._snapshot_thread.start()
+
+    def _write_snapshot(self, lsn):
+        """Capture the state, write it atomically as a snapshot, then delete the files it supersedes."""
+        state = self._capture_state()
+        path = os.path.join(self.directory, f"{SNAPSHOT_PREFIX}{lsn:012d}.json")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        for old_lsn, old_path in self._files(SNAPSHOT_PREFIX, ".json"):
+            if old_lsn < lsn:
+                os.remove(old_path)
+        for first_lsn, old_path in self._files(LOG_PREFIX, ".log"):
+            if first_lsn <= lsn:
+                os.remove(old_path)
+
+    def snapshot(self):
+        """
+        Write a snapshot of the current state now and wait for it to finish.
+        """
+        while True:
+            # Wait for a running snapshot without the lock: it may need loan
+            # locks held by a writer that is waiting to log.
+            with self._lock:
+                thread = self._snapshot_thread
+                if thread is None or not thread.is_alive():
+                    self._begin_snapshot()
+                    thread = self._snapshot_thread
+                    break
+            thread.join()
+        thread.join()
+
+    def close(self):
+        """
+        Stop logging, sync the log to disk and wait for any pending snapshot.
+        """
+        self._sync_event.set()
+        if self._sync_thread is not None:
+            self._sync_thread.join()
+        self.sync()
+        with self._lock:
+            self._closed = True
+            if self._log_file is not None:
+                self._log_file.close()
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+        self.book_list.remove_observer(self._on_book_event)
+        self.user_list.remove_observer(self._on_user_event)
+        self.loans.remove_observer(self._on_loan_event)
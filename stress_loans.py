@@ -0,0 +1,124 @@
+import argparse
+import random
+import sys
+import threading
+import time
+
+from benchmark import make_book, make_user
+from book_management import Loans, UserList
+
+
+def _worker(loans, users, books, operations, seed):
+    """Borrow, return, hold and batch-lend random books until the operations run out."""
+    rng = random.Random(seed)
+    for _ in range(operations):
+        user, book = rng.choice(users), rng.choice(books)
+        action = rng.random()
+        try:
+            if action < 0.4:
+                loans.borrow_book(user, book)
+            elif action < 0.75:
+                loans.return_book(user, book)
+            elif action < 0.85:
+                loans.borrow_many([(user, other) for other in rng.sample(books, 3)])
+            elif action < 0.95:
+                loans.return_many([(user, other) for other in rng.sample(books, 3)])
+            elif action < 0.98:
+                loans.place_hold(user, book, priority=rng.randint(0, 2))
+            else:
+                loans.cancel_hold(user, book)
+        except ValueError:
+            pass
+
+
+def check_invariants(loans, users, books, user_list):
+    """
+    Return a list of the ways the loan state disagrees with itself: a book
+    with negative or too many available copies, available plus lent copies
+    that differ from the book's number of copies, a holder index or loan
+    count that does not match the loans, or a due-date index that has lost
+    or gained loans.
+    """
+    problems = []
+    lent = {book.book_id: set() for book in books}
+    total = 0
+    for user in users:
+        held = loans.loans.get(user.get_username(), {})
+        total += len(held)
+        if loans.get_user_loan_count(user) != len(held):
+            problems.append(f"{user.get_username()}: loan count {loans.get_user_loan_count(user)} != {len(held)}")
+        for book_id in held:
+            lent[book_id].add(user.get_username())
+    for book in books:
+        available, copies = book.get_available_copies(), book.get_num_copies()
+        holders = lent[book.book_id]
+        if not 0 <= available <= copies:
+            problems.append(f"{book.book_id}: {available} of {copies} copies available")
+        if available + len(holders) != copies:
+            problems.append(f"{book.book_id}: {available} available + {len(holders)} lent != {copies} copies")
+        if set(loans.get_book_holders(book)) != holders:
+            problems.append(f"{book.book_id}: holder index disagrees with the loans")
+        if loans.is_on_loan(book) != bool(holders):
+            problems.append(f"{book.book_id}: is_on_loan is {loans.is_on_loan(book)} with {len(holders)} holders")
+    indexed = len(loans.get_books_due_within(3650, user_list))
+    if indexed != total:
+        problems.append(f"due-date index holds {indexed} loans, the loan map {total}")
+    return problems
+
+
+def stress_loans(threads=8, operations=5_000, num_books=20, num_users=50, compact=False, seed=0):
+    """
+    Run borrow/return traffic from several threads against a small library,
+    where few copies make the threads contend for the same books, then check
+    the invariants. Returns a report with the throughput and any problems.
+    """
+    rng = random.Random(seed)
+    user_list = UserList()
+    user_list.add_users(make_user(rng, f"stress{i}") for i in range(num_users))
+    users = list(user_list.users.values())
+    books = [make_book(rng) for _ in range(num_books)]
+    loans = Loans(compact=compact)
+
+    workers = [threading.Thread(target=_worker, args=(loans, users, books, operations, seed + i))
+               for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "threads": threads,
+        "operations": threads * operations,
+        "ops_per_second": threads * operations / elapsed,
+        "loans": sum(len(held) for held in loans.loans.values()),
+        "problems": check_invariants(loans, users, books, user_list),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that concurrent borrowing never breaks the loan invariants")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--operations", type=int, default=5_000, help="operations per thread")
+    parser.add_argument("--books", type=int, default=20)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=5, help="independent runs, each with its own seed")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    failed = False
+    for compact in (False, True):
+        for round_number in range(args.rounds):
+            report = stress_loans(args.threads, args.operations, args.books, args.users, compact,
+                                  args.seed + round_number * args.threads)
+            layout = "compact" if compact else "dict"
+            print(f"{layout:8} round {round_number}: {report['ops_per_second']:10.0f} ops/s, "
+                  f"{report['loans']} loans left, {len(report['problems'])} problems")
+            for problem in report["problems"]:
+                print(f"  {problem}")
+            failed = failed or bool(report["problems"])
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
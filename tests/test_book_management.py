@@ -0,0 +1,33 @@
+import os
+import sys
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from book_management import Book, BookList, User, UserList
+
+
+class SearchTest(unittest.TestCase):
+
+    def test_a_publication_date_search_matches_only_the_exact_date(self):
+        book_list = BookList()
+        book_list.add_book(Book("Title", "Author", 2000, "Publisher", 1, datetime(2000, 1, 1)))
+        self.assertEqual(len(book_list.search_book("2000-01-01", "publication_date")), 1)
+        self.assertEqual(book_list.search_book("2000-1-1", "publication_date"), [])
+        self.assertEqual(book_list.search_book("not a date", "publication_date"), [])
+
+
+class UserTest(unittest.TestCase):
+
+    def test_a_numeric_postcode_is_stored_as_text_and_indexed(self):
+        user_list = UserList()
+        user = User("alice", "Alice", "Smith", "1", "High Street", 12345, "alice@example.com",
+                    datetime(1990, 1, 1))
+        user_list.add_user(user)
+        self.assertEqual(user.get_postcode(), "12345")
+        self.assertEqual(user_list.find_users(postcode="12345"), [user])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from book_management import Book, BookList, Loans, User, UserList
+from storage import LOG_PREFIX, LibraryStorage
+
+
+class RecoveryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def open_library(self, snapshot_every=10000):
+        """Recover a library from the test directory and start logging to it."""
+        book_list, user_list, loans = BookList(), UserList(), Loans()
+        storage = LibraryStorage(self.directory, book_list, user_list, loans, sync_interval=60,
+                                 snapshot_every=snapshot_every)
+        storage.open()
+        self.user_list, self.loans = user_list, loans
+        return book_list, storage
+
+    def add_books(self, book_list, *titles):
+        for title in titles:
+            book_list.add_book(Book(title, "Author", 2000, "Publisher", 1, datetime(2000, 1, 1)))
+
+    def last_segment(self):
+        return max(name for name in os.listdir(self.directory) if name.startswith(LOG_PREFIX))
+
+    def test_writes_after_a_torn_record_survive_the_next_recovery(self):
+        book_list, storage = self.open_library()
+        self.add_books(book_list, "First", "Second")
+        storage.close()
+        # Crash while writing the first record of the next session's segment,
+        # which recovery reopens for the records it logs next.
+        book_list, storage = self.open_library()
+        storage.close()
+        with open(os.path.join(self.directory, self.last_segment()), "ab") as f:
+            f.write(b'{"op":"add_book","bo')
+
+        book_list, storage = self.open_library()
+        self.assertEqual(book_list.get_total_books(), 2)
+        self.add_books(book_list, "Third", "Fourth")
+        storage.close()
+
+        book_list, storage = self.open_library()
+        titles = sorted(book.get_title() for book in book_list.books.values())
+        storage.close()
+        self.assertEqual(titles, ["First", "Fourth", "Second", "Third"])
+
+    def test_a_corrupt_record_before_the_end_of_the_log_is_an_error(self):
+        book_list, storage = self.open_library()
+        self.add_books(book_list, "First")
+        storage.close()
+        path = os.path.join(self.directory, self.last_segment())
+        with open(path, "rb") as f:
+            record = f.read()
+        with open(path, "wb") as f:
+            f.write(b"not json\n" + record)
+
+        with self.assertRaises(ValueError):
+            self.open_library()
+
+    def test_snapshots_taken_during_concurrent_loans_recover_the_same_state(self):
+        book_list, storage = self.open_library(snapshot_every=25)
+        for i in range(20):
+            book_list.add_book(Book(f"Book {i}", "Author", 2000, "Publisher", 2, datetime(2000, 1, 1)))
+        for i in range(30):
+            self.user_list.add_user(User(f"user{i}", "First", "Last", "1", "High Street", "AB1 2CD",
+                                         f"user{i}@example.com", datetime(1990, 1, 1)))
+        books = list(book_list.books.values())
+        users = list(self.user_list.users.values())
+        loans = self.loans
+        errors = []
+
+        def worker(seed):
+            rng = random.Random(seed)
+            for _ in range(400):
+                user, book = rng.choice(users), rng.choice(books)
+                try:
+                    if rng.random() < 0.6:
+                        loans.borrow_book(user, book)
+                    else:
+                        loans.return_book(user, book)
+                except ValueError:
+                    pass
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        storage.close()
+        self.assertEqual(errors, [])
+        expected_loans = sorted(loans.snapshot()[0])
+        expected_available = {book.book_id: book.get_available_copies() for book in books}
+
+        book_list, storage = self.open_library()
+        storage.close()
+        self.assertEqual(sorted(self.loans.snapshot()[0]), expected_loans)
+        self.assertEqual({book.book_id: book.get_available_copies() for book in book_list.books.values()},
+                         expected_available)
+        self.assertTrue(any(name.startswith("snapshot-") for name in os.listdir(self.directory)))
+
+
+if __name__ == "__main__":
+    unittest.main()